@@ -2,17 +2,21 @@
 The sea sub compiler entry point.
 """
 import os
+import sys
 
 import argparse
 import pathlib
 
-from seasub import seasub
+from seasub import x86
 
 _DEFAULT_OPTIMIZATION_LEVEL = 1
+_DEFAULT_MAX_ERRORS = 20
 
 
 def main():
-    optimization_levels = {0: "No optimization", 1: "Constant folding"}
+    # The descriptions of the pipelines of seasub.pass_manager.PIPELINES, which is not imported to keep --help fast.
+    optimization_levels = {0: "No optimization", 1: "Constant folding, block layout and loop optimizations",
+                           2: "As 1, and interprocedural constant propagation and dead code elimination"}
     optimization_level_help = "\n".join(f"\t{level}: {description}"
                                         for level, description in optimization_levels.items())
     parser = argparse.ArgumentParser(description="A compiler for the Sea Sub (C subset) language.",
@@ -21,17 +25,113 @@ def main():
                         help="the c source file to be compiled, output is stored in the same location with '.s' ending")
     parser.add_argument('-o',
                         help=f"optimization level (default {_DEFAULT_OPTIMIZATION_LEVEL})\n{optimization_level_help}",
-                        dest='optimization_level', type=int, metavar='N', default=_DEFAULT_OPTIMIZATION_LEVEL)
+                        dest='optimization_level', type=int, metavar='N', default=_DEFAULT_OPTIMIZATION_LEVEL,
+                        choices=list(optimization_levels))
+    parser.add_argument('--pass-stats', action='store_true',
+                        help=("print the time spent, the number of nodes or quadruples changed and the size of the\n"
+                              "code before and after each optimization pass"))
+    parser.add_argument('--memoize', action='store_true',
+                        help=("memoize the pure recursive functions, i.e. the calls are looked up in a fixed size\n"
+                              "table of each function before the function body is run (at any optimization level)"))
     parser.add_argument('--ast', type=pathlib.Path, metavar='ast.dot',
-                        help=".dot file to store the abstract syntax tree")
+                        help=".dot (or .jsonl or .graphml) file to store the abstract syntax tree")
     parser.add_argument('--symbol-table', type=pathlib.Path, metavar='symbol-table.dot',
-                        help=".dot file to store the symbol table")
+                        help=".dot (or .jsonl or .graphml) file to store the symbol table")
+    parser.add_argument('--graph-functions', metavar='NAME[,NAME...]',
+                        help="only include these functions in the graphs")
+    parser.add_argument('--graph-depth', type=int, metavar='N',
+                        help="only include the nodes (scopes) down to depth N in the graphs")
     parser.add_argument('--save-intermediate-code', action='store_true', help="save the intermediate code")
+    parser.add_argument('--omit-frame-pointer', action='store_true',
+                        help="address the stack frame relative to the stack pointer instead of a frame pointer")
+    parser.add_argument('--march', choices=[*x86.ARCHITECTURES, 'native'], default='x86-64',
+                        help=("the target architecture, decides the instruction set extensions used by the vectorizer\n"
+                              "(default x86-64, native detects the features of this machine)"))
+    parser.add_argument('-c', action='store_true', dest='object',
+                        help="assemble into an (ELF) object file with '.o' ending instead of an assembly file")
+    parser.add_argument('--run', action='store_true',
+                        help=("compile into memory and run the program in the compiler's process (no files are\n"
+                              "written), the exit status is the value returned by main"))
+    parser.add_argument('--interpret', action='store_true',
+                        help=("run the program in the intermediate code interpreter instead of generating target code\n"
+                              "(no files are written), the exit status is the value returned by main"))
+    profile_group = parser.add_mutually_exclusive_group()
+    profile_group.add_argument('--profile-generate', action='store_true',
+                               help=("instrument the program to count how many times each basic block is executed,\n"
+                                     "the counts are appended to the profile file each time main returns"))
+    profile_group.add_argument('--profile-use', action='store_true',
+                               help=("use the counts of the profile file to guide the block layout and inlining\n"
+                                     "(requires the same source code and options as the instrumented program)"))
+    parser.add_argument('--profile-file', type=pathlib.Path, metavar='file.profile',
+                        help="the profile file (default the input file with '.profile' ending)")
+    parser.add_argument('-j', dest='jobs', type=int, metavar='N', default=1,
+                        help=("compile the functions in N parallel processes (default 1, 0 uses all processors), the\n"
+                              "output is the same for any N"))
+    parser.add_argument('--max-errors', type=int, metavar='N', default=_DEFAULT_MAX_ERRORS,
+                        help=(f"stop after N errors (default {_DEFAULT_MAX_ERRORS}, 0 reports all errors), --stream "
+                              "stops at the first error"))
+    parser.add_argument('--diagnostics-format', choices=['text', 'json', 'ndjson'], default='text',
+                        help=("the format of the errors and warnings (default text), json is an array and ndjson one\n"
+                              "line of the diagnostics as objects with their severity, kind, code, file, line, column\n"
+                              "and message"))
+    parser.add_argument('--stream', action='store_true',
+                        help=("compile one function at a time, each function is written before the next is parsed\n"
+                              "(the memory usage does not grow with the number of functions, can't be combined with\n"
+                              "-o 2, the graphs, profiles, -j, --run, --interpret or --memoize)"))
     args = parser.parse_args()
-    seasub.run(args.input, f'{os.path.splitext(args.input)[0]}.s', args.optimization_level,
+    from seasub import seasub  # Imported after the arguments are parsed, e.g. --help does not need the compiler.
+    if args.stream and (args.optimization_level == 2 or args.ast or args.symbol_table or args.profile_generate or
+                        args.profile_use or args.jobs != 1 or args.run or args.interpret or args.memoize):
+        parser.error("--stream can't be combined with -o 2, the graphs, profiles, -j, --run, --interpret or --memoize")
+    for graph_path in (args.ast, args.symbol_table):
+        if graph_path and graph_path.suffix not in ('.dot', '.jsonl', '.graphml'):
+            parser.error(f"unknown graph format of '{graph_path}' (expected .dot, .jsonl or .graphml)")
+    profile_file = args.profile_file or f'{os.path.splitext(args.input)[0]}.profile'
+    profile_generate = profile_file if args.profile_generate else None
+    profile_use = profile_file if args.profile_use else None
+    max_errors = args.max_errors or None
+    if args.interpret:
+        sys.exit(seasub.interpret(args.input, args.optimization_level, architecture=args.march,
+                                  profile_generate=profile_generate, profile_use=profile_use, jobs=args.jobs,
+                                  max_errors=max_errors, diagnostics_format=args.diagnostics_format,
+                                  pass_stats=args.pass_stats, memoize=args.memoize) % 256)
+    if args.run:
+        sys.exit(seasub.execute(args.input, args.optimization_level,
+                                omit_frame_pointer=args.omit_frame_pointer,
+                                architecture=args.march,
+                                profile_generate=profile_generate,
+                                profile_use=profile_use,
+                                jobs=args.jobs,
+                                max_errors=max_errors,
+                                diagnostics_format=args.diagnostics_format,
+                                pass_stats=args.pass_stats,
+                                memoize=args.memoize) % 256)
+    extension = '.o' if args.object else '.s'
+    if args.stream:
+        seasub.run_stream(args.input, f'{os.path.splitext(args.input)[0]}{extension}', args.optimization_level,
+                          save_intermediate_code=args.save_intermediate_code,
+                          omit_frame_pointer=args.omit_frame_pointer,
+                          architecture=args.march,
+                          output_format='object' if args.object else 'assembly',
+                          diagnostics_format=args.diagnostics_format,
+                          pass_stats=args.pass_stats)
+        return
+    seasub.run(args.input, f'{os.path.splitext(args.input)[0]}{extension}', args.optimization_level,
                ast_graph_path=args.ast,
                symbol_table_graph_path=args.symbol_table,
-               save_intermediate_code=args.save_intermediate_code)
+               graph_functions=args.graph_functions.split(',') if args.graph_functions else None,
+               graph_depth=args.graph_depth,
+               save_intermediate_code=args.save_intermediate_code,
+               omit_frame_pointer=args.omit_frame_pointer,
+               architecture=args.march,
+               output_format='object' if args.object else 'assembly',
+               profile_generate=profile_generate,
+               profile_use=profile_use,
+               jobs=args.jobs,
+               max_errors=max_errors,
+               diagnostics_format=args.diagnostics_format,
+               pass_stats=args.pass_stats,
+               memoize=args.memoize)
 
 
 if __name__ == "__main__":
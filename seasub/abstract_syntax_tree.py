@@ -4,14 +4,19 @@ The abstract syntax tree of the sea sub compiler.
 import abc
 
 
-def save_graph(symbol_table, file_path):
-    _Graph().save(symbol_table, file_path)
+def save_graph(abstract_syntax_tree, file_path, functions=None, depth=None):
+    # Writes the graph in the format of the file extension (see the graph module). The nodes are numbered in the order
+    # they are visited, so the same tree always gets the same node ids. Only the given functions (names) are included
+    # if any, and only the nodes down to the given depth (the translation unit is at depth zero) if any.
+    from seasub import graph  # Imported when used, like the other optional stages.
+    with graph.open_graph(file_path, 'abstractsyntaxtree') as writer:
+        _Graph(writer, functions, depth).visit(abstract_syntax_tree)
 
 
 def _get_nodes():
     return (NoOperation, TranslationUnit, FunctionDefinition, Parameter, FunctionCall,
-            ReturnStatement, CompoundStatement, Declaration, Assignment, IfStatement,
-            BinaryOperator, UnaryOperator, Identifier, IntegerConstant, RealConstant)
+            ReturnStatement, CompoundStatement, Declaration, Assignment, IfStatement, WhileStatement,
+            ForStatement, BinaryOperator, UnaryOperator, Subscript, Identifier, IntegerConstant, RealConstant)
 
 
 class NodeVisitor:
@@ -39,6 +44,7 @@ class AbstractSyntaxTreeNode(abc.ABC):
     def __init__(self, token):
         self._token = token
         self._symbol_table = None
+        self._symbol = None
 
     @property
     def token(self):
@@ -52,6 +58,14 @@ class AbstractSyntaxTreeNode(abc.ABC):
     def symbol_table(self, value):
         self._symbol_table = value
 
+    @property
+    def symbol(self):
+        return self._symbol
+
+    @symbol.setter
+    def symbol(self, value):
+        self._symbol = value
+
     @abc.abstractmethod
     def get_children(self):
         ...
@@ -76,6 +90,10 @@ class TranslationUnit(AbstractSyntaxTreeNode):
         super().__init__(token)
         self._functions = functions
 
+    @property
+    def functions(self):
+        return self._functions
+
     def __repr__(self):
         return f"TranslationUnit({self._functions})"
 
@@ -203,15 +221,24 @@ class CompoundStatement(AbstractSyntaxTreeNode):
     def __str__(self):
         return "\n".join(f"{str(item)}" for item in self._declarations + self._statements)
 
+    @property
+    def declarations(self):
+        return self._declarations
+
+    @property
+    def statements(self):
+        return self._statements
+
     def get_children(self):
         return self._declarations + self._statements
 
 
 class Declaration(AbstractSyntaxTreeNode):
-    def __init__(self, token, type_specifier, identifier):
+    def __init__(self, token, type_specifier, identifier, length=None):
         super().__init__(token)
         self._type_specifier = type_specifier
         self._identifier = identifier
+        self._length = length
 
     @property
     def type_specifier(self):
@@ -221,26 +248,40 @@ class Declaration(AbstractSyntaxTreeNode):
     def identifier(self):
         return self._identifier
 
+    @property
+    def length(self):
+        return self._length
+
     def __repr__(self):
-        return f"Declaration({self._type_specifier}, {self._identifier})"
+        return f"Declaration({self._type_specifier}, {self._identifier}, {self._length})"
 
     def __str__(self):
-        return f"{str(self._type_specifier)} {str(self._identifier)}"
+        length = f"[{self._length}]" if self._length is not None else ""
+        return f"{str(self._type_specifier)} {str(self._identifier)}{length}"
 
     def get_children(self):
         return []
 
 
 class Assignment(AbstractSyntaxTreeNode):
-    def __init__(self, token, identifier, value):
+    def __init__(self, token, identifier, value, index=None):
         super().__init__(token)
         self._identifier = identifier
         self._value = value
+        self._index = index
 
     @property
     def identifier(self):
         return self._identifier
 
+    @property
+    def index(self):
+        return self._index
+
+    @index.setter
+    def index(self, value):
+        self._index = value
+
     @property
     def value(self):
         return self._value
@@ -250,13 +291,14 @@ class Assignment(AbstractSyntaxTreeNode):
         self._value = value
 
     def __repr__(self):
-        return f"Assignment({repr(self._identifier)}, {repr(self._value)})"
+        return f"Assignment({repr(self._identifier)}, {repr(self._value)}, {repr(self._index)})"
 
     def __str__(self):
-        return f"{self._identifier} = {self._value}"
+        index = f"[{self._index}]" if self._index is not None else ""
+        return f"{self._identifier}{index} = {self._value}"
 
     def get_children(self):
-        return [self._value]
+        return [self._value] if self._index is None else [self._index, self._value]
 
 
 class IfStatement(AbstractSyntaxTreeNode):
@@ -292,6 +334,83 @@ class IfStatement(AbstractSyntaxTreeNode):
         return [self._predicate, self._consequent, self._alternative]
 
 
+class WhileStatement(AbstractSyntaxTreeNode):
+    def __init__(self, token, predicate, body):
+        super().__init__(token)
+        self._predicate = predicate
+        self._body = body
+
+    @property
+    def predicate(self):
+        return self._predicate
+
+    @predicate.setter
+    def predicate(self, value):
+        self._predicate = value
+
+    @property
+    def body(self):
+        return self._body
+
+    def __repr__(self):
+        return f"WhileStatement({repr(self._predicate)}, {repr(self._body)})"
+
+    def __str__(self):
+        return f"while ({self._predicate})\n{self._body}"
+
+    def get_children(self):
+        return [self._predicate, self._body]
+
+
+class ForStatement(AbstractSyntaxTreeNode):
+    def __init__(self, token, initialization, predicate, step, body):
+        super().__init__(token)
+        self._initialization = initialization
+        self._predicate = predicate
+        self._step = step
+        self._body = body
+        self._vectorization = None
+
+    @property
+    def initialization(self):
+        return self._initialization
+
+    @property
+    def predicate(self):
+        return self._predicate
+
+    @predicate.setter
+    def predicate(self, value):
+        self._predicate = value
+
+    @property
+    def step(self):
+        return self._step
+
+    @property
+    def body(self):
+        return self._body
+
+    @property
+    def vectorization(self):
+        # Set by the optimizer to the vector width, predicate and step of a vectorized loop.
+        return self._vectorization
+
+    @vectorization.setter
+    def vectorization(self, value):
+        self._vectorization = value
+
+    def __repr__(self):
+        return (f"ForStatement({repr(self._initialization)}, {repr(self._predicate)}, {repr(self._step)}, "
+                f"{repr(self._body)})")
+
+    def __str__(self):
+        return f"for ({self._initialization}; {self._predicate}; {self._step})\n{self._body}"
+
+    def get_children(self):
+        return [self._initialization, self._predicate, self._step, self._body]
+
+
 class BinaryOperator(AbstractSyntaxTreeNode):
     def __init__(self, token, operator, a, b):
         super().__init__(token)
@@ -307,10 +426,18 @@ class BinaryOperator(AbstractSyntaxTreeNode):
     def a(self):
         return self._a
 
+    @a.setter
+    def a(self, value):
+        self._a = value
+
     @property
     def b(self):
         return self._b
 
+    @b.setter
+    def b(self, value):
+        self._b = value
+
     def __repr__(self):
         return f"BinaryOperator({repr(self._operator)}, {repr(self._a)}, {repr(self._b)})"
 
@@ -335,6 +462,10 @@ class UnaryOperator(AbstractSyntaxTreeNode):
     def a(self):
         return self._a
 
+    @a.setter
+    def a(self, value):
+        self._a = value
+
     def __repr__(self):
         return f"UnaryOperator({repr(self._operator)}, {repr(self._a)})"
 
@@ -345,6 +476,34 @@ class UnaryOperator(AbstractSyntaxTreeNode):
         return [self._a]
 
 
+class Subscript(AbstractSyntaxTreeNode):
+    def __init__(self, token, identifier, index):
+        super().__init__(token)
+        self._identifier = identifier
+        self._index = index
+
+    @property
+    def identifier(self):
+        return self._identifier
+
+    @property
+    def index(self):
+        return self._index
+
+    @index.setter
+    def index(self, value):
+        self._index = value
+
+    def __repr__(self):
+        return f"Subscript({repr(self._identifier)}, {repr(self._index)})"
+
+    def __str__(self):
+        return f"{self._identifier}[{self._index}]"
+
+    def get_children(self):
+        return [self._identifier, self._index]
+
+
 class Identifier(AbstractSyntaxTreeNode):
     def __init__(self, token, name):
         super().__init__(token)
@@ -411,65 +570,82 @@ class RealConstant(AbstractSyntaxTreeNode):
 
 
 class _Graph(NodeVisitor):
-    def __init__(self):
+    def __init__(self, writer, functions, depth):
         super().__init__()
-        self._connections = None
-
-    def save(self, abstract_syntax_tree, file_path):
-        self._connections = []
-        self.visit(abstract_syntax_tree)
-        internal = "\n".join(self._connections)
-        graph = f"digraph abstractsyntaxtree {{ {internal} }}"
-        with open(file_path, 'w') as file:
-            file.write(graph)
+        self._writer = writer
+        self._functions = None if functions is None else set(functions)
+        self._max_depth = depth
+        self._depth = 0
+        self._node_count = 0
+        self._parent_id = None
 
     def _visit_NoOperation(self, node):
-        self._add_connections(node, "NOP")
+        self._add_node(node, "NOP")
 
     def _visit_TranslationUnit(self, node):
-        self._add_connections(node, "Translation unit")
+        functions = node.get_children()
+        if self._functions is not None:
+            functions = [function for function in functions if function.identifier in self._functions]
+        self._add_node(node, "Translation unit", functions)
 
     def _visit_FunctionDefinition(self, node):
-        self._add_connections(node, f"{node.identifier}()")
+        self._add_node(node, f"{node.identifier}()")
 
     def _visit_Parameter(self, node):
-        self._add_connections(node, f"{node.type_specifier} {node.identifier}")
+        self._add_node(node, f"{node.type_specifier} {node.identifier}")
 
     def _visit_FunctionCall(self, node):
-        self._add_connections(node, "( )")
+        self._add_node(node, "( )")
 
     def _visit_ReturnStatement(self, node):
-        self._add_connections(node, "return")
+        self._add_node(node, "return")
 
     def _visit_CompoundStatement(self, node):
-        self._add_connections(node, "{ }")
+        self._add_node(node, "{ }")
 
     def _visit_Declaration(self, node):
-        self._add_connections(node, f"{node.type_specifier} {node.identifier}")
+        self._add_node(node, str(node))
 
     def _visit_Assignment(self, node):
-        self._add_connections(node, f"{node.identifier} = ")
+        self._add_node(node, f"{node.identifier}[ ] = " if node.index is not None else f"{node.identifier} = ")
 
     def _visit_IfStatement(self, node):
-        self._add_connections(node, "if")
+        self._add_node(node, "if")
+
+    def _visit_WhileStatement(self, node):
+        self._add_node(node, "while")
+
+    def _visit_ForStatement(self, node):
+        self._add_node(node, "for")
 
     def _visit_BinaryOperator(self, node):
-        self._add_connections(node, f"{node.operator}")
+        self._add_node(node, f"{node.operator}")
 
     def _visit_UnaryOperator(self, node):
-        self._add_connections(node, f"{node.operator}")
+        self._add_node(node, f"{node.operator}")
+
+    def _visit_Subscript(self, node):
+        self._add_node(node, "[ ]")
 
     def _visit_Identifier(self, node):
-        self._add_connections(node, f"{node.name}")
+        self._add_node(node, f"{node.name}")
 
     def _visit_IntegerConstant(self, node):
-        self._add_connections(node, f"{node.value}")
+        self._add_node(node, f"{node.value}")
 
     def _visit_RealConstant(self, node):
-        self._add_connections(node, f"{node.value}")
-
-    def _add_connections(self, node, label):
-        self._connections.append(f'node{id(node)} [label="{label}"]')
-        self._generic_visit(node)
-        for child in node.get_children():
-            self._connections.append(f"node{id(node)} -> node{id(child)};")
+        self._add_node(node, f"{node.value}")
+
+    def _add_node(self, node, label, children=None):
+        node_id = f'n{self._node_count}'
+        self._node_count += 1
+        self._writer.add_node(node_id, label, type(node).__name__, self._parent_id)
+        if self._max_depth is not None and self._depth >= self._max_depth:
+            return
+        parent_id = self._parent_id
+        self._parent_id = node_id
+        self._depth += 1
+        for child in node.get_children() if children is None else children:
+            self.visit(child)
+        self._depth -= 1
+        self._parent_id = parent_id
@@ -0,0 +1,422 @@
+"""
+The assembler of the sea sub compiler.
+
+Encodes the x86-64 instructions of the target code generator into machine code.
+"""
+import struct
+
+from seasub import x86
+
+
+def assemble(target_code):
+    return _Assembler().assemble(target_code)
+
+
+class ObjectCode:
+    # The machine code of a translation unit, the bytes of each section (text, read-only data, data and bss, whose
+    # bytes are all zero). The relocations are 32 bit pc-relative references from the text section to one of the data
+    # sections, (offset in the text, section, offset in the section minus the bytes between the reference and the next
+    # instruction), which are resolved when the sections are placed in memory.
+    def __init__(self, sections, labels, functions, relocations):
+        self._sections = sections
+        self._labels = labels
+        self._functions = functions
+        self._relocations = relocations
+
+    def __repr__(self):
+        sizes = ", ".join(f"{name}: <{len(data)} BYTES>" for name, data in self._sections.items())
+        return f"ObjectCode({sizes}, {list(self._functions)})"
+
+    @property
+    def sections(self):
+        return self._sections
+
+    @property
+    def text(self):
+        return self._sections['.text']
+
+    @property
+    def labels(self):
+        # The offset of each label in the text section.
+        return self._labels
+
+    @property
+    def functions(self):
+        # The offset and size of each global function in the text section.
+        return self._functions
+
+    @property
+    def relocations(self):
+        return self._relocations
+
+
+_DATA_SECTIONS = ('.rodata', '.data', '.bss')
+
+
+class _Assembler:
+    # Four sections are supported, text, read-only data, data and bss. The jumps are encoded with 8 bit displacements if
+    # possible (branch relaxation): all jumps start out short and the ones whose target is out of reach are made long
+    # until no more jumps change. A long jump never becomes short again so this always terminates.
+    def __init__(self):
+        self._sections = None
+        self._current = None
+        self._globals = None
+
+    def assemble(self, target_code):
+        self._sections = {'.text': [], **{name: [] for name in _DATA_SECTIONS}}
+        self._current = self._sections['.text']
+        self._globals = []
+        for item in target_code:
+            if isinstance(item, x86.Instruction):
+                self._add_instruction(item)
+            elif isinstance(item, x86.Label):
+                self._current.append(('label', item.name))
+            else:
+                self._add_directive(item)
+        text = self._sections['.text']
+        long_branches = set(index for index, item in enumerate(text) if item[0] == 'branch' and item[1] == 'call')
+        while True:
+            offsets, labels, _ = _layout(text, long_branches)
+            grown = set(index for index, item in enumerate(text)
+                        if item[0] == 'branch' and index not in long_branches and
+                        not _is_byte(labels[item[2]] - offsets[index] - _branch_size(item[1], False)))
+            if not grown:
+                break
+            long_branches |= grown
+        sections = {}
+        data_labels = {}
+        for name in _DATA_SECTIONS:
+            data_offsets, section_labels, _ = _layout(self._sections[name], set())
+            sections[name] = self._emit(self._sections[name], data_offsets, section_labels, set(), {}, [])
+            data_labels.update({label: (name, offset) for label, offset in section_labels.items()})
+        relocations = []
+        functions = {}
+        sections['.text'] = self._emit(text, offsets, labels, long_branches, data_labels, relocations, functions)
+        return ObjectCode(sections, labels, {name: functions[name] for name in self._globals}, relocations)
+
+    def _add_instruction(self, instruction):
+        if instruction.mnemonic in _BRANCHES or instruction.mnemonic == 'call':
+            self._current.append(('branch', instruction.mnemonic, instruction.operands[0]))
+        else:
+            self._current.append(('code', *_encode(instruction)))
+
+    def _add_directive(self, directive):
+        name, _, argument = directive.partition(' ')
+        if name in ('.text', '.data', '.bss'):
+            self._current = self._sections[name]
+        elif name == '.section':
+            self._current = self._sections[argument]
+        elif name == '.globl':
+            self._globals.append(argument)
+        elif name == '.align':
+            self._current.append(('align', int(argument)))
+        elif name == '.quad':
+            self._current.append(('code', struct.pack('<Q', int(argument, 0)), None))
+        elif name == '.zero':
+            self._current.append(('code', bytes(int(argument, 0)), None))
+        elif name == '.byte':
+            self._current.append(('code', bytes(int(value, 0) for value in argument.split(',')), None))
+        elif name == '.size':
+            self._current.append(('size', argument.split(',')[0]))
+        elif name not in ('.file', '.type'):
+            raise NotImplementedError(f"Unknown directive {directive}")
+
+    @staticmethod
+    def _emit(items, offsets, labels, long_branches, data_labels, relocations, functions=None):
+        output = bytearray()
+        for index, item in enumerate(items):
+            kind = item[0]
+            if kind == 'code':
+                code, reference = item[1], item[2]
+                if reference is not None:  # A rip-relative memory operand.
+                    position, label, trailing = reference
+                    if label in labels:
+                        displacement = labels[label] - (offsets[index] + len(code))
+                        code = code[:position] + struct.pack('<i', displacement) + code[position + 4:]
+                    else:
+                        section, offset = data_labels[label]
+                        relocations.append((offsets[index] + position, section, offset - 4 - trailing))
+                output += code
+            elif kind == 'branch':
+                is_long = index in long_branches
+                displacement = labels[item[2]] - (offsets[index] + _branch_size(item[1], is_long))
+                output += _encode_branch(item[1], displacement, is_long)
+            elif kind == 'align':
+                output += (b'\x90' if functions is not None else b'\x00') * (-len(output) % item[1])
+            elif kind == 'size':
+                functions[item[1]] = (labels[item[1]], offsets[index] - labels[item[1]])
+        return bytes(output)
+
+
+def _layout(items, long_branches):
+    offset = 0
+    offsets = []
+    labels = {}
+    for index, item in enumerate(items):
+        offsets.append(offset)
+        kind = item[0]
+        if kind == 'label':
+            labels[item[1]] = offset
+        elif kind == 'code':
+            offset += len(item[1])
+        elif kind == 'branch':
+            offset += _branch_size(item[1], index in long_branches)
+        elif kind == 'align':
+            offset += -offset % item[1]
+    return offsets, labels, offset
+
+
+def _is_byte(value):
+    return -128 <= value <= 127
+
+
+_CONDITIONS = {'o': 0, 'no': 1, 'b': 2, 'nae': 2, 'c': 2, 'ae': 3, 'nb': 3, 'nc': 3, 'e': 4, 'z': 4, 'ne': 5, 'nz': 5,
+               'be': 6, 'na': 6, 'a': 7, 'nbe': 7, 's': 8, 'ns': 9, 'p': 10, 'pe': 10, 'np': 11, 'po': 11, 'l': 12,
+               'nge': 12, 'ge': 13, 'nl': 13, 'le': 14, 'ng': 14, 'g': 15, 'nle': 15}
+_BRANCHES = {'jmp': None, **{f'j{condition}': code for condition, code in _CONDITIONS.items()}}
+
+
+def _branch_size(mnemonic, is_long):
+    if not is_long:
+        return 2
+    return 6 if mnemonic in _BRANCHES and mnemonic != 'jmp' else 5
+
+
+def _encode_branch(mnemonic, displacement, is_long):
+    if mnemonic == 'call':
+        return b'\xe8' + struct.pack('<i', displacement)
+    condition = _BRANCHES[mnemonic]
+    if not is_long:
+        return bytes([0xeb if condition is None else 0x70 + condition]) + struct.pack('<b', displacement)
+    if condition is None:
+        return b'\xe9' + struct.pack('<i', displacement)
+    return bytes([0x0f, 0x80 + condition]) + struct.pack('<i', displacement)
+
+
+_REGISTERS = {**{name: number for number, name in enumerate(('al', 'cl', 'dl', 'bl'))},
+              **{name: number for number, name in enumerate(('eax', 'ecx', 'edx', 'ebx', 'esp', 'ebp', 'esi', 'edi'))},
+              **{name: number for number, name in enumerate(('rax', 'rcx', 'rdx', 'rbx', 'rsp', 'rbp', 'rsi', 'rdi',
+                                                             'r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15'))},
+              **{f'xmm{number}': number for number in range(16)},
+              **{f'ymm{number}': number for number in range(16)}}
+
+
+def _is_register(operand, name):
+    return isinstance(operand, x86.Register) and operand.name == name
+
+
+def _number(register):
+    return _REGISTERS[register.name]
+
+
+def _encode(instruction):
+    # Returns the bytes of the instruction and its rip-relative reference (if any), as (position of the displacement
+    # in the bytes, label, number of bytes after the displacement).
+    encoder = _ENCODERS.get(instruction.mnemonic)
+    if encoder is None:
+        raise NotImplementedError(f"No encoding of {instruction}")
+    return encoder(*instruction.operands)
+
+
+def _modrm(register_field, operand):
+    # The ModRM byte (and SIB byte and displacement) of a register or memory operand. Returns the REX bits (R, X, B),
+    # the bytes and the rip-relative reference (label, position of the displacement in the bytes).
+    rex = (register_field >> 3) << 2
+    field = (register_field & 7) << 3
+    if isinstance(operand, x86.Register):
+        number = _number(operand)
+        return rex | (number >> 3), bytes([0xc0 | field | (number & 7)]), None
+    if operand.base == x86.RIP:
+        return rex, bytes([field | 5]) + bytes(4), (operand.offset, 1)
+    base = _number(operand.base)
+    rex |= base >> 3
+    offset = operand.offset
+    if offset == 0 and base & 7 != 5:  # rbp (and r13) as base always needs a displacement.
+        mode, displacement = 0, b''
+    elif _is_byte(offset):
+        mode, displacement = 1, struct.pack('<b', offset)
+    else:
+        mode, displacement = 2, struct.pack('<i', offset)
+    if operand.index is None and base & 7 != 4:
+        return rex, bytes([mode << 6 | field | (base & 7)]) + displacement, None
+    # A SIB byte is needed for an index, and for rsp (and r12) as base, in which case the index field is 4 (none).
+    index = 4 if operand.index is None else _number(operand.index)
+    rex |= (index >> 3) << 1
+    scale = 0 if operand.index is None else {1: 0, 2: 1, 4: 2, 8: 3}[operand.scale]
+    return rex, bytes([mode << 6 | field | 4, scale << 6 | (index & 7) << 3 | (base & 7)]) + displacement, None
+
+
+def _code(opcode, register_field, operand, wide=False, prefix=b'', immediate=b''):
+    # Legacy encoding: [prefix] [REX] opcode ModRM [SIB] [displacement] [immediate].
+    rex, modrm, reference = _modrm(register_field, operand)
+    rex_byte = bytes([0x40 | (wide << 3) | rex]) if wide or rex else b''
+    head = prefix + rex_byte + bytes(opcode)
+    if reference is not None:
+        reference = (len(head) + reference[1], reference[0], len(immediate))
+    return head + modrm + immediate, reference
+
+
+def _vex_code(opcode, register, source_register, operand, prefix, opcode_map=1, wide=False):
+    # VEX encoding of the AVX instructions: the prefix, opcode map and the extra (non-destructive) source register are
+    # part of the 2 or 3 byte VEX prefix. A ymm register makes it a 256 bit instruction.
+    rex, modrm, reference = _modrm(_number(register), operand)
+    length = register.name.startswith('ymm')
+    source = 0 if source_register is None else _number(source_register)
+    prefixes = {b'': 0, b'\x66': 1, b'\xf3': 2, b'\xf2': 3}
+    last = (~source & 15) << 3 | length << 2 | prefixes[prefix]
+    if rex & 3 == 0 and opcode_map == 1 and not wide:
+        head = bytes([0xc5, (~rex & 4) << 5 | last])
+    else:
+        head = bytes([0xc4, (~rex & 7) << 5 | opcode_map, wide << 7 | last])
+    head += bytes(opcode)
+    if reference is not None:
+        reference = (len(head) + reference[1], reference[0], 0)
+    return head + modrm, reference
+
+
+def _immediate(value, size, wide=False):
+    # The 4 byte immediate of a 32 bit operation may also be given unsigned (as accepted by GNU as), the immediate of a
+    # 64 bit operation is sign extended so it must be signed.
+    if size == 4 and not wide and value > 0x7fffffff:
+        value -= 2 ** 32
+    return struct.pack({1: '<b', 4: '<i'}[size], value)
+
+
+def _arithmetic(digit, size):
+    # add, or, and, sub and cmp, the opcodes are given by the digit (the operation in the ModRM byte): digit * 8 (+1 if
+    # not 8 bits) for register to r/m, +2 for r/m to register.
+    def encode(source, destination):
+        wide = size == 64
+        if isinstance(source, x86.Immediate):
+            if size == 8 and _is_register(destination, 'al'):  # The short forms of the accumulator.
+                return bytes([digit * 8 + 4]) + _immediate(source.value, 1), None
+            if size == 32 and _is_register(destination, 'eax') and not _is_byte(source.value):
+                return bytes([digit * 8 + 5]) + _immediate(source.value, 4), None
+            if size == 8:
+                return _code([0x80], digit, destination, immediate=_immediate(source.value, 1))
+            if _is_byte(source.value):
+                return _code([0x83], digit, destination, wide, immediate=_immediate(source.value, 1))
+            return _code([0x81], digit, destination, wide, immediate=_immediate(source.value, 4, wide))
+        base = digit * 8 + (0 if size == 8 else 1)
+        if isinstance(source, x86.Register):
+            return _code([base], _number(source), destination, wide)
+        return _code([base + 2], _number(destination), source, wide)
+    return encode
+
+
+def _move(size):
+    def encode(source, destination):
+        wide = size == 64
+        if isinstance(source, x86.Immediate):
+            if isinstance(destination, x86.Register) and not wide:
+                number = _number(destination)
+                rex = bytes([0x41]) if number >= 8 else b''
+                return rex + bytes([0xb8 + (number & 7)]) + _immediate(source.value, 4), None
+            return _code([0xc7], 0, destination, wide, immediate=_immediate(source.value, 4, wide))
+        if isinstance(source, x86.Register):
+            return _code([0x89], _number(source), destination, wide)
+        return _code([0x8b], _number(destination), source, wide)
+    return encode
+
+
+def _load(opcode, wide=False):
+    # Instructions with a register destination and a register or memory source (e.g. lea, movslq, movzbl).
+    def encode(source, destination):
+        return _code(opcode, _number(destination), source, wide)
+    return encode
+
+
+def _unary(opcode, digit, wide=False):
+    # Instructions with one register or memory operand (e.g. neg, idiv, setcc).
+    def encode(operand):
+        return _code(opcode, digit, operand, wide)
+    return encode
+
+
+def _imul(*operands):
+    if len(operands) == 2 and not isinstance(operands[0], x86.Immediate):  # imull r/m, register
+        return _code([0x0f, 0xaf], _number(operands[1]), operands[0])
+    constant, source, destination = operands if len(operands) == 3 else (operands[0], operands[1], operands[1])
+    if _is_byte(constant.value):
+        return _code([0x6b], _number(destination), source, immediate=_immediate(constant.value, 1))
+    return _code([0x69], _number(destination), source, immediate=_immediate(constant.value, 4))
+
+
+def _shift(digit):
+    # Shifts by a constant (e.g. shr), the operation is given by the digit.
+    def encode(count, destination):
+        return _code([0xc1], digit, destination, immediate=_immediate(count.value, 1))
+    return encode
+
+
+def _test(source, destination):
+    return _code([0x85], _number(source), destination)
+
+
+def _push(operand):
+    if isinstance(operand, x86.Immediate):
+        if _is_byte(operand.value):
+            return bytes([0x6a]) + _immediate(operand.value, 1), None
+        return bytes([0x68]) + _immediate(operand.value, 4, wide=True), None
+    if isinstance(operand, x86.Register):
+        number = _number(operand)
+        return (bytes([0x41]) if number >= 8 else b'') + bytes([0x50 + (number & 7)]), None
+    return _code([0xff], 6, operand)
+
+
+def _pop(operand):
+    number = _number(operand)
+    return (bytes([0x41]) if number >= 8 else b'') + bytes([0x58 + (number & 7)]), None
+
+
+def _fixed(code):
+    def encode():
+        return bytes(code), None
+    return encode
+
+
+def _sse(prefix, load_opcode, store_opcode=None):
+    # SSE instructions: the destination is a xmm register, or for the stores (e.g. movsd %xmm0, mem) a memory operand.
+    def encode(source, destination):
+        if isinstance(destination, x86.Register):
+            return _code([0x0f, load_opcode], _number(destination), source, prefix=prefix)
+        return _code([0x0f, store_opcode], _number(source), destination, prefix=prefix)
+    return encode
+
+
+def _avx(prefix, load_opcode, store_opcode=None, opcode_map=1):
+    # AVX instructions, either moves (source, destination) or operations (source 2, source 1, destination).
+    def encode(*operands):
+        if len(operands) == 3:
+            source_2, source_1, destination = operands
+            return _vex_code([load_opcode], destination, source_1, source_2, prefix, opcode_map)
+        source, destination = operands
+        if isinstance(destination, x86.Register):
+            return _vex_code([load_opcode], destination, None, source, prefix, opcode_map)
+        return _vex_code([store_opcode], source, None, destination, prefix, opcode_map)
+    return encode
+
+
+_ENCODERS = {
+    'addl': _arithmetic(0, 32), 'addq': _arithmetic(0, 64), 'subl': _arithmetic(5, 32), 'subq': _arithmetic(5, 64),
+    'cmpl': _arithmetic(7, 32), 'cmpq': _arithmetic(7, 64), 'andb': _arithmetic(4, 8), 'orb': _arithmetic(1, 8),
+    'movl': _move(32), 'movq': _move(64),
+    'movslq': _load([0x63], wide=True), 'movzbl': _load([0x0f, 0xb6]),
+    'leal': _load([0x8d]), 'leaq': _load([0x8d], wide=True),
+    'imull': _imul, 'shrl': _shift(5), 'testl': _test, 'negl': _unary([0xf7], 3), 'idivl': _unary([0xf7], 7),
+    'pushq': _push, 'popq': _pop,
+    'cltd': _fixed([0x99]), 'ret': _fixed([0xc3]), 'syscall': _fixed([0x0f, 0x05]),
+    'vzeroupper': _fixed([0xc5, 0xf8, 0x77]),
+    **{f'set{condition}': _unary([0x0f, 0x90 + code], 0) for condition, code in _CONDITIONS.items()},
+    'movsd': _sse(b'\xf2', 0x10, 0x11), 'addsd': _sse(b'\xf2', 0x58), 'mulsd': _sse(b'\xf2', 0x59),
+    'subsd': _sse(b'\xf2', 0x5c), 'divsd': _sse(b'\xf2', 0x5e),
+    'movapd': _sse(b'\x66', 0x28, 0x29), 'movupd': _sse(b'\x66', 0x10, 0x11), 'xorpd': _sse(b'\x66', 0x57),
+    'ucomisd': _sse(b'\x66', 0x2e), 'movdqu': _sse(b'\xf3', 0x6f, 0x7f), 'movdqa': _sse(b'\x66', 0x6f, 0x7f),
+    'paddd': _sse(b'\x66', 0xfe), 'psubd': _sse(b'\x66', 0xfa),
+    'addpd': _sse(b'\x66', 0x58), 'subpd': _sse(b'\x66', 0x5c), 'mulpd': _sse(b'\x66', 0x59),
+    'divpd': _sse(b'\x66', 0x5e),
+    'vmovdqu': _avx(b'\xf3', 0x6f, 0x7f), 'vmovdqa': _avx(b'\x66', 0x6f, 0x7f), 'vmovupd': _avx(b'\x66', 0x10, 0x11),
+    'vmovapd': _avx(b'\x66', 0x28, 0x29), 'vpaddd': _avx(b'\x66', 0xfe), 'vpsubd': _avx(b'\x66', 0xfa),
+    'vpmulld': _avx(b'\x66', 0x40, opcode_map=2), 'vaddpd': _avx(b'\x66', 0x58), 'vsubpd': _avx(b'\x66', 0x5c),
+    'vmulpd': _avx(b'\x66', 0x59), 'vdivpd': _avx(b'\x66', 0x5e),
+}
@@ -0,0 +1,307 @@
+"""
+The control flow graph of the sea sub compiler.
+"""
+from seasub import intermediate_code_generator as icg
+from seasub import symbol_table as symtab
+
+
+_JUMPS = (icg.Operator.q_jmp, icg.Operator.q_jmpif, icg.Operator.q_jmpifnot, icg.Operator.q_return)
+_NON_KILLING_OPERATORS = (icg.Operator.q_setelem,)
+_CONDITIONAL_JUMPS = {icg.Operator.q_jmpif: icg.Operator.q_jmpifnot, icg.Operator.q_jmpifnot: icg.Operator.q_jmpif}
+
+
+def build_control_flow_graph(code):
+    blocks = [BasicBlock(0)]
+    for quad in code:
+        operator = quad.operator
+        if operator == icg.Operator.q_label and (blocks[-1].quads or blocks[-1].label is not None):
+            blocks.append(BasicBlock(len(blocks)))
+        if operator == icg.Operator.q_label:
+            blocks[-1].label = quad.operand_1
+        else:
+            blocks[-1].quads.append((operator, quad.operand_1, quad.operand_2, quad.result))
+            if operator in _JUMPS:
+                blocks.append(BasicBlock(len(blocks)))
+    labels = {block.label: block for block in blocks if block.label is not None}
+    for block, following in zip(blocks, blocks[1:] + [None]):
+        jump = block.jump
+        if jump is not None:
+            block.successors.append(labels[jump[1]])
+        if (jump is None or jump[0] in _CONDITIONAL_JUMPS) and following is not None:
+            block.successors.insert(0, following)  # The fall through successor is always the first one.
+        for successor in block.successors:
+            successor.predecessors.append(block)
+    return blocks
+
+
+def find_loops(blocks):
+    # Finds the natural loops, i.e. the blocks of each back edge (an edge to a block that dominates its source) that
+    # can reach the source without passing the header. Loops sharing a header are merged. The innermost loops are
+    # returned first.
+    dominators = get_dominators(blocks)
+    loops = {}
+    for block in dominators:
+        for successor in block.successors:
+            if successor in dominators[block]:
+                loop = loops.setdefault(successor, Loop(successor))
+                stack = [block]
+                while stack:
+                    member = stack.pop()
+                    if member not in loop.blocks:
+                        loop.blocks.add(member)
+                        stack.extend(member.predecessors)
+    return sorted(loops.values(), key=lambda loop: len(loop.blocks))
+
+
+def get_dominators(blocks):
+    # The iterative data flow algorithm, for the reachable blocks only.
+    reachable = [block for block in blocks if block in _get_reachable(blocks[0])]
+    dominators = {block: set(reachable) for block in reachable}
+    dominators[blocks[0]] = {blocks[0]}
+    changed = True
+    while changed:
+        changed = False
+        for block in reachable[1:]:
+            predecessors = [dominators[predecessor] for predecessor in block.predecessors if predecessor in dominators]
+            new = set.intersection(*predecessors) | {block}
+            if new != dominators[block]:
+                dominators[block] = new
+                changed = True
+    return dominators
+
+
+def layout_blocks(function, blocks, label_generator):
+    # Orders the basic blocks so that the likely successor of each block is placed directly after it (and can be
+    # reached by falling through), removes unreachable blocks and threads jumps to blocks that only jump further. The
+    # conditional jumps are inverted when the likely successor is the jump target. The block with the function's end
+    # label (i.e. the epilogue) is always kept last. The block frequencies of a profile are used when available, the
+    # blocks that were never executed are placed last.
+    _thread_jumps(blocks)
+    reachable = _get_reachable(blocks[0])
+    loops = find_loops(blocks)
+    end = blocks[-1]
+    placed = []
+    is_placed = set()
+    for start in sorted(blocks, key=lambda block: block is not blocks[0] and block.frequency == 0):
+        block = start
+        while block is not None and block in reachable and block not in is_placed and block is not end:
+            placed.append(block)
+            is_placed.add(block)
+            block = _get_likely_successor(block, loops)
+    placed.append(end)
+    for block in placed[1:]:
+        if block.label is None:  # Any block might need to be jumped to after the reordering.
+            block.label = label_generator()
+    quads = []
+    for block, following in zip(placed, placed[1:] + [None]):
+        _emit_block(block, following, quads)
+    # Labels that are only reached by falling through are removed, since they would split the basic blocks.
+    referenced = set(quad[1] for quad in quads if quad[0] in _JUMPS)
+    new_code = icg.FunctionCode(function)
+    for quad in quads:
+        if quad[0] != icg.Operator.q_label or quad[1] in referenced:
+            new_code.append(*quad)
+    return new_code
+
+
+def emit_blocks(function, blocks):
+    # The code of the blocks (e.g. after they have been transformed) in their original order.
+    quads = []
+    for block, following in zip(blocks, blocks[1:] + [None]):
+        _emit_block(block, following, quads)
+    new_code = icg.FunctionCode(function)
+    for quad in quads:
+        new_code.append(*quad)
+    return new_code
+
+
+def get_live_variables(blocks):
+    # The variables that are live at the end of each block, i.e. that might be used before they are assigned on some
+    # path from the block, by the iterative (backward) data flow algorithm. An element assignment doesn't kill the
+    # array, since the other elements are still live.
+    uses = {}
+    kills = {}
+    for block in blocks:
+        used = set()
+        killed = set()
+        for quad in reversed(block.quads):
+            result = quad[3]
+            if result is not None and quad[0] not in _NON_KILLING_OPERATORS:
+                killed.add(result)
+                used.discard(result)
+            used.update(get_uses(quad))
+        uses[block] = used
+        kills[block] = killed
+    live_in = {block: set() for block in blocks}
+    live_out = {block: set() for block in blocks}
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(blocks):
+            out = live_out[block] = set().union(*(live_in[successor] for successor in block.successors))
+            new_in = uses[block] | (out - kills[block])
+            if new_in != live_in[block]:
+                live_in[block] = new_in
+                changed = True
+    return live_out
+
+
+def get_uses(quad):
+    # The variables read by a quadruple. The operands that are not variables (e.g. constants, labels and the called
+    # function) are skipped. The array of an element assignment is also read, since only one of its elements changes.
+    operator, operand_1, operand_2, result = quad
+    if operator in (icg.Operator.q_jmpif, icg.Operator.q_jmpifnot, icg.Operator.q_return):
+        operands = (operand_2,)
+    elif operator in _NON_KILLING_OPERATORS:
+        operands = (operand_1, operand_2, result)
+    else:
+        operands = (operand_1, operand_2)
+    return [operand for operand in operands if isinstance(operand, (symtab.Variable, symtab.Parameter))]
+
+
+class Loop:
+    def __init__(self, header):
+        self.header = header
+        self.blocks = {header}
+
+    def __repr__(self):
+        return f"Loop({self.header}, <{len(self.blocks)} BLOCKS>)"
+
+    @property
+    def preheader(self):
+        # The only block outside the loop that enters it, provided it has no other successor.
+        outside = [block for block in self.header.predecessors if block not in self.blocks]
+        if len(outside) == 1 and outside[0].successors == [self.header]:
+            return outside[0]
+        return None
+
+
+class BasicBlock:
+    def __init__(self, index):
+        self.index = index
+        self.label = None
+        self.quads = []
+        self.successors = []
+        self.predecessors = []
+
+    def __repr__(self):
+        return f"BasicBlock({self.index}, {self.label}, <{len(self.quads)} QUADRUPLES>)"
+
+    @property
+    def jump(self):
+        if self.quads and self.quads[-1][0] in _JUMPS:
+            return self.quads[-1]
+        return None
+
+    @property
+    def frequency(self):
+        # The number of times the block was executed according to a profile, given by its counter (see the profile
+        # module), None if not known.
+        if self.quads and self.quads[0][0] == icg.Operator.q_count:
+            return self.quads[0][2]
+        return None
+
+
+def _thread_jumps(blocks):
+    # A jump to an empty block is redirected to where that block continues.
+    def destination(block, visited):
+        if len(block.successors) != 1 or block in visited:
+            return block
+        quads = [quad for quad in block.quads if quad[0] != icg.Operator.q_count]
+        if quads and quads != [(icg.Operator.q_jmp, block.successors[0].label, None, None)]:
+            return block
+        visited.add(block)
+        return destination(block.successors[0], visited)
+
+    labels = {block.label: block for block in blocks if block.label is not None}
+    for block in blocks:
+        jump = block.jump
+        if jump is None or jump[0] == icg.Operator.q_return:
+            continue
+        target = destination(labels[jump[1]], set())
+        if target.label != jump[1]:
+            block.quads[-1] = (jump[0], target.label, jump[2], jump[3])
+            index = block.successors.index(labels[jump[1]], len(block.successors) - 1)
+            labels[jump[1]].predecessors.remove(block)
+            block.successors[index] = target
+            target.predecessors.append(block)
+
+
+def _get_reachable(entry):
+    reachable = set()
+    stack = [entry]
+    while stack:
+        block = stack.pop()
+        if block not in reachable:
+            reachable.add(block)
+            stack.extend(block.successors)
+    return reachable
+
+
+def _get_likely_successor(block, loops):
+    jump = block.jump
+    if jump is None:
+        return block.successors[0] if block.successors else None
+    if jump[0] in _CONDITIONAL_JUMPS:
+        fall_through, target = block.successors
+        fall_through_frequency = _get_edge_frequency(block, fall_through, target)
+        target_frequency = _get_edge_frequency(block, target, fall_through)
+        if fall_through_frequency is not None and target_frequency is not None and \
+                fall_through_frequency != target_frequency:
+            return target if target_frequency > fall_through_frequency else fall_through
+        # Static prediction: a successor that stays in a loop is more likely than one that exits the loop, and a
+        # successor that directly leaves the function is less likely than one that continues.
+        for loop in loops:
+            if block in loop.blocks and (fall_through in loop.blocks) != (target in loop.blocks):
+                return target if target in loop.blocks else fall_through
+        if _returns(fall_through) and not _returns(target):
+            return target
+        return fall_through
+    if jump[0] == icg.Operator.q_jmp:
+        target = block.successors[0]
+        # The jump into a (rotated) loop is kept, the loop is better entered at its condition than split around it.
+        if any(loop.header is target and block not in loop.blocks for loop in loops):
+            return None
+        return target
+    return None
+
+
+def _get_edge_frequency(block, successor, other):
+    # The number of times the edge from the block to one of its two successors was taken, estimated from the block
+    # frequencies. The frequency of a successor with only one predecessor is the frequency of the edge, otherwise the
+    # other edge is estimated and subtracted from the frequency of the block.
+    if successor.frequency is not None and len(successor.predecessors) == 1:
+        return successor.frequency
+    if block.frequency is not None and other.frequency is not None and len(other.predecessors) == 1:
+        return block.frequency - other.frequency
+    return None
+
+
+def _returns(block):
+    jump = block.jump
+    return jump is not None and jump[0] == icg.Operator.q_return
+
+
+def _emit_block(block, following, quads):
+    if block.label is not None:
+        quads.append((icg.Operator.q_label, block.label, None, None))
+    jump = block.jump
+    for quad in block.quads[:-1] if jump is not None else block.quads:
+        quads.append(quad)
+    if jump is None:
+        if block.successors and block.successors[0] is not following:
+            quads.append((icg.Operator.q_jmp, block.successors[0].label, None, None))
+    elif jump[0] == icg.Operator.q_jmp:
+        if block.successors[0] is not following:
+            quads.append(jump)
+    elif jump[0] in _CONDITIONAL_JUMPS:
+        fall_through, target = block.successors
+        if fall_through is following:
+            quads.append(jump)
+        elif target is following:
+            quads.append((_CONDITIONAL_JUMPS[jump[0]], fall_through.label, jump[2], jump[3]))
+        else:
+            quads.append(jump)
+            quads.append((icg.Operator.q_jmp, fall_through.label, None, None))
+    else:
+        quads.append(jump)
@@ -0,0 +1,88 @@
+"""
+The object file writer of the sea sub compiler.
+
+Writes the machine code as an ELF64 relocatable object file (x86-64) that can be linked by e.g. ld or gcc.
+"""
+import struct
+
+_SECTION_NAMES = ('', '.text', '.rodata', '.data', '.bss', '.rela.text', '.symtab', '.strtab', '.shstrtab',
+                  '.note.GNU-stack')
+_TEXT, _RODATA, _DATA, _BSS, _RELA_TEXT, _SYMTAB, _STRTAB, _SHSTRTAB, _NOTE_GNU_STACK = range(1, len(_SECTION_NAMES))
+
+_SHT_PROGBITS, _SHT_SYMTAB, _SHT_STRTAB, _SHT_RELA, _SHT_NOBITS = 1, 2, 3, 4, 8
+_SHF_WRITE, _SHF_ALLOC, _SHF_EXECINSTR, _SHF_INFO_LINK = 0x1, 0x2, 0x4, 0x40
+_STB_LOCAL, _STB_GLOBAL = 0, 1
+_STT_FUNC, _STT_SECTION, _STT_FILE = 2, 3, 4
+_SHN_ABS = 0xfff1
+_R_X86_64_PC32 = 2
+
+_HEADER_SIZE = 64
+_SECTION_HEADER_SIZE = 64
+_SYMBOL_SIZE = 24
+_RELOCATION_SIZE = 24
+
+
+def save_object(object_code, file_path, source_name):
+    with open(file_path, 'wb') as file:
+        file.write(get_object(object_code, source_name))
+
+
+def get_object(object_code, source_name):
+    strings = _StringTable()
+    symbols = [_symbol(0, 0, 0, 0),
+               _symbol(strings.add(source_name), _STB_LOCAL << 4 | _STT_FILE, _SHN_ABS, 0),
+               _symbol(0, _STB_LOCAL << 4 | _STT_SECTION, _TEXT, 0),
+               _symbol(0, _STB_LOCAL << 4 | _STT_SECTION, _RODATA, 0),
+               _symbol(0, _STB_LOCAL << 4 | _STT_SECTION, _DATA, 0),
+               _symbol(0, _STB_LOCAL << 4 | _STT_SECTION, _BSS, 0)]
+    # The relocations refer to the symbols of the data sections.
+    section_symbols = {'.rodata': 3, '.data': 4, '.bss': 5}
+    first_global = len(symbols)  # The local symbols must precede the global symbols.
+    for name, (offset, size) in object_code.functions.items():
+        symbols.append(_symbol(strings.add(name), _STB_GLOBAL << 4 | _STT_FUNC, _TEXT, offset, size))
+    relocations = [struct.pack('<QQq', offset, section_symbols[section] << 32 | _R_X86_64_PC32, addend)
+                   for offset, section, addend in object_code.relocations]
+    section_names = _StringTable()
+    name_offsets = [section_names.add(name) for name in _SECTION_NAMES]
+    # (type, flags, data, link, info, alignment, entry size) of each section (except the null section).
+    sections = [(_SHT_PROGBITS, _SHF_ALLOC | _SHF_EXECINSTR, object_code.text, 0, 0, 16, 0),
+                (_SHT_PROGBITS, _SHF_ALLOC, object_code.sections['.rodata'], 0, 0, 8, 0),
+                (_SHT_PROGBITS, _SHF_ALLOC | _SHF_WRITE, object_code.sections['.data'], 0, 0, 8, 0),
+                (_SHT_NOBITS, _SHF_ALLOC | _SHF_WRITE, object_code.sections['.bss'], 0, 0, 8, 0),
+                (_SHT_RELA, _SHF_INFO_LINK, b''.join(relocations), _SYMTAB, _TEXT, 8, _RELOCATION_SIZE),
+                (_SHT_SYMTAB, 0, b''.join(symbols), _STRTAB, first_global, 8, _SYMBOL_SIZE),
+                (_SHT_STRTAB, 0, strings.data, 0, 0, 1, 0),
+                (_SHT_STRTAB, 0, section_names.data, 0, 0, 1, 0),
+                (_SHT_PROGBITS, 0, b'', 0, 0, 1, 0)]  # Marks that the stack does not need to be executable.
+    body = bytearray()
+    headers = [bytes(_SECTION_HEADER_SIZE)]
+    for name, (kind, flags, data, link, info, alignment, entry_size) in zip(name_offsets[1:], sections):
+        body += bytes(-(_HEADER_SIZE + len(body)) % alignment)
+        headers.append(struct.pack('<IIQQQQIIQQ', name, kind, flags, 0, _HEADER_SIZE + len(body), len(data), link,
+                                   info, alignment, entry_size))
+        if kind != _SHT_NOBITS:  # The bss only has a size, it is zeroed when the program is loaded.
+            body += data
+    body += bytes(-(_HEADER_SIZE + len(body)) % 8)
+    header = struct.pack('<16sHHIQQQIHHHHHH', b'\x7fELF\x02\x01\x01', 1, 62, 1, 0, 0, _HEADER_SIZE + len(body), 0,
+                         _HEADER_SIZE, 0, 0, _SECTION_HEADER_SIZE, len(headers), _SHSTRTAB)
+    return header + bytes(body) + b''.join(headers)
+
+
+def _symbol(name, info, section, value, size=0):
+    return struct.pack('<IBBHQQ', name, info, 0, section, value, size)
+
+
+class _StringTable:
+    def __init__(self):
+        self._data = bytearray(b'\0')
+
+    @property
+    def data(self):
+        return bytes(self._data)
+
+    def add(self, string):
+        if not string:
+            return 0
+        offset = len(self._data)
+        self._data += string.encode() + b'\0'
+        return offset
@@ -3,13 +3,106 @@ The error handler of the sea sub compiler.
 """
 
 
-class SeaSubLexicalError(SyntaxError):
-    pass
+class Diagnostic:
+    # The structured information of an error (or a warning): the severity, the kind (the stage that found it), a code
+    # that identifies the message (see the README), the file, the line and the column where it was found (None if not
+    # known) and the message itself. The message does not include the position, which is added when it is converted to
+    # a string.
+    severity = 'error'
+    kind = None
 
+    def __init__(self, message, code, line=None, column=None, file=None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.line = line
+        self.column = column
+        self.file = file
 
-class SeaSubSyntaxError(SyntaxError):
-    pass
+    def __str__(self):
+        if self.line is None:
+            return self.message
+        return f"{self.message} on line {self.line}:{self.column}"
 
+    def __reduce__(self):
+        return type(self), (self.message, self.code, self.line, self.column, self.file)
 
-class SeaSubSemanticError(SyntaxError):
-    pass
+    def to_dict(self):
+        return {'severity': self.severity, 'kind': self.kind, 'code': self.code, 'file': self.file, 'line': self.line,
+                'column': self.column, 'message': self.message}
+
+
+class SeaSubLexicalError(Diagnostic, SyntaxError):
+    kind = 'lexical'
+
+
+class SeaSubSyntaxError(Diagnostic, SyntaxError):
+    kind = 'syntax'
+
+
+class SeaSubSemanticError(Diagnostic, SyntaxError):
+    kind = 'semantic'
+
+
+class SeaSubRuntimeError(Diagnostic, RuntimeError):
+    kind = 'runtime'
+
+
+class SeaSubProfileWarning(Diagnostic, UserWarning):
+    severity = 'warning'
+    kind = 'profile'
+
+
+class ErrorLog:
+    # Collects the errors of the compiler, so that all errors of a program are reported at once instead of only the
+    # first. The compilation is stopped, by raising the error, when the maximum number of errors is reached (the
+    # default of one error stops at the first error). No maximum (None) collects all errors. The warnings are
+    # collected too, but are not counted. The errors without a file get the file of the log.
+    def __init__(self, max_errors=1, file=None):
+        self._max_errors = max_errors
+        self._file = file
+        self._diagnostics = []
+        self._error_count = 0
+
+    def __repr__(self):
+        return f"ErrorLog({self._max_errors}, {self._file}, <{len(self._diagnostics)} DIAGNOSTICS>)"
+
+    def __iter__(self):
+        return iter(self._diagnostics)
+
+    @property
+    def max_errors(self):
+        return self._max_errors
+
+    @property
+    def error_count(self):
+        return self._error_count
+
+    @property
+    def is_full(self):
+        return self._max_errors is not None and self._error_count >= self._max_errors
+
+    def report(self, error):
+        self._add(error)
+        self._error_count += 1
+        if self.is_full:
+            raise error
+
+    def warn(self, warning):
+        self._add(warning)
+
+    def _add(self, diagnostic):
+        if diagnostic.file is None:
+            diagnostic.file = self._file
+        self._diagnostics.append(diagnostic)
+
+
+def format_diagnostics(diagnostics, diagnostics_format='text'):
+    # The text format has one line per diagnostic (e.g. "Error: Undeclared identifier 'a' on line 2:5"), the json
+    # format is an array of the diagnostics as objects and the ndjson format has one object per line.
+    if diagnostics_format == 'text':
+        return '\n'.join(f"{diagnostic.severity.capitalize()}: {diagnostic}" for diagnostic in diagnostics)
+    import json
+    if diagnostics_format == 'json':
+        return json.dumps([diagnostic.to_dict() for diagnostic in diagnostics])
+    return '\n'.join(json.dumps(diagnostic.to_dict()) for diagnostic in diagnostics)
@@ -0,0 +1,88 @@
+"""
+The graph writers of the sea sub compiler.
+
+A graph (e.g. of the abstract syntax tree or the symbol table) is written one node and edge at a time directly to the
+file, so the whole graph is never built in memory. The format is given by the extension of the file: Graphviz dot
+(.dot), JSON lines (.jsonl, one object per node and edge) or GraphML (.graphml), the latter two are meant for tools
+that can't render huge dot files.
+"""
+import contextlib
+import json.encoder
+import os
+
+
+@contextlib.contextmanager
+def open_graph(file_path, name, node_shape=None):
+    # Yields a writer with add_node(node_id, label, kind, parent_id), which writes the node and the edge from its parent
+    # (if not None) at once, since the graphs are trees. The node shape is only used by the dot format.
+    writers = {'.dot': _DotWriter, '.jsonl': _JsonLinesWriter, '.graphml': _GraphMLWriter}
+    extension = os.path.splitext(file_path)[1]
+    if extension not in writers:
+        raise ValueError(f"Unknown graph format '{extension}' of '{file_path}' (expected {', '.join(writers)})")
+    with open(file_path, 'w') as file:
+        writer = writers[extension](file, name, node_shape)
+        yield writer
+        writer.close()
+
+
+class _DotWriter:
+    def __init__(self, file, name, node_shape):
+        self._file = file
+        self._node_attributes = '' if node_shape is None else f', shape={node_shape}'
+        file.write(f'digraph {name} {{\n')
+
+    def add_node(self, node_id, label, kind, parent_id):
+        if '"' in label or '\\' in label or '\n' in label:
+            label = label.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        if parent_id is None:
+            self._file.write(f'{node_id} [label="{label}"{self._node_attributes}];\n')
+        else:
+            self._file.write(f'{node_id} [label="{label}"{self._node_attributes}];\n{parent_id} -> {node_id};\n')
+
+    def close(self):
+        self._file.write('}\n')
+
+
+class _JsonLinesWriter:
+    def __init__(self, file, name, node_shape):
+        self._file = file
+        file.write(f'{{"type": "graph", "name": "{name}"}}\n')
+
+    def add_node(self, node_id, label, kind, parent_id):
+        # The objects are formatted directly (the ids and kinds are identifiers), which is much faster than json.dumps.
+        node = f'{{"type": "node", "id": "{node_id}", "kind": "{kind}", "label": {_encode_json(label)}}}\n'
+        if parent_id is None:
+            self._file.write(node)
+        else:
+            self._file.write(f'{node}{{"type": "edge", "source": "{parent_id}", "target": "{node_id}"}}\n')
+
+    def close(self):
+        pass
+
+
+class _GraphMLWriter:
+    def __init__(self, file, name, node_shape):
+        self._file = file
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                   '<key id="label" for="node" attr.name="label" attr.type="string"/>\n'
+                   '<key id="kind" for="node" attr.name="kind" attr.type="string"/>\n'
+                   f'<graph id="{name}" edgedefault="directed">\n')
+
+    def add_node(self, node_id, label, kind, parent_id):
+        node = (f'<node id="{node_id}"><data key="label">{_escape_xml(label)}</data>'
+                f'<data key="kind">{kind}</data></node>\n')
+        if parent_id is None:
+            self._file.write(node)
+        else:
+            self._file.write(f'{node}<edge source="{parent_id}" target="{node_id}"/>\n')
+
+    def close(self):
+        self._file.write('</graph>\n</graphml>\n')
+
+
+_encode_json = json.encoder.encode_basestring  # A JSON string literal.
+
+
+def _escape_xml(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
@@ -1,6 +1,9 @@
 """
 The intermediate code generator of the sea sub compiler.
 """
+import array
+import enum
+
 from seasub import abstract_syntax_tree as ast
 from seasub import symbol_table as symtab
 
@@ -9,50 +12,232 @@ def generate_intermediate_code(abstract_syntax_tree):
     return Generator().generate(abstract_syntax_tree)
 
 
+def generate_function_code(function_definition):
+    # The code of one function does not depend on any other function (the temporaries and labels are numbered per
+    # function), so the functions can be generated in any order, or in parallel.
+    return Generator().generate(function_definition)[function_definition.identifier]
+
+
 def save_code(code, file_path):
     with open(file_path, 'w') as file:
-        for name, function in code.items():
-            file.write(f"{name}:\n")
-            file.writelines("\n".join(f"\t{instruction}" for instruction in function))
-            file.write("\n")
+        write_code(code, file)
+
+
+def write_code(code, file):
+    # Each function starts with its declarations: the return type, and the parameters and variables (in the order of
+    # their indices) with their types, which lets the code be read back (see read_code). A symbol with the same name as
+    # an earlier symbol of the function (e.g. a variable of an inner scope) is written as name#N.
+    for name, function_code in code.items():
+        function = function_code.function
+        names = _get_unique_names(function)
+        file.write(f"{name}:\n\t.function {function.type}\n")
+        file.writelines(f"\t.parameter {names[parameter]} {parameter.type}\n" for parameter in function.parameters)
+        for variable in function.variables:
+            if isinstance(variable, symtab.Array):
+                file.write(f"\t.array {names[variable]} {variable.type} {variable.length}\n")
+            elif isinstance(variable, symtab.Temporary):
+                file.write(f"\t.temporary {names[variable]} {variable.type}\n")
+            else:
+                file.write(f"\t.variable {names[variable]} {variable.type}\n")
+        file.writelines(f"\t{quad.format(names)}\n" for quad in function_code)
+
+
+def load_code(file_path):
+    with open(file_path, 'r') as file:
+        return read_code(file)
+
+
+def read_code(file):
+    # Reads the code written by write_code, a ValueError is raised if it is not valid. The called functions are looked
+    # up by name once all functions have been read. The labels are the first operands of the jumps, the label
+    # definitions and the returns, the other operands are the symbols declared by the function or else constants
+    # (integers or reals).
+    functions = {}
+    bodies = []
+    for line_number, line in enumerate(file, 1):
+        fields = line.split()
+        if not fields:
+            continue
+        if not line[0].isspace():
+            if len(fields) != 1 or not fields[0].endswith(':'):
+                raise ValueError(f"Expected a function name on line {line_number}")
+            bodies.append((fields[0][:-1], {}, []))
+        elif not bodies:
+            raise ValueError(f"Expected a function name on line {line_number}")
+        elif fields[0].startswith('.'):
+            _read_declaration(fields, line_number, bodies[-1], functions)
+        else:
+            bodies[-1][2].append((line_number, fields))
+    code = {}
+    for name, symbols, quads in bodies:
+        if name not in functions:
+            raise ValueError(f"The function '{name}' is not declared")
+        code[name] = FunctionCode(functions[name])
+        for line_number, fields in quads:
+            code[name].append(*_read_quadruple(fields, line_number, symbols, functions))
+    return code
+
+
+class Operator(enum.IntEnum):
+    q_load = enum.auto()
+    q_uplus = enum.auto()
+    q_uminus = enum.auto()
+    q_plus = enum.auto()
+    q_minus = enum.auto()
+    q_mult = enum.auto()
+    q_div = enum.auto()
+    q_lt = enum.auto()
+    q_le = enum.auto()
+    q_gt = enum.auto()
+    q_ge = enum.auto()
+    q_eq = enum.auto()
+    q_ne = enum.auto()
+    q_not = enum.auto()
+    q_assign = enum.auto()
+    q_getelem = enum.auto()
+    q_setelem = enum.auto()
+    q_jmp = enum.auto()
+    q_jmpifnot = enum.auto()
+    q_jmpif = enum.auto()
+    q_param = enum.auto()
+    q_call = enum.auto()
+    q_label = enum.auto()
+    q_return = enum.auto()
+    q_count = enum.auto()
+    q_memoize = enum.auto()
+
+    def __str__(self):
+        return self.name
+
+
+_COMPARISONS = (Operator.q_lt, Operator.q_le, Operator.q_gt, Operator.q_ge, Operator.q_eq, Operator.q_ne)
+_OPERATORS = {operator.value: operator for operator in Operator}
+
+
+class FunctionCode:
+    # The quadruples of a function are stored column-wise, one compact array per field. The operands (symbols, labels
+    # and constants) are interned in a per function operand list and the arrays only hold the operand ids.
+    _NO_OPERAND = -1
+
+    def __init__(self, function):
+        self._function = function
+        self._operators = array.array('B')
+        self._operands_1 = array.array('i')
+        self._operands_2 = array.array('i')
+        self._results = array.array('i')
+        self._operands = []
+        self._operand_ids = {}
+
+    def __repr__(self):
+        return f"FunctionCode({self._function.name}, <{len(self)} QUADRUPLES>)"
+
+    def __len__(self):
+        return len(self._operators)
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError("Quadruple index out of range")
+        return Quadruple(self, index % len(self))
+
+    def __iter__(self):
+        return (Quadruple(self, index) for index in range(len(self)))
+
+    @classmethod
+    def from_columns(cls, function, operators, operands_1, operands_2, results, operands):
+        # The code with the given columns (e.g. as loaded by the serialization), which are not copied.
+        code = cls(function)
+        code._operators = operators
+        code._operands_1 = operands_1
+        code._operands_2 = operands_2
+        code._results = results
+        code._operands = operands
+        code._operand_ids = {cls._key(operand): operand_id for operand_id, operand in enumerate(operands)}
+        return code
+
+    @property
+    def function(self):
+        return self._function
+
+    @property
+    def columns(self):
+        # The operators, the operand ids of each field and the operands, see from_columns.
+        return self._operators, self._operands_1, self._operands_2, self._results, self._operands
+
+    def append(self, operator, operand_1, operand_2, result):
+        self._operators.append(operator)
+        self._operands_1.append(self._intern(operand_1))
+        self._operands_2.append(self._intern(operand_2))
+        self._results.append(self._intern(result))
+
+    def __reduce__(self):
+        # The code is transferred between processes when the functions are compiled in parallel, in the format of the
+        # serialization module which is more compact and much faster to load than the pickled objects.
+        from seasub import serialization
+        return _load_function_code, (serialization.dump_intermediate_code({self._function.name: self}),)
+
+    def _intern(self, operand):
+        if operand is None:
+            return self._NO_OPERAND
+        key = self._key(operand)
+        operand_id = self._operand_ids.get(key)
+        if operand_id is None:
+            operand_id = len(self._operands)
+            self._operand_ids[key] = operand_id
+            self._operands.append(operand)
+        return operand_id
+
+    @staticmethod
+    def _key(operand):
+        if isinstance(operand, float):
+            return float, operand.hex()  # To not mix up 0.0 and -0.0.
+        return type(operand), operand  # The type is part of the key to not mix up e.g. 1 and 1.0.
+
+    def _operand(self, operand_id):
+        return None if operand_id == self._NO_OPERAND else self._operands[operand_id]
 
 
 class Quadruple:
-    def __init__(self, operator, operand_1, operand_2, result, symbol_table):
-        self._operator = operator
-        self._operand_1 = operand_1
-        self._operand_2 = operand_2
-        self._result = result
-        self._symbol_table = symbol_table
+    # A light weight view of one quadruple in a function code.
+    __slots__ = ('_code', '_index')
+
+    def __init__(self, code, index):
+        self._code = code
+        self._index = index
 
     def __repr__(self):
-        return f"Quadruple({self._operator}, {self._operand_1}, {self._operand_2}, {self._result}, <SYMBOL TABLE>)"
+        return f"Quadruple({self.operator}, {self.operand_1}, {self.operand_2}, {self.result})"
 
     def __str__(self):
+        return self.format({})
+
+    def format(self, names):
+        # The symbols are written by the given names (by symbol), if any, otherwise by their own names. The columns are
+        # always separated by at least one space.
         def column(field):
-            value = "-" if field is None else str(field)
-            return f"{value}{' ' * (15 - len(value))}"
-        return "".join(column(e) for e in (self._operator, self._operand_1, self._operand_2, self._result))
+            if field is None:
+                value = "-"
+            elif isinstance(field, symtab.Symbol):
+                value = names.get(field, field.name)
+            else:
+                value = str(field)
+            return f"{value:<14} "
+        return "".join(column(e) for e in (self.operator, self.operand_1, self.operand_2, self.result))
 
     @property
     def operator(self):
-        return self._operator
+        return _OPERATORS[self._code._operators[self._index]]
 
     @property
     def operand_1(self):
-        return self._operand_1
+        return self._code._operand(self._code._operands_1[self._index])
 
     @property
     def operand_2(self):
-        return self._operand_2
+        return self._code._operand(self._code._operands_2[self._index])
 
     @property
     def result(self):
-        return self._result
-
-    @property
-    def symbol_table(self):
-        return self._symbol_table
+        return self._code._operand(self._code._results[self._index])
 
 
 class Generator(ast.NodeVisitor):
@@ -64,103 +249,251 @@ class Generator(ast.NodeVisitor):
         self._label_counter = None
         self._current_label = None
         self._current_function = None
+        self._vector_width = None
 
     def generate(self, abstract_syntax_tree):
-        self._temp_counter = 0
-        self._label_counter = 0
+        # Generates the code of each function of a translation unit, or of a single function definition.
+        self._functions = {}
         self.visit(abstract_syntax_tree)
         return self._functions
 
-    def _visit_TranslationUnit(self, node):
-        self._functions = {}
-        self._generic_visit(node)
-
     def _visit_FunctionDefinition(self, node):
-        self._verify_type(node)
-        self._current_function = node.symbol_table[node.identifier]
+        self._current_function = node.symbol
+        self._temp_counter = 0
+        self._label_counter = 0
         self._current_label = self._generate_label()
-        self._code = []
+        self._code = FunctionCode(self._current_function)
         self._functions[node.identifier] = self._code
         self._generic_visit(node)
-        self._code.append(Quadruple('q_label', self._current_label, None, None, node.symbol_table))
+        self._code.append(Operator.q_label, self._current_label, None, None)
         self._code = None
         self._current_label = None
 
-    def _visit_Parameter(self, node):
-        self._verify_type(node)
-        self._generic_visit(node)
-
     def _visit_FunctionCall(self, node):
         arguments = [self.visit(arg) for arg in node.arguments]
         for arg in arguments[::-1]:  # Revert the order to make life easier for the target code generator.
-            self._code.append(Quadruple('q_param', arg, None, None, node.symbol_table))
-        temp = self._generate_temp(node)
-        self._code.append(Quadruple('q_call', node.identifier.name, len(arguments), temp, node.symbol_table))
+            self._code.append(Operator.q_param, arg, None, None)
+        temp = self._generate_temp(node.identifier.symbol.type)
+        self._code.append(Operator.q_call, node.identifier.symbol, len(arguments), temp)
         return temp
 
     def _visit_ReturnStatement(self, node):
         value = self.visit(node.value)
-        self._code.append(Quadruple('q_return', self._current_label, value, None, node.symbol_table))
-
-    def _visit_Declaration(self, node):
-        self._verify_type(node)
-        self._generic_visit(node)
+        self._code.append(Operator.q_return, self._current_label, value, None)
 
     def _visit_Assignment(self, node):
-        value = self.visit(node.value)
-        self._code.append(Quadruple('q_assign', value, None, node.identifier, node.symbol_table))
+        if node.index is None:
+            value = self.visit(node.value)
+            self._code.append(Operator.q_assign, value, None, node.symbol)
+        else:
+            index = self.visit(node.index)
+            value = self.visit(node.value)
+            self._code.append(Operator.q_setelem, value, index, node.symbol)
 
     def _visit_IfStatement(self, node):
-        predicate = self.visit(node.predicate)
         alternative = self._generate_label()
         end = self._generate_label()
-        self._code.append(Quadruple('q_jmpifnot', alternative, predicate, None, node.symbol_table))
-        self.visit(node.consequent)
-        self._code.append(Quadruple('q_jmp', end, None, None, node.symbol_table))
-        self._code.append(Quadruple('q_label', alternative, None, None, node.symbol_table))
-        self.visit(node.alternative)
-        self._code.append(Quadruple('q_label', end, None, None, node.symbol_table))
+        if isinstance(node.alternative, ast.NoOperation):  # No need to jump over an empty alternative.
+            self._generate_condition(node.predicate, end, False)
+            self.visit(node.consequent)
+        else:
+            self._generate_condition(node.predicate, alternative, False)
+            self.visit(node.consequent)
+            self._code.append(Operator.q_jmp, end, None, None)
+            self._code.append(Operator.q_label, alternative, None, None)
+            self.visit(node.alternative)
+        self._code.append(Operator.q_label, end, None, None)
+
+    def _visit_WhileStatement(self, node):
+        self._generate_loop(node.predicate, node.body, None)
+
+    def _visit_ForStatement(self, node):
+        self.visit(node.initialization)
+        if node.vectorization is not None:
+            # The vectorized loop handles as many iterations as possible, each iteration handles width elements. The
+            # original loop is kept as the (scalar) epilogue that handles the remaining elements.
+            self._vector_width, predicate, step = node.vectorization
+            self._generate_loop(predicate, node.body, step)
+            self._vector_width = None
+        self._generate_loop(node.predicate, node.body, node.step)
 
     def _visit_BinaryOperator(self, node):
-        operators = {'+': 'q_plus', '-': 'q_minus', '*': 'q_mult', '/': 'q_div'}
+        if node.operator in ('&&', '||'):
+            return self._generate_logical_value(node)
+        operators = {'+': Operator.q_plus, '-': Operator.q_minus, '*': Operator.q_mult, '/': Operator.q_div,
+                     '<': Operator.q_lt, '<=': Operator.q_le, '>': Operator.q_gt, '>=': Operator.q_ge,
+                     '==': Operator.q_eq, '!=': Operator.q_ne}
         a = self.visit(node.a)
         b = self.visit(node.b)
-        temp = self._generate_temp(node)
-        self._code.append(Quadruple(operators[node.operator], a, b, temp, node.symbol_table))
+        temp = self._generate_temp('int' if operators[node.operator] in _COMPARISONS else a.type)
+        self._code.append(operators[node.operator], a, b, temp)
         return temp
 
     def _visit_UnaryOperator(self, node):
-        operators = {'+': 'q_uplus', '-': 'q_uminus'}
+        operators = {'+': Operator.q_uplus, '-': Operator.q_uminus, '!': Operator.q_not}
         a = self.visit(node.a)
-        temp = self._generate_temp(node)
-        self._code.append(Quadruple(operators[node.operator], a, None, temp, node.symbol_table))
+        temp = self._generate_temp('int' if node.operator == '!' else a.type)
+        self._code.append(operators[node.operator], a, None, temp)
+        return temp
+
+    def _visit_Subscript(self, node):
+        array = node.identifier.symbol
+        index = self.visit(node.index)
+        element_type = array.type[:-2]
+        if self._vector_width is not None:  # E.g. int<4>, a vector of four ints.
+            element_type = f'{element_type}<{self._vector_width}>'
+        temp = self._generate_temp(element_type)
+        self._code.append(Operator.q_getelem, array, index, temp)
         return temp
 
     def _visit_Identifier(self, node):
-        return node.name
+        return node.symbol
 
     def _visit_IntegerConstant(self, node):
-        temp = self._generate_temp(node)
-        self._code.append(Quadruple('q_load', node.value, None, temp, node.symbol_table))
+        temp = self._generate_temp('int')
+        self._code.append(Operator.q_load, node.value, None, temp)
         return temp
 
     def _visit_RealConstant(self, node):
-        raise NotImplementedError("The intermediate code generator does not support real values")
+        temp = self._generate_temp('double')
+        self._code.append(Operator.q_load, node.value, None, temp)
+        return temp
 
-    @staticmethod
-    def _verify_type(node):
-        if node.type_specifier != 'int':
-            raise NotImplementedError("The intermediate code generator only support integers")
+    def _generate_loop(self, predicate, body, step):
+        # The loop is rotated, i.e. the predicate is placed after the body, so that each iteration only executes one
+        # (conditional) jump.
+        body_label = self._generate_label()
+        predicate_label = self._generate_label()
+        self._code.append(Operator.q_jmp, predicate_label, None, None)
+        self._code.append(Operator.q_label, body_label, None, None)
+        self.visit(body)
+        if step is not None:
+            self.visit(step)
+        self._code.append(Operator.q_label, predicate_label, None, None)
+        self._generate_condition(predicate, body_label, True)
+
+    def _generate_condition(self, node, target, jump_if):
+        # Short-circuit code, jumps to the target if the truth value of the node equals jump_if and otherwise falls
+        # through. The logical operators are turned into control flow instead of 0/1 values.
+        if isinstance(node, ast.BinaryOperator) and node.operator in ('&&', '||'):
+            if (node.operator == '||') == jump_if:  # Any operand decides the outcome.
+                self._generate_condition(node.a, target, jump_if)
+                self._generate_condition(node.b, target, jump_if)
+            else:  # The first operand can only decide that the jump is not taken.
+                skip = self._generate_label()
+                self._generate_condition(node.a, skip, not jump_if)
+                self._generate_condition(node.b, target, jump_if)
+                self._code.append(Operator.q_label, skip, None, None)
+        elif isinstance(node, ast.UnaryOperator) and node.operator == '!':
+            self._generate_condition(node.a, target, not jump_if)
+        else:
+            self._code.append(Operator.q_jmpif if jump_if else Operator.q_jmpifnot, target, self.visit(node), None)
+
+    def _generate_logical_value(self, node):
+        # Only used when the value of a logical operator is needed (e.g. assigned), not when it is a condition.
+        false = self._generate_label()
+        end = self._generate_label()
+        temp = self._generate_temp('int')
+        self._generate_condition(node, false, False)
+        self._code.append(Operator.q_load, 1, None, temp)
+        self._code.append(Operator.q_jmp, end, None, None)
+        self._code.append(Operator.q_label, false, None, None)
+        self._code.append(Operator.q_load, 0, None, temp)
+        self._code.append(Operator.q_label, end, None, None)
+        return temp
 
-    def _generate_temp(self, node):
-        temp = f'${self._temp_counter}'
+    def _generate_temp(self, temp_type):
+        # The temporaries are only added to the function (which owns the stack frame), not to the lexical scope, since
+        # all later stages refer directly to the symbols.
+        variable = symtab.Temporary(f'${self._temp_counter}', temp_type)
         self._temp_counter += 1
-        variable = symtab.Variable(temp, 'int')
         self._current_function.add_variable(variable)
-        node.symbol_table[temp] = variable
-        return temp
+        return variable
 
     def _generate_label(self):
-        label = f'label{self._label_counter}'
+        # Prefixed with the function name (and a dot, which is not allowed in identifiers) to be unique in the program.
+        label = f'{self._current_function.name}.label{self._label_counter}'
         self._label_counter += 1
         return label
+
+
+def _load_function_code(data):
+    from seasub import serialization
+    code, = serialization.load_intermediate_code(data).values()
+    return code
+
+
+_DECLARATIONS = {'.parameter': symtab.Parameter, '.variable': symtab.Variable, '.temporary': symtab.Temporary,
+                 '.array': symtab.Array}
+# The operators whose first operand is a label (the end label of the function in the case of q_return).
+_LABEL_OPERATORS = (Operator.q_jmp, Operator.q_jmpif, Operator.q_jmpifnot, Operator.q_label, Operator.q_return)
+
+
+def _get_unique_names(function):
+    names = {}
+    counts = {}
+    for symbol in (*function.parameters, *function.variables):
+        count = counts.get(symbol.name, 0)
+        counts[symbol.name] = count + 1
+        names[symbol] = symbol.name if count == 0 else f'{symbol.name}#{count}'
+    return names
+
+
+def _read_declaration(fields, line_number, body, functions):
+    name, symbols, quads = body
+    directive = fields[0]
+    if quads:
+        raise ValueError(f"Declaration after the quadruples on line {line_number}")
+    if directive == '.function':
+        if len(fields) != 2 or name in functions:
+            raise ValueError(f"Invalid function declaration on line {line_number}")
+        functions[name] = symtab.Function(name, fields[1])
+        return
+    if name not in functions:
+        raise ValueError(f"Declaration before the function declaration on line {line_number}")
+    symbol_class = _DECLARATIONS.get(directive)
+    if symbol_class is None or len(fields) != (4 if symbol_class is symtab.Array else 3) or fields[1] in symbols:
+        raise ValueError(f"Invalid declaration on line {line_number}")
+    arguments = [fields[1].split('#')[0], *fields[2:]]  # The unique name (see write_code) is only used in the code.
+    if symbol_class is symtab.Array:
+        arguments[2] = _read_constant(arguments[2], line_number)
+    symbol = symbol_class(*arguments)
+    if symbol_class is symtab.Parameter:
+        functions[name].add_parameter(symbol)
+    else:
+        functions[name].add_variable(symbol)
+    symbols[fields[1]] = symbol
+
+
+def _read_quadruple(fields, line_number, symbols, functions):
+    if len(fields) != 4 or fields[0] not in Operator.__members__:
+        raise ValueError(f"Invalid quadruple on line {line_number}")
+    operator = Operator[fields[0]]
+    operands = []
+    for position, field in enumerate(fields[1:]):
+        if field == '-':
+            operands.append(None)
+        elif position == 0 and operator == Operator.q_call:
+            if field not in functions:
+                raise ValueError(f"Call of the undeclared function '{field}' on line {line_number}")
+            operands.append(functions[field])
+        elif position == 0 and operator in _LABEL_OPERATORS:
+            operands.append(field)
+        elif field in symbols:
+            operands.append(symbols[field])
+        else:
+            try:
+                operands.append(_read_constant(field, line_number))
+            except ValueError:
+                raise ValueError(f"Undeclared symbol '{field}' on line {line_number}") from None
+    return (operator, *operands)
+
+
+def _read_constant(field, line_number):
+    # An integer or a real constant.
+    for constant_type in (int, float):
+        try:
+            return constant_type(field)
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid constant '{field}' on line {line_number}")
@@ -0,0 +1,393 @@
+"""
+The intermediate code interpreter of the sea sub compiler.
+"""
+import math
+
+from seasub import error_handler as err
+from seasub import intermediate_code_generator as icg
+from seasub import symbol_table as symtab
+
+# The call and return closures return these signals instead of the index of the next closure. The first slot of each
+# frame collects the arguments of the next call and the second slot passes the call (or the return value) to the
+# dispatch loop.
+_CALL = -1
+_RETURN = -2
+_ARGUMENTS = 0
+_TRANSFER = 1
+_MAX_CALL_DEPTH = 100000
+_INT_MIN = -2 ** 31
+
+
+def load(intermediate_code, counters=0):
+    return Program(intermediate_code, counters)
+
+
+class Program:
+    # Each function is translated (once, when it is first called) into a list of closures, one per quadruple. A closure
+    # executes its quadruple on a frame (a list with one slot per symbol of the function) and returns the index of the
+    # next closure, the labels are resolved to indices by the translation. The dispatch loop thereby only indexes a
+    # list and calls the closure, without looking up anything by name. The frames of the calling functions are kept in
+    # an explicit stack, i.e. the calls of the program are not Python calls. The counters of instrumented code (see the
+    # profile module) are accumulated over all calls.
+    def __init__(self, intermediate_code, counters=0):
+        self._code = intermediate_code
+        self._functions = {}
+        self.counters = [0] * counters
+
+    def __repr__(self):
+        return f"Program({list(self._code)})"
+
+    def call(self, name, *arguments, fuel=None):
+        # The arrays are passed as lists, that are updated by the called function. With fuel (e.g. when a call is
+        # evaluated by the optimizer) at most that many quadruples are executed, the call is stopped by a runtime error
+        # when the fuel runs out.
+        function = self._get_function(name)
+        arguments = [_convert(parameter.type, argument)
+                     for parameter, argument in zip(function.symbol.parameters, arguments)]
+        instructions, frame, index = function.instructions, function.create_frame(arguments), 0
+        stack = []
+        while True:
+            if fuel is None:
+                while index >= 0:
+                    index = instructions[index](frame)
+            else:
+                while index >= 0 and fuel:
+                    index = instructions[index](frame)
+                    fuel -= 1
+                if index >= 0:
+                    raise err.SeaSubRuntimeError(f"Out of fuel when calling '{name}'", 'E404')
+            transfer = frame[_TRANSFER]
+            if index == _CALL:
+                callee, count, result, following = transfer
+                pending = frame[_ARGUMENTS]
+                arguments = pending[:-count - 1:-1]  # The arguments are pushed in reverse order.
+                del pending[len(pending) - count:]
+                if len(stack) == _MAX_CALL_DEPTH:
+                    raise err.SeaSubRuntimeError(f"Stack overflow when calling '{callee}'", 'E401')
+                stack.append((instructions, frame, result, following))
+                function = self._get_function(callee)
+                instructions, frame, index = function.instructions, function.create_frame(arguments), 0
+            elif stack:
+                instructions, frame, result, index = stack.pop()
+                frame[result] = transfer
+            else:
+                return transfer
+
+    def _get_function(self, name):
+        function = self._functions.get(name)
+        if function is None:
+            function = _Function(self._code[name], self.counters)
+            self._functions[name] = function
+        return function
+
+
+class _Function:
+    def __init__(self, code, counters):
+        self.symbol = code.function
+        self._counters = counters
+        self._slots = {}
+        self._template = [None, None]
+        self._arrays = []
+        self._parameters = [self._get_slot(parameter) for parameter in self.symbol.parameters]
+        labels = {}
+        position = 0
+        for quad in code:
+            if quad.operator == icg.Operator.q_label:
+                labels[quad.operand_1] = position
+            else:
+                position += 1
+        quads = [quad for quad in code if quad.operator != icg.Operator.q_label]
+        self.instructions = [self._translate(quad, index + 1, labels) for index, quad in enumerate(quads)]
+        for index, (quad, jump) in enumerate(zip(quads, quads[1:])):
+            # A comparison that is directly followed by a conditional jump on its result is fused into one closure
+            # (the jump closure is kept since it can still be a jump target).
+            if (quad.operator in _COMPARISONS and jump.operator in (icg.Operator.q_jmpif, icg.Operator.q_jmpifnot) and
+                    jump.operand_2 is quad.result):
+                slots = [self._get_slot(operand) for operand in (quad.operand_1, quad.operand_2, quad.result)]
+                self.instructions[index] = _compare_and_jump(_COMPARISONS[quad.operator], *slots,
+                                                             labels[jump.operand_1], index + 2,
+                                                             jump.operator == icg.Operator.q_jmpif)
+        self.instructions.append(_return_constant(_get_zero(self.symbol.type)))  # Falls off the end.
+
+    def create_frame(self, arguments):
+        frame = self._template.copy()
+        frame[_ARGUMENTS] = []
+        for slot, length, zero in self._arrays:
+            frame[slot] = [zero] * length
+        for slot, argument in zip(self._parameters, arguments):
+            frame[slot] = argument
+        return frame
+
+    def _get_slot(self, symbol):
+        slot = self._slots.get(symbol)
+        if slot is None:
+            slot = len(self._template)
+            self._slots[symbol] = slot
+            if isinstance(symbol, symtab.Array):
+                self._arrays.append((slot, symbol.length, _get_zero(symbol.element_type)))
+            self._template.append(_get_zero(symbol.type))  # The value of an uninitialized variable.
+        return slot
+
+    def _translate(self, quad, following, labels):
+        operator, operand_1, operand_2, result = quad.operator, quad.operand_1, quad.operand_2, quad.result
+        if operator == icg.Operator.q_load:
+            return _load(operand_1, self._get_slot(result), following)
+        if operator in (icg.Operator.q_uplus, icg.Operator.q_assign):
+            return _copy(self._get_slot(operand_1), self._get_slot(result), following)
+        if operator in (icg.Operator.q_uminus, icg.Operator.q_not):
+            function = _not if operator == icg.Operator.q_not else _get_operation(operator, result.type)
+            return _unary(function, self._get_slot(operand_1), self._get_slot(result), following)
+        if operator in _INT_OPERATORS and result.type == 'int':
+            return _INT_OPERATORS[operator](self._get_slot(operand_1), self._get_slot(operand_2),
+                                            self._get_slot(result), following)
+        if operator in _BINARY_OPERATORS:
+            function = _get_operation(operator, result.type)
+            return _binary(function, self._get_slot(operand_1), self._get_slot(operand_2), self._get_slot(result),
+                           following)
+        if operator == icg.Operator.q_getelem:
+            return _get_element(self._get_slot(operand_1), self._get_slot(operand_2), self._get_slot(result),
+                                _get_width(result.type), following)
+        if operator == icg.Operator.q_setelem:
+            return _set_element(self._get_slot(operand_1), self._get_slot(operand_2), self._get_slot(result),
+                                _get_width(operand_1.type), following)
+        if operator == icg.Operator.q_jmp:
+            return _jump(labels[operand_1])
+        if operator in (icg.Operator.q_jmpif, icg.Operator.q_jmpifnot):
+            return _conditional_jump(self._get_slot(operand_2), labels[operand_1], following,
+                                     operator == icg.Operator.q_jmpif)
+        if operator == icg.Operator.q_param:
+            return _param(self._get_slot(operand_1), following)
+        if operator == icg.Operator.q_call:
+            return _call(operand_1.name, operand_2, self._get_slot(result), following)
+        if operator == icg.Operator.q_return:
+            return _return(self._get_slot(operand_2))
+        if operator == icg.Operator.q_count:
+            return _count(self._counters, operand_1, following)
+        if operator == icg.Operator.q_memoize:
+            return _jump(following)  # A memoized function returns the same values without the memo table.
+        raise NotImplementedError(f"Can't interpret {quad}")
+
+
+def _load(value, result, following):
+    def execute(frame):
+        frame[result] = value
+        return following
+    return execute
+
+
+def _copy(operand, result, following):
+    def execute(frame):
+        frame[result] = frame[operand]
+        return following
+    return execute
+
+
+def _unary(function, operand, result, following):
+    def execute(frame):
+        frame[result] = function(frame[operand])
+        return following
+    return execute
+
+
+def _binary(function, operand_1, operand_2, result, following):
+    def execute(frame):
+        frame[result] = function(frame[operand_1], frame[operand_2])
+        return following
+    return execute
+
+
+# The most common integer operations wrap around without calling any function.
+def _plus(operand_1, operand_2, result, following):
+    def execute(frame):
+        value = frame[operand_1] + frame[operand_2]
+        frame[result] = value if -0x80000000 <= value <= 0x7fffffff else _wrap(value)
+        return following
+    return execute
+
+
+def _minus(operand_1, operand_2, result, following):
+    def execute(frame):
+        value = frame[operand_1] - frame[operand_2]
+        frame[result] = value if -0x80000000 <= value <= 0x7fffffff else _wrap(value)
+        return following
+    return execute
+
+
+def _mult(operand_1, operand_2, result, following):
+    def execute(frame):
+        value = frame[operand_1] * frame[operand_2]
+        frame[result] = value if -0x80000000 <= value <= 0x7fffffff else _wrap(value)
+        return following
+    return execute
+
+
+def _compare_and_jump(function, operand_1, operand_2, result, target, following, jump_if):
+    def execute(frame):
+        value = frame[result] = function(frame[operand_1], frame[operand_2])
+        return target if value == jump_if else following
+    return execute
+
+
+def _get_element(array, index, result, width, following):
+    if width is None:
+        def execute(frame):
+            elements, position = frame[array], frame[index]
+            if not 0 <= position < len(elements):
+                raise err.SeaSubRuntimeError(f"Array index {position} out of bounds", 'E402')
+            frame[result] = elements[position]
+            return following
+    else:
+        def execute(frame):
+            elements, position = frame[array], frame[index]
+            if not 0 <= position <= len(elements) - width:
+                raise err.SeaSubRuntimeError(f"Array index {position} out of bounds", 'E402')
+            frame[result] = elements[position:position + width]
+            return following
+    return execute
+
+
+def _set_element(value, index, array, width, following):
+    if width is None:
+        def execute(frame):
+            elements, position = frame[array], frame[index]
+            if not 0 <= position < len(elements):
+                raise err.SeaSubRuntimeError(f"Array index {position} out of bounds", 'E402')
+            elements[position] = frame[value]
+            return following
+    else:
+        def execute(frame):
+            elements, position = frame[array], frame[index]
+            if not 0 <= position <= len(elements) - width:
+                raise err.SeaSubRuntimeError(f"Array index {position} out of bounds", 'E402')
+            elements[position:position + width] = frame[value]
+            return following
+    return execute
+
+
+def _jump(target):
+    def execute(_):
+        return target
+    return execute
+
+
+def _conditional_jump(condition, target, following, jump_if):
+    if jump_if:
+        def execute(frame):
+            return target if frame[condition] else following
+    else:
+        def execute(frame):
+            return following if frame[condition] else target
+    return execute
+
+
+def _param(operand, following):
+    def execute(frame):
+        frame[_ARGUMENTS].append(frame[operand])
+        return following
+    return execute
+
+
+def _call(name, count, result, following):
+    def execute(frame):
+        frame[_TRANSFER] = (name, count, result, following)
+        return _CALL
+    return execute
+
+
+def _return(value):
+    def execute(frame):
+        frame[_TRANSFER] = frame[value]
+        return _RETURN
+    return execute
+
+
+def _count(counters, index, following):
+    def execute(frame):
+        counters[index] += 1
+        return following
+    return execute
+
+
+def _return_constant(value):
+    def execute(frame):
+        frame[_TRANSFER] = value
+        return _RETURN
+    return execute
+
+
+def _wrap(value):
+    # Integer arithmetic wraps around at 32 bits, like on the target.
+    return ((value + 2 ** 31) & 0xffffffff) - 2 ** 31
+
+
+def _divide_ints(a, b):
+    # Rounds towards zero (unlike Python), and traps like the idiv instruction.
+    if b == 0 or (a == _INT_MIN and b == -1):
+        raise err.SeaSubRuntimeError(f"Integer division {a} / {b} traps", 'E403')
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def _divide_doubles(a, b):
+    # Division by zero gives infinity (or NaN), like IEEE 754, instead of an exception.
+    if b == 0.0:
+        if a == 0.0 or a != a:
+            return math.nan
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+    return a / b
+
+
+def _not(a):
+    return int(not a)
+
+
+_OPERATIONS = {
+    ('int', icg.Operator.q_uminus): lambda a: _wrap(-a),
+    ('int', icg.Operator.q_plus): lambda a, b: _wrap(a + b),
+    ('int', icg.Operator.q_minus): lambda a, b: _wrap(a - b),
+    ('int', icg.Operator.q_mult): lambda a, b: _wrap(a * b),
+    ('int', icg.Operator.q_div): _divide_ints,
+    ('double', icg.Operator.q_uminus): lambda a: -a,
+    ('double', icg.Operator.q_plus): lambda a, b: a + b,
+    ('double', icg.Operator.q_minus): lambda a, b: a - b,
+    ('double', icg.Operator.q_mult): lambda a, b: a * b,
+    ('double', icg.Operator.q_div): _divide_doubles,
+}
+_COMPARISONS = {icg.Operator.q_lt: lambda a, b: int(a < b),
+                icg.Operator.q_le: lambda a, b: int(a <= b),
+                icg.Operator.q_gt: lambda a, b: int(a > b),
+                icg.Operator.q_ge: lambda a, b: int(a >= b),
+                icg.Operator.q_eq: lambda a, b: int(a == b),
+                icg.Operator.q_ne: lambda a, b: int(a != b)}
+_INT_OPERATORS = {icg.Operator.q_plus: _plus, icg.Operator.q_minus: _minus, icg.Operator.q_mult: _mult}
+_BINARY_OPERATORS = (icg.Operator.q_plus, icg.Operator.q_minus, icg.Operator.q_mult, icg.Operator.q_div,
+                     *_COMPARISONS)
+
+
+def _get_operation(operator, result_type):
+    if operator in _COMPARISONS:
+        return _COMPARISONS[operator]
+    width = _get_width(result_type)
+    if width is None:
+        return _OPERATIONS[(result_type, operator)]
+    function = _OPERATIONS[(result_type.partition('<')[0], operator)]
+    return lambda a, b: [function(x, y) for x, y in zip(a, b)]  # Element wise.
+
+
+def _get_width(symbol_type):
+    # The number of elements of a vector type (e.g. int<4>), None for scalars.
+    if not symbol_type.endswith('>'):
+        return None
+    return int(symbol_type[symbol_type.index('<') + 1:-1])
+
+
+def _get_zero(symbol_type):
+    return 0.0 if symbol_type.startswith('double') else 0
+
+
+def _convert(parameter_type, argument):
+    if parameter_type.endswith('[]'):
+        return argument
+    if parameter_type == 'double':
+        return float(argument)
+    return _wrap(int(argument))
@@ -0,0 +1,121 @@
+"""
+The just-in-time runner of the sea sub compiler.
+
+Loads the machine code into executable memory of the running process and calls the functions using ctypes.
+"""
+import ctypes
+import itertools
+import mmap
+
+from seasub import assembler as asm
+from seasub import x86
+
+_CTYPES = {'int': ctypes.c_int, 'double': ctypes.c_double}
+_INTEGER_REGISTERS = (x86.RDI, x86.RSI, x86.RDX, x86.RCX, x86.R8, x86.R9)
+_DOUBLE_REGISTERS = (x86.XMM0, x86.XMM1, x86.XMM2, x86.XMM3, x86.XMM4, x86.XMM5, x86.XMM6, x86.XMM7)
+
+
+def load(target_code, functions):
+    return Program(target_code, {function.name: function for function in functions})
+
+
+class Program:
+    # The program is assembled together with an entry stub for each function, which translates from the calling
+    # convention used by ctypes (System V, the arguments in registers) to the calling convention of the sea sub compiler
+    # (the arguments on the stack). The sections are placed in the same memory mapping, first writable to copy the code
+    # and resolve the relocations, then the text and read-only data are made executable (but not writable).
+    def __init__(self, target_code, functions):
+        self._functions = functions
+        entries = ['.text']
+        for function in functions.values():
+            entries.extend(_generate_entry(function))
+        object_code = asm.assemble(itertools.chain(target_code, entries))
+        text, rodata, data, bss = (object_code.sections[name] for name in ('.text', '.rodata', '.data', '.bss'))
+        rodata_offset = len(text) + -len(text) % 16
+        data_offset = _get_page_multiple(rodata_offset + len(rodata))  # The data is writable, on pages of its own.
+        bss_offset = data_offset + len(data) + -len(data) % 16
+        size = _get_page_multiple(bss_offset + len(bss))  # The mapping is zeroed, so the bss is not copied.
+        self._memory = mmap.mmap(-1, size, prot=mmap.PROT_READ | mmap.PROT_WRITE)
+        self._memory[:len(text)] = text
+        self._memory[rodata_offset:rodata_offset + len(rodata)] = rodata
+        self._memory[data_offset:data_offset + len(data)] = data
+        offsets = {'.rodata': rodata_offset, '.data': data_offset, '.bss': bss_offset}
+        for offset, section, addend in object_code.relocations:
+            value = offsets[section] + addend - offset
+            self._memory[offset:offset + 4] = value.to_bytes(4, 'little', signed=True)
+        self._buffer = ctypes.c_char.from_buffer(self._memory)
+        self._address = ctypes.addressof(self._buffer)
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.mprotect.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+        if libc.mprotect(self._address, data_offset, mmap.PROT_READ | mmap.PROT_EXEC) != 0:
+            raise OSError(ctypes.get_errno(), "Could not make the code executable")
+        self._labels = object_code.labels
+
+    def __repr__(self):
+        return f"Program({list(self._functions)})"
+
+    def close(self):
+        del self._buffer
+        self._memory.close()
+
+    def call(self, name, *arguments):
+        # The arrays are passed as lists, that are updated with the values of the array after the call.
+        function = self._functions[name]
+        parameter_types = [_get_ctype(parameter.type) for parameter in function.parameters]
+        prototype = ctypes.CFUNCTYPE(_get_ctype(function.type), *parameter_types)
+        entry = prototype(self._address + self._labels[_entry_label(name)])
+        values = [_get_array(parameter.type, argument) if parameter.type.endswith('[]') else argument
+                  for parameter, argument in zip(function.parameters, arguments)]
+        result = entry(*values)
+        for argument, value in zip(arguments, values):
+            if value is not argument:
+                argument[:] = value[:]
+        return result
+
+
+def _get_page_multiple(size):
+    return size + -size % mmap.PAGESIZE
+
+
+def _get_ctype(symbol_type):
+    if symbol_type.endswith('[]'):
+        return ctypes.POINTER(_CTYPES[symbol_type[:-2]])
+    return _CTYPES[symbol_type]
+
+
+def _get_array(array_type, values):
+    return (_CTYPES[array_type[:-2]] * len(values))(*values)
+
+
+def _entry_label(name):
+    return f'{name}.entry'  # Can't collide with a function name.
+
+
+def _generate_entry(function):
+    # The System V calling convention passes the first six integers (and pointers) in general purpose registers and the
+    # first eight doubles in xmm registers, the other arguments are passed on the stack (in order, above the return
+    # address). The arguments on the stack are pushed again, the offset of each includes the bytes pushed before it.
+    integers = iter(_INTEGER_REGISTERS)
+    doubles = iter(_DOUBLE_REGISTERS)
+    registers = []
+    stack_arguments = 0
+    for parameter in function.parameters:
+        register = next(doubles if parameter.type == 'double' else integers, None)
+        if register is None:
+            register = stack_arguments
+            stack_arguments += 1
+        registers.append(register)
+    output = [x86.Label(_entry_label(function.name))]
+    for pushed, register in enumerate(reversed(registers)):
+        if isinstance(register, int):
+            output.append(x86.Instruction('pushq', x86.Memory(8 + 8 * (register + pushed), x86.RSP)))
+        elif register.name.startswith('xmm'):
+            output.append(x86.Instruction('subq', x86.Immediate(8), x86.RSP))
+            output.append(x86.Instruction('movsd', register, x86.Memory(0, x86.RSP)))
+        else:
+            output.append(x86.Instruction('pushq', register))
+    output.append(x86.Instruction('call', function.name))
+    if registers:
+        output.append(x86.Instruction('addq', x86.Immediate(8 * len(registers)), x86.RSP))
+    output.append(x86.Instruction('ret'))
+    return output
@@ -6,17 +6,26 @@ import re
 from seasub import error_handler as err
 
 
-def tokenize(text):
+def tokenize(text, errors=None):
+    # An unexpected character is reported to the error log (see error_handler.ErrorLog) and skipped.
+    if errors is None:
+        errors = err.ErrorLog()
     token_specification = [
         # The order is important.
         ('LEFT_CURLY_BRACKET', r'\{'),  # Left curly bracket.
         ('RIGHT_CURLY_BRACKET', r'\}'),  # Right curly bracket.
-        ('TYPE_SPECIFIER', r'int|double'),  # Type specifier.
-        ('IF', r'if'),  # If keyword.
-        ('ELSE', r'else'),  # Else keyword.
-        ('RETURN', r'return'),  # Return keyword.
+        ('LEFT_SQUARE_BRACKET', r'\['),  # Left square bracket.
+        ('RIGHT_SQUARE_BRACKET', r'\]'),  # Right square bracket.
+        ('TYPE_SPECIFIER', r'(int|double)\b'),  # Type specifier.
+        ('IF', r'if\b'),  # If keyword.
+        ('ELSE', r'else\b'),  # Else keyword.
+        ('WHILE', r'while\b'),  # While keyword.
+        ('FOR', r'for\b'),  # For keyword.
+        ('RETURN', r'return\b'),  # Return keyword.
         ('NUMBER', r'\d+(\.\d*)?'),  # Integer or decimal number.
         ('IDENTIFIER', r'[_a-zA-Z][_a-zA-Z0-9]{0,30}'),  # Variable or function name.
+        ('RELATIONAL_OPERATOR', r'<=|>=|==|!=|<|>'),  # Relational operators.
+        ('LOGICAL_OPERATOR', r'&&|\|\||!'),  # Logical operators.
         ('ASSIGNMENT', r'='),  # Assignment operator.
         ('ARITHMETIC_OPERATOR', r'[+\-*/]'),  # Arithmetic operators.
         ('LEFT_PARENTHESIS', r'\('),  # Left parenthesis.
@@ -48,7 +57,8 @@ def tokenize(text):
         elif kind == 'SKIP':
             continue
         elif kind == 'MISMATCH':
-            raise err.SeaSubLexicalError(f"Unexpected {value!r} on line {line}:{column}")
+            errors.report(err.SeaSubLexicalError(f"Unexpected {value!r}", 'E101', line, column))
+            continue
         yield Token(kind, value, line, column)
     yield Token('EOF', None, line, 0)
 
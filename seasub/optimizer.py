@@ -1,12 +1,690 @@
 """
 The optimizer of the sea sub compiler.
 """
+import collections
+import itertools
+import math
+
 from seasub import abstract_syntax_tree as ast
+from seasub import control_flow as cfg
+from seasub import error_handler as err
+from seasub import intermediate_code_generator as icg
+from seasub import pass_manager as pm
+from seasub import symbol_table as symtab
+
 
-def optimize(abstract_syntax_tree):
+def fold_constants(abstract_syntax_tree, options):
     _ConstantFolding().visit(abstract_syntax_tree)
 
 
+def vectorize_loops(abstract_syntax_tree, options):
+    _LoopVectorization(options['vector_size']).visit(abstract_syntax_tree)
+
+
+def inline_hot_calls(intermediate_code):
+    _inline_hot_calls(intermediate_code)
+
+
+def propagate_constants(intermediate_code):
+    # Interprocedural constant propagation: the constants are propagated through each function (see
+    # _propagate_constants) and into the called functions. A call of a pure, non-recursive function with constant
+    # arguments is evaluated (by the interpreter, with a limited amount of fuel) and replaced by its value. A call with
+    # some constant arguments instead calls a copy of the function specialized for those constants, if the constants
+    # can be folded in the copy. The evaluation and the copies only depend on the code before this pass.
+    calls = _get_call_graph(intermediate_code)
+    recursive = set(name for name in calls if name in _get_reachable_functions(calls, calls[name]))
+    pure = set(name for name in calls if _is_pure(intermediate_code, calls, name))
+    specializer = _Specializer(dict(intermediate_code), calls, pure - recursive)
+    for name in list(intermediate_code):
+        intermediate_code[name] = specializer.propagate(intermediate_code[name], name)
+    intermediate_code.update(specializer.copies)
+
+
+def memoize_recursive_functions(intermediate_code):
+    # The pure recursive functions (e.g. a naive Fibonacci) are memoized by the target code: a q_memoize quadruple
+    # first in the function looks up the arguments in a fixed size table of the function before the body is run, and
+    # the returned value is stored in the table (see the target code generator). The arguments are stored after the
+    # body, so a function that assigns its parameters is not memoized. Without the whole program (e.g. a function that
+    # calls an undefined function) the purity can't be proven and nothing is memoized.
+    calls = _get_call_graph(intermediate_code)
+    for name, code in list(intermediate_code.items()):
+        function = code.function
+        if (function.type in ('int', 'double') and function.parameters and
+                name in _get_reachable_functions(calls, calls[name]) and _is_pure(intermediate_code, calls, name) and
+                not any(isinstance(quad.result, symtab.Parameter) or quad.operator == icg.Operator.q_memoize
+                        for quad in code)):
+            new_code = icg.FunctionCode(function)
+            new_code.append(icg.Operator.q_memoize, _MEMOIZATION_ENTRIES, None, None)
+            for quad in code:
+                new_code.append(quad.operator, quad.operand_1, quad.operand_2, quad.result)
+            intermediate_code[name] = new_code
+
+
+def hoist_loop_invariants(analyses):
+    for loop in analyses.get('loops'):
+        if loop.preheader is not None:
+            _hoist_loop_invariants(analyses.get('cfg'), loop, loop.preheader)
+
+
+def reduce_induction_variables(analyses):
+    blocks = analyses.get('cfg')
+    temp_generator = _get_temp_generator(analyses.function)
+    for loop in analyses.get('loops'):
+        if loop.preheader is not None:
+            _reduce_induction_variables(blocks, loop, loop.preheader, temp_generator)
+
+
+def eliminate_dead_code(analyses):
+    # Removes the computations (that can't trap) of the local variables and temporaries that are never used, i.e.
+    # that are not live after the assignment. The live variables are updated backwards through each block, so a chain
+    # of dead computations is removed at once.
+    blocks = analyses.get('cfg')
+    live_out = analyses.get('liveness')
+    constants = _get_constants(blocks)
+    for block in blocks:
+        live = set(live_out[block])
+        quads = []
+        for quad in reversed(block.quads):
+            operator, _, operand_2, result = quad
+            if (operator in _DEAD_CODE_OPERATORS and result not in live and not result.type.endswith('[]') and
+                    (operator != icg.Operator.q_div or constants.get(operand_2) not in (None, 0, -1))):
+                continue
+            if result is not None and operator != icg.Operator.q_setelem:
+                live.discard(result)
+            live.update(cfg.get_uses(quad))
+            quads.append(quad)
+        block.quads = quads[::-1]
+
+
+def layout_blocks(analyses):
+    blocks = analyses.get('cfg')
+    labels = set(block.label for block in blocks)
+    return cfg.layout_blocks(analyses.function, blocks, _get_label_generator(analyses.function, labels))
+
+
+# The optimization passes by name, see the pass_manager module. The passes that change the blocks of the control flow
+# graph in place keep the other analyses that they don't invalidate, e.g. the loops found before the loop invariants are
+# hoisted are still the loops of the function.
+PASSES = {optimization_pass.name: optimization_pass for optimization_pass in (
+    pm.Pass('constant-folding', pm.TREE, fold_constants, "evaluate the constant expressions"),
+    pm.Pass('vectorization', pm.TREE, vectorize_loops,
+            "vectorize the element wise loops over arrays with the packed instructions of the target"),
+    pm.Pass('inline', pm.PROGRAM, inline_hot_calls,
+            "inline the hot calls of small functions (needs the block counts of a profile)"),
+    pm.Pass('constant-propagation', pm.PROGRAM, propagate_constants,
+            "propagate the constants into the called functions, evaluate the calls of pure functions with constant "
+            "arguments and specialize the functions for the other constant arguments"),
+    pm.Pass('memoize', pm.PROGRAM, memoize_recursive_functions,
+            "memoize the pure recursive functions in a fixed size table of each function (not part of any level)"),
+    pm.Pass('hoist', pm.FUNCTION, hoist_loop_invariants, "move the loop invariant computations to the loop preheaders",
+            requires=('cfg', 'loops'), invalidates=('liveness',)),
+    pm.Pass('induction', pm.FUNCTION, reduce_induction_variables,
+            "strength reduce the multiplications of the induction variables of the loops",
+            requires=('cfg', 'loops'), invalidates=('liveness',)),
+    pm.Pass('dead-code', pm.FUNCTION, eliminate_dead_code,
+            "remove the computations of the local variables and temporaries that are never used",
+            requires=('cfg', 'liveness'), invalidates=('liveness',)),
+    pm.Pass('layout', pm.FUNCTION, layout_blocks,
+            "order the blocks by their likely successors, thread the jumps and remove unreachable blocks",
+            requires=('cfg',)),
+)}
+
+
+def _get_label_generator(function, used):
+    # The labels generated by the optimizer contains a dot, which is not allowed in identifiers, to not collide with
+    # any other labels. The labels already in the code (e.g. of an earlier pass) are skipped.
+    labels = (f'{function.name}.block{index}' for index in itertools.count())
+    return lambda: next(label for label in labels if label not in used)
+
+
+def _get_temp_generator(function):
+    # Same as for the labels, the dot keeps the names apart from the temporaries of the intermediate code generator.
+    used = set(variable.name for variable in function.variables)
+    names = (f'${function.name}.{index}' for index in itertools.count())
+
+    def generate():
+        temp = symtab.Temporary(next(name for name in names if name not in used), 'int')
+        function.add_variable(temp)
+        return temp
+    return generate
+
+
+_INLINE_THRESHOLD = 100  # A call site is hot if it executed at least 1 / 100 as often as the hottest block.
+_INLINE_MAX_SIZE = 64  # The maximum number of quadruples of an inlined function.
+
+
+def _inline_hot_calls(intermediate_code):
+    # Profile guided inlining: the hot call sites, according to the block frequencies of a profile (see the profile
+    # module), of small functions are replaced by the code of the called function. The parameters become variables
+    # that are assigned the arguments and the returns assign the result and jump past the inlined code. The
+    # frequencies of the inlined blocks are scaled to the call site. Nothing is inlined without a profile.
+    frequencies = [quad.operand_2 for code in intermediate_code.values() for quad in code
+                   if quad.operator == icg.Operator.q_count and quad.operand_2 is not None]
+    if not frequencies or max(frequencies) == 0:
+        return
+    hottest = max(frequencies)
+    original = dict(intermediate_code)  # The functions are inlined as they were before any inlining.
+    for name, code in original.items():
+        new_code = icg.FunctionCode(code.function)
+        inlined = itertools.count()
+        counter = frequency = None
+        params = []
+        for quad in code:
+            operator, operand_1, operand_2, result = quad.operator, quad.operand_1, quad.operand_2, quad.result
+            if operator == icg.Operator.q_label:
+                counter = frequency = None
+            elif operator == icg.Operator.q_count:
+                counter, frequency = operand_1, operand_2
+            elif operator == icg.Operator.q_param:
+                params.append((operator, operand_1, operand_2, result))
+                continue
+            elif operator == icg.Operator.q_call:
+                callee = original.get(operand_1.name)
+                if (frequency and frequency * _INLINE_THRESHOLD >= hottest and callee is not None and
+                        _is_inlinable(callee, code.function)):
+                    _inline(callee, [param[1] for param in reversed(params)], result, frequency, counter,
+                            f'{name}.inline{next(inlined)}', new_code)
+                    params = []
+                    continue
+            for param in params:
+                new_code.append(*param)
+            params = []
+            new_code.append(operator, operand_1, operand_2, result)
+        intermediate_code[name] = new_code
+
+
+def _is_inlinable(callee, caller):
+    # The functions are compared by name, the code of different functions might refer to different copies of the
+    # function symbols (when the code has been generated by another process).
+    function = callee.function
+    size = sum(1 for quad in callee if quad.operator not in (icg.Operator.q_label, icg.Operator.q_count))
+    return (function.name not in (caller.name, 'main') and size <= _INLINE_MAX_SIZE and
+            not any(parameter.type.endswith('[]') for parameter in function.parameters) and
+            not any(quad.operator == icg.Operator.q_call and quad.operand_1.name == function.name for quad in callee))
+
+
+def _inline(callee, arguments, result, frequency, counter, prefix, code):
+    # The labels and the symbols of the inlined function are renamed (with a dot, like the generated labels above) to
+    # not collide with the labels and symbols of the calling function, or with another inlining of the same function.
+    function = code.function
+    symbols = {}
+    for symbol in (*callee.function.parameters, *callee.function.variables):
+        if isinstance(symbol, symtab.Array):
+            copy = symtab.Array(f'{prefix}.{symbol.name}', symbol.type, symbol.length)
+        elif isinstance(symbol, symtab.Temporary):
+            copy = symtab.Temporary(f'{prefix}.{symbol.name}', symbol.type)
+        else:
+            copy = symtab.Variable(f'{prefix}.{symbol.name}', symbol.type)
+        function.add_variable(copy)
+        symbols[symbol] = copy
+    end = next(quad.operand_1 for quad in reversed(callee) if quad.operator == icg.Operator.q_label)
+    entry = next((quad.operand_2 for quad in callee if quad.operator == icg.Operator.q_count), None)
+    for parameter, argument in zip(callee.function.parameters, arguments):
+        code.append(icg.Operator.q_assign, argument, None, symbols[parameter])
+    for quad in callee:
+        operator, operand_1, operand_2, quad_result = quad.operator, quad.operand_1, quad.operand_2, quad.result
+        if operator == icg.Operator.q_label and operand_1 == end:  # Where the call continues, the rest of its block.
+            code.append(operator, f'{prefix}.{end}', None, None)
+            code.append(icg.Operator.q_count, counter, frequency, None)
+            break
+        if operator in (icg.Operator.q_label, icg.Operator.q_jmp, icg.Operator.q_jmpif, icg.Operator.q_jmpifnot):
+            code.append(operator, f'{prefix}.{operand_1}', symbols.get(operand_2, operand_2), None)
+        elif operator == icg.Operator.q_count:
+            scaled = None if operand_2 is None or not entry else operand_2 * frequency // entry
+            code.append(operator, operand_1, scaled, None)
+        elif operator == icg.Operator.q_return:
+            code.append(icg.Operator.q_assign, symbols.get(operand_2, operand_2), None, result)
+            code.append(icg.Operator.q_jmp, f'{prefix}.{end}', None, None)
+        elif operator == icg.Operator.q_memoize:
+            continue  # Only the calls of a memoized function are looked up, not the inlined code.
+        else:
+            code.append(operator, *(symbols.get(operand, operand) for operand in (operand_1, operand_2, quad_result)))
+
+
+_MEMOIZATION_ENTRIES = 4096  # The number of entries of the memo table of a function, a power of two.
+
+
+_EVALUATION_FUEL = 100000  # The maximum number of quadruples executed to evaluate a call.
+_SPECIALIZATION_MAX_SIZE = 64  # The maximum number of quadruples of a specialized function.
+_SPECIALIZATION_MAX_COPIES = 4  # The maximum number of specialized copies of a function.
+_PROPAGATION_ROUNDS = 4  # The values of evaluated calls are propagated further in the following rounds.
+
+
+class _Specializer:
+    # Propagates the constants of the functions, and evaluates the calls or calls specialized copies. The copies are
+    # named by the function and a number, with a dot (like the generated labels) to not collide with other functions.
+    def __init__(self, intermediate_code, calls, evaluable):
+        self.copies = {}
+        self._code = intermediate_code
+        self._calls = calls
+        self._evaluable = evaluable
+        self._program = None
+        self._values = {}
+        self._specializations = {}
+        self._origins = {}
+
+    def __repr__(self):
+        return f"_Specializer(<{len(self.copies)} COPIES>)"
+
+    def propagate(self, code, name):
+        # The calls of a function to the functions that (directly or indirectly) call the function are never
+        # specialized, which would copy the function for each level of the recursion.
+        origin = self._origins.get(name, name)
+        cycle = set(callee for callee in self._calls[origin]
+                    if origin in _get_reachable_functions(self._calls, [callee]))
+
+        def fold_call(callee, arguments, result):
+            values = [value for _, value in arguments]
+            if callee.name in self._evaluable and all(value is not None for value in values):
+                value = self._evaluate(callee, values)
+                if value is not None:
+                    return [(icg.Operator.q_load, value, None, result)]
+            if callee.name in cycle or callee.name not in self._code or all(value is None for value in values):
+                return None
+            copy = self._specialize(callee.name, values)
+            if copy is None:
+                return None
+            params = [param for param, value in reversed(arguments) if value is None]
+            return [*params, (icg.Operator.q_call, copy, len(params), result)]
+
+        for _ in range(_PROPAGATION_ROUNDS):
+            code, folded = _propagate_constants(code, fold_call)
+            if not folded:
+                break
+        return code
+
+    def _evaluate(self, callee, values):
+        # The value of the call, None if it can't be evaluated (e.g. it traps or runs out of fuel) or if the value
+        # can't be a constant of the code (e.g. infinity).
+        from seasub import interpreter
+        key = (callee.name, *map(repr, values))  # The zeros of doubles are equal but differ in sign.
+        if key not in self._values:
+            if self._program is None:
+                counters = [quad.operand_1 for code in self._code.values() for quad in code
+                            if quad.operator == icg.Operator.q_count]
+                self._program = interpreter.load(self._code, max(counters, default=-1) + 1)
+            try:
+                value = self._program.call(callee.name, *values, fuel=_EVALUATION_FUEL)
+            except err.SeaSubRuntimeError:
+                value = None
+            if isinstance(value, float) and not math.isfinite(value):
+                value = None
+            self._values[key] = value
+        return self._values[key]
+
+    def _specialize(self, name, values):
+        # The copy of the function specialized for the constant arguments, None if not profitable. The constant
+        # parameters become variables that are assigned the constants on entry.
+        key = (name, *map(repr, values))
+        if key in self._specializations:
+            return self._specializations[key]
+        self._specializations[key] = None
+        code = self._code[name]
+        size = sum(1 for quad in code if quad.operator not in (icg.Operator.q_label, icg.Operator.q_count))
+        copies = sum(1 for origin in self._origins.values() if origin == name)
+        if size > _SPECIALIZATION_MAX_SIZE or copies >= _SPECIALIZATION_MAX_COPIES:
+            return None
+        function = code.function
+        copy_name = f'{name}.const{copies}'
+        copy = symtab.Function(copy_name, function.type)
+        symbols = {}
+        for parameter, value in zip(function.parameters, values):
+            if value is None:
+                symbols[parameter] = symtab.Parameter(parameter.name, parameter.type)
+                copy.add_parameter(symbols[parameter])
+            else:
+                symbols[parameter] = symtab.Variable(parameter.name, parameter.type)
+                copy.add_variable(symbols[parameter])
+        for variable in function.variables:
+            if isinstance(variable, symtab.Array):
+                symbols[variable] = symtab.Array(variable.name, variable.type, variable.length)
+            else:
+                symbols[variable] = type(variable)(variable.name, variable.type)
+            copy.add_variable(symbols[variable])
+        specialized = icg.FunctionCode(copy)
+        for parameter, value in zip(function.parameters, values):
+            if value is not None:
+                specialized.append(icg.Operator.q_load, value, None, symbols[parameter])
+        for quad in code:
+            operator, operand_1, operand_2, result = quad.operator, quad.operand_1, quad.operand_2, quad.result
+            if operator in (icg.Operator.q_label, icg.Operator.q_jmp, icg.Operator.q_jmpif, icg.Operator.q_jmpifnot,
+                            icg.Operator.q_return):
+                operand_1 = _rename_label(operand_1, name, copy_name)
+            specialized.append(operator, *(symbols.get(operand, operand) for operand in (operand_1, operand_2, result)))
+        self._origins[copy_name] = name
+        specialized, folded = _propagate_constants(specialized)
+        if not folded:
+            del self._origins[copy_name]
+            return None
+        self.copies[copy_name] = self.propagate(specialized, copy_name)
+        self._specializations[key] = copy
+        return copy
+
+
+def _rename_label(label, name, new_name):
+    # The labels of a function start with its name (see _get_label_generator and the intermediate code generator).
+    if label.startswith(f'{name}.'):
+        return f'{new_name}{label[len(name):]}'
+    return f'{new_name}.{label}'
+
+
+def _get_call_graph(intermediate_code):
+    # The names of the functions called by each function.
+    return {name: set(quad.operand_1.name for quad in code if quad.operator == icg.Operator.q_call)
+            for name, code in intermediate_code.items()}
+
+
+def _get_reachable_functions(calls, names):
+    reachable = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name not in reachable:
+            reachable.add(name)
+            stack.extend(calls.get(name, ()))
+    return reachable
+
+
+def _is_pure(intermediate_code, calls, name):
+    # A function only has side effects through its array parameters (which are pointers to the arrays of the caller)
+    # or, when instrumented, through the counters of the profile. A function is pure if neither it nor any of the
+    # functions it calls (with its own arrays) has a counter, and it has no array parameters.
+    if any(parameter.type.endswith('[]') for parameter in intermediate_code[name].function.parameters):
+        return False
+    return all(callee in intermediate_code and
+               not any(quad.operator == icg.Operator.q_count and quad.operand_2 is None
+                       for quad in intermediate_code[callee])
+               for callee in _get_reachable_functions(calls, [name]))
+
+
+def _propagate_constants(code, fold_call=None):
+    # Constant propagation (of the scalar variables) over the control flow graph, where the branches that are never
+    # taken (given the constants) are ignored. The temporaries with a constant value are loaded with the constant
+    # instead of computed, the conditional jumps on a constant are resolved and the unreachable blocks are removed.
+    # The other variables are kept as they are, the now unused computations are left to the dead code elimination.
+    # A call (with the constant values of its arguments) may be replaced by the quadruples returned by fold_call.
+    # Returns the new code and the number of quadruples that were folded.
+    blocks = cfg.build_control_flow_graph(code)
+    states = _get_constant_states(blocks)
+    new_code = icg.FunctionCode(code.function)
+    folded = 0
+    for block in blocks:
+        if block.label is not None:
+            new_code.append(icg.Operator.q_label, block.label, None, None)
+        if block not in states:
+            continue
+        state = dict(states[block])
+        arguments = []
+        for quad in block.quads:
+            operator, operand_1, operand_2, result = quad
+            if operator == icg.Operator.q_param:
+                arguments.insert(0, (quad, state.get(operand_1)))  # The arguments are pushed in reverse order.
+                continue
+            quads = [quad]
+            if operator == icg.Operator.q_call:
+                replacement = None if fold_call is None else fold_call(operand_1, arguments, result)
+                if replacement is not None:
+                    quads = replacement
+                    folded += 1
+                else:
+                    quads = [param for param, _ in reversed(arguments)] + quads
+                arguments = []
+            elif operator in (icg.Operator.q_jmpif, icg.Operator.q_jmpifnot) and operand_2 in state:
+                quads = [(icg.Operator.q_jmp, operand_1, None, None)] if bool(state[operand_2]) == (
+                    operator == icg.Operator.q_jmpif) else []
+                folded += 1
+            elif operator != icg.Operator.q_load and isinstance(result, symtab.Temporary) and _is_scalar(result):
+                value = _evaluate_quadruple(quad, state)
+                if value is not None:
+                    quads = [(icg.Operator.q_load, value, None, result)]
+                    folded += 1
+            for new_quad in quads:
+                _transfer_constants(new_quad, state)
+                new_code.append(*new_quad)
+    return new_code, folded
+
+
+def _get_constant_states(blocks):
+    # The constant values of the variables at the start of each reachable block, by the iterative data flow algorithm.
+    # A variable that is missing might have different values, and only the edges that might be taken are followed.
+    states = {blocks[0]: {}}
+    changed = True
+    while changed:
+        changed = False
+        for block in blocks:
+            if block not in states:
+                continue
+            state = dict(states[block])
+            for quad in block.quads:
+                _transfer_constants(quad, state)
+            successors = block.successors
+            jump = block.jump
+            if jump is not None and jump[0] in (icg.Operator.q_jmpif, icg.Operator.q_jmpifnot) and jump[2] in state:
+                successors = successors[-1:] if bool(state[jump[2]]) == (jump[0] == icg.Operator.q_jmpif) else \
+                    successors[:1]
+            for successor in successors:
+                old = states.get(successor)
+                new = state if old is None else {variable: value for variable, value in old.items()
+                                                 if _is_same_value(state.get(variable), value)}
+                if old is None or len(new) != len(old):
+                    states[successor] = new
+                    changed = True
+    return states
+
+
+def _transfer_constants(quad, state):
+    result = quad[3]
+    if quad[0] == icg.Operator.q_setelem or result is None:
+        return
+    value = _evaluate_quadruple(quad, state)
+    if value is None or not _is_scalar(result):
+        state.pop(result, None)
+    else:
+        state[result] = value
+
+
+def _evaluate_quadruple(quad, state):
+    # The constant value of the result, None if not known or if the computation would trap.
+    operator, operand_1, operand_2, result = quad
+    if operator == icg.Operator.q_load:
+        return operand_1
+    if operator in (icg.Operator.q_assign, icg.Operator.q_uplus):
+        return state.get(operand_1)
+    if operator not in _FOLDED_OPERATORS or operand_1 not in state:
+        return None
+    a = state[operand_1]
+    if operator == icg.Operator.q_not:
+        return int(not a)
+    if operator == icg.Operator.q_uminus:
+        return _wrap(-a) if isinstance(a, int) else -a
+    if operand_2 not in state:
+        return None
+    b = state[operand_2]
+    if operator in _FOLDED_COMPARISONS:
+        return int(_FOLDED_COMPARISONS[operator](a, b))
+    if isinstance(a, int):
+        if operator == icg.Operator.q_div and (b == 0 or (a == -_INT_MODULUS // 2 and b == -1)):
+            return None
+        return _wrap(_FOLDED_ARITHMETIC[operator](a, b))
+    if operator == icg.Operator.q_div and b == 0:
+        return None
+    value = _FOLDED_ARITHMETIC[operator](a, b) if operator != icg.Operator.q_div else a / b
+    return value if math.isfinite(value) else None
+
+
+def _is_scalar(symbol):
+    return isinstance(symbol, (symtab.Variable, symtab.Parameter)) and symbol.type in ('int', 'double')
+
+
+def _is_same_value(a, b):
+    # The signs of the zeros of doubles differ.
+    return a is not None and type(a) is type(b) and a == b and math.copysign(1, a) == math.copysign(1, b)
+
+
+# Operators that can't trap, i.e. that can be executed before the loop even if the loop body never is. Division is
+# only safe with a constant divisor that is neither zero nor minus one.
+_INVARIANT_OPERATORS = (icg.Operator.q_load, icg.Operator.q_uplus, icg.Operator.q_uminus, icg.Operator.q_plus,
+                        icg.Operator.q_minus, icg.Operator.q_mult, icg.Operator.q_div, icg.Operator.q_lt,
+                        icg.Operator.q_le, icg.Operator.q_gt, icg.Operator.q_ge, icg.Operator.q_eq, icg.Operator.q_ne,
+                        icg.Operator.q_not)
+_DEAD_CODE_OPERATORS = (*_INVARIANT_OPERATORS, icg.Operator.q_assign)
+_INT_MODULUS = 2 ** 32
+_FOLDED_COMPARISONS = {icg.Operator.q_lt: lambda a, b: a < b,
+                       icg.Operator.q_le: lambda a, b: a <= b,
+                       icg.Operator.q_gt: lambda a, b: a > b,
+                       icg.Operator.q_ge: lambda a, b: a >= b,
+                       icg.Operator.q_eq: lambda a, b: a == b,
+                       icg.Operator.q_ne: lambda a, b: a != b}
+_FOLDED_ARITHMETIC = {icg.Operator.q_plus: lambda a, b: a + b,
+                      icg.Operator.q_minus: lambda a, b: a - b,
+                      icg.Operator.q_mult: lambda a, b: a * b,
+                      icg.Operator.q_div: lambda a, b: _divide(a, b)}
+_FOLDED_OPERATORS = (icg.Operator.q_uminus, icg.Operator.q_not, *_FOLDED_COMPARISONS, *_FOLDED_ARITHMETIC)
+
+
+def _hoist_loop_invariants(blocks, loop, preheader):
+    # Loop invariant code motion: a quadruple that only depends on constants, on variables that are not assigned in
+    # the loop and on other invariant quadruples is computed once, at the end of the preheader. Only temporaries
+    # (that are assigned once) are moved, the constants are only moved along with the quadruples that use them.
+    definitions = _count_definitions(blocks)
+    constants = _get_constants(blocks)
+    assigned = set(quad[3] for block in loop.blocks for quad in block.quads)
+    quads = [quad for block in sorted(loop.blocks, key=lambda block: block.index) for quad in block.quads]
+    invariant = set()
+    invariant_results = set()
+    changed = True
+    while changed:
+        changed = False
+        for quad in quads:
+            operator, operand_1, operand_2, result = quad
+            if (quad not in invariant and operator in _INVARIANT_OPERATORS and
+                    isinstance(result, symtab.Temporary) and definitions[result] == 1 and
+                    (operator == icg.Operator.q_load or
+                     all(operand is None or operand not in assigned or operand in invariant_results
+                         for operand in (operand_1, operand_2))) and
+                    (operator != icg.Operator.q_div or constants.get(operand_2) not in (None, 0, -1))):
+                invariant.add(quad)
+                changed = True
+        invariant_results = set(quad[3] for quad in invariant)
+    hoisted = [quad for quad in quads if quad in invariant and quad[0] != icg.Operator.q_load]
+    used = set(operand for quad in hoisted for operand in quad[1:3])
+    hoisted = [quad for quad in quads if quad in hoisted or (quad in invariant and quad[3] in used)]
+    if not hoisted:
+        return
+    for block in loop.blocks:
+        block.quads = [quad for quad in block.quads if quad not in hoisted]
+    _append_to_preheader(preheader, hoisted)
+
+
+def _reduce_induction_variables(blocks, loop, preheader, temp_generator):
+    # Induction variable strength reduction: for a (basic) induction variable i, that is only assigned by i = i + c in
+    # the loop, each i * k is replaced by a new variable that is initialized to i * k in the preheader and increased
+    # by c * k each time i is increased.
+    constants = _get_constants(blocks)
+    loop_blocks = sorted(loop.blocks, key=lambda block: block.index)
+    definitions = {}
+    for block in loop_blocks:
+        for quad in block.quads:
+            definitions.setdefault(quad[3], []).append(quad)
+    induction_variables = _find_induction_variables(definitions, constants)
+    products = [(block, index, quad[3], variable, factor)
+                for block in loop_blocks for index, quad in enumerate(block.quads)
+                for variable, factor in [_get_product(quad, induction_variables, constants)] if variable is not None]
+    for block, index, result, variable, factor in products:
+        operator, step = induction_variables[variable]
+        reduced, factor_temp, product, increment_temp, sum_temp = (temp_generator() for _ in range(5))
+        block.quads[index] = (icg.Operator.q_uplus, reduced, None, result)
+        _append_to_preheader(preheader, [(icg.Operator.q_load, factor, None, factor_temp),
+                                         (icg.Operator.q_mult, variable, factor_temp, product),
+                                         (icg.Operator.q_assign, product, None, reduced)])
+        increment = _wrap(step * factor)
+        update = definitions[variable][0]
+        update_block = next(block for block in loop_blocks if update in block.quads)
+        position = update_block.quads.index(update) + 1
+        update_block.quads[position:position] = [(icg.Operator.q_load, increment, None, increment_temp),
+                                                 (operator, reduced, increment_temp, sum_temp),
+                                                 (icg.Operator.q_assign, sum_temp, None, reduced)]
+    if products:
+        _remove_unused_constants(blocks, loop_blocks)
+
+
+def _find_induction_variables(definitions, constants):
+    induction_variables = {}
+    for variable, quads in definitions.items():
+        if (isinstance(variable, symtab.Temporary) or not isinstance(variable, (symtab.Parameter, symtab.Variable)) or
+                variable.type != 'int' or len(quads) != 1 or quads[0][0] != icg.Operator.q_assign):
+            continue
+        value = definitions.get(quads[0][1], [None])
+        if len(value) != 1 or value[0] is None:
+            continue
+        operator, operand_1, operand_2, _ = value[0]
+        if operator == icg.Operator.q_plus and operand_2 is variable and operand_1 in constants:
+            operand_1, operand_2 = operand_2, operand_1
+        if operator in (icg.Operator.q_plus, icg.Operator.q_minus) and operand_1 is variable and operand_2 in constants:
+            induction_variables[variable] = (operator, constants[operand_2])
+    return induction_variables
+
+
+def _get_product(quad, induction_variables, constants):
+    # The induction variable and the constant factor of a multiplication, if it is one.
+    operator, operand_1, operand_2, _ = quad
+    if operator == icg.Operator.q_mult:
+        if operand_1 in induction_variables and operand_2 in constants:
+            return operand_1, constants[operand_2]
+        if operand_2 in induction_variables and operand_1 in constants:
+            return operand_2, constants[operand_1]
+    return None, None
+
+
+def _count_definitions(blocks):
+    definitions = collections.Counter()
+    for block in blocks:
+        for quad in block.quads:
+            if quad[3] is not None:
+                definitions[quad[3]] += 1
+    return definitions
+
+
+def _get_constants(blocks):
+    # The temporaries that are assigned (once) to a constant.
+    definitions = _count_definitions(blocks)
+    return {quad[3]: quad[1] for block in blocks for quad in block.quads
+            if quad[0] == icg.Operator.q_load and definitions[quad[3]] == 1}
+
+
+def _remove_unused_constants(blocks, loop_blocks):
+    used = set(operand for block in blocks for quad in block.quads for operand in quad[1:3])
+    for block in loop_blocks:
+        block.quads = [quad for quad in block.quads if quad[0] != icg.Operator.q_load or quad[3] in used]
+
+
+def _append_to_preheader(preheader, quads):
+    # Before the jump into the loop (if any).
+    position = len(preheader.quads) - 1 if preheader.jump is not None else len(preheader.quads)
+    preheader.quads[position:position] = quads
+
+
+_LOGICAL_OPERATORS = {'<': lambda a, b: int(a < b),
+                      '<=': lambda a, b: int(a <= b),
+                      '>': lambda a, b: int(a > b),
+                      '>=': lambda a, b: int(a >= b),
+                      '==': lambda a, b: int(a == b),
+                      '!=': lambda a, b: int(a != b),
+                      '&&': lambda a, b: int(bool(a) and bool(b)),
+                      '||': lambda a, b: int(bool(a) or bool(b))}
+
+
+def _wrap(value):
+    # Integer arithmetic wraps around at 32 bits, like on the target.
+    return (value + _INT_MODULUS // 2) % _INT_MODULUS - _INT_MODULUS // 2
+
+
+def _divide(a, b):
+    # Integer division rounds towards zero (unlike Python's floor division).
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
 class _ConstantFolding(ast.NodeVisitor):
     def _visit_FunctionCall(self, node):
         assert len(node.get_children()) == 1 + len(node.arguments)
@@ -19,7 +697,9 @@ class _ConstantFolding(ast.NodeVisitor):
         node.value = self.visit(node.value)
 
     def _visit_Assignment(self, node):
-        assert len(node.get_children()) == 1
+        assert len(node.get_children()) == (1 if node.index is None else 2)
+        if node.index is not None:
+            node.index = self.visit(node.index)
         node.value = self.visit(node.value)
 
     def _visit_IfStatement(self, node):
@@ -28,20 +708,39 @@ class _ConstantFolding(ast.NodeVisitor):
         self.visit(node.consequent)
         self.visit(node.alternative)
 
+    def _visit_WhileStatement(self, node):
+        assert len(node.get_children()) == 2
+        node.predicate = self.visit(node.predicate)
+        self.visit(node.body)
+
+    def _visit_ForStatement(self, node):
+        assert len(node.get_children()) == 4
+        self.visit(node.initialization)
+        node.predicate = self.visit(node.predicate)
+        self.visit(node.step)
+        self.visit(node.body)
+
     def _visit_BinaryOperator(self, node):
         assert len(node.get_children()) == 2
-        a = self.visit(node.a)
-        b = self.visit(node.b)
+        a = node.a = self.visit(node.a)
+        b = node.b = self.visit(node.b)
+        if node.operator == '/' and isinstance(b, (ast.IntegerConstant, ast.RealConstant)) and b.value == 0:
+            return node  # Left to run time, e.g. a double division by zero gives infinity (or NaN).
         if isinstance(a, ast.IntegerConstant) and isinstance(b, ast.IntegerConstant):
             operators = {'+': lambda a, b: a + b,
                          '-': lambda a, b: a - b,
                          '*': lambda a, b: a * b,
-                         '/': lambda a, b: a // b}
-            value = operators[node.operator](a.value, b.value)
+                         '/': _divide,
+                         **_LOGICAL_OPERATORS}
+            value = _wrap(operators[node.operator](a.value, b.value))
             new_node = ast.IntegerConstant(node.token, value)
             new_node.symbol_table = node.symbol_table
             return new_node
         if isinstance(a, ast.RealConstant) and isinstance(b, ast.RealConstant):
+            if node.operator in _LOGICAL_OPERATORS:  # Compares real values but the result is an int.
+                new_node = ast.IntegerConstant(node.token, _LOGICAL_OPERATORS[node.operator](a.value, b.value))
+                new_node.symbol_table = node.symbol_table
+                return new_node
             operators = {'+': lambda a, b: a + b,
                          '-': lambda a, b: a - b,
                          '*': lambda a, b: a * b,
@@ -54,14 +753,28 @@ class _ConstantFolding(ast.NodeVisitor):
 
     def _visit_UnaryOperator(self, node):
         assert len(node.get_children()) == 1
-        a = self.visit(node.a)
-        if isinstance(a, (ast.IntegerConstant, ast.RealConstant)):
-            operators = {'+': lambda a: a,
-                         '-': lambda a: -a}
-            a.value = operators[node.operator](a.value)
+        a = node.a = self.visit(node.a)
+        if isinstance(a, (ast.IntegerConstant, ast.RealConstant)) and node.operator == '!':
+            new_node = ast.IntegerConstant(node.token, int(not a.value))
+            new_node.symbol_table = node.symbol_table
+            return new_node
+        if isinstance(a, ast.IntegerConstant) and node.operator == '-':
+            new_node = ast.IntegerConstant(node.token, _wrap(-a.value))
+            new_node.symbol_table = node.symbol_table
+            return new_node
+        if isinstance(a, ast.RealConstant) and node.operator == '-':
+            new_node = ast.RealConstant(node.token, -a.value)
+            new_node.symbol_table = node.symbol_table
+            return new_node
+        if isinstance(a, (ast.IntegerConstant, ast.RealConstant)):  # Unary plus.
             return a
         return node
 
+    def _visit_Subscript(self, node):
+        assert len(node.get_children()) == 2
+        node.index = self.visit(node.index)
+        return node
+
     def _visit_Identifier(self, node):
         assert len(node.get_children()) == 0
         return node
@@ -73,3 +786,87 @@ class _ConstantFolding(ast.NodeVisitor):
     def _visit_RealConstant(self, node):
         assert len(node.get_children()) == 0
         return node
+
+
+# The element wise operators that have packed instructions, per element type and vector size. There is no packed 32
+# bit multiplication in SSE2 and no packed integer division at all.
+_VECTOR_OPERATORS = {('int', 16): ('+', '-'),
+                     ('int', 32): ('+', '-', '*'),
+                     ('double', 16): ('+', '-', '*', '/'),
+                     ('double', 32): ('+', '-', '*', '/')}
+_ELEMENT_SIZES = {'int': 4, 'double': 8}
+
+
+class _LoopVectorization(ast.NodeVisitor):
+    # Vectorizes the loops of the form for (...; i < n; i = i + 1) a[i] = b[i] op c[i]; where i is an int variable and
+    # n an int variable or constant. Each iteration of the vectorized loop handles width (the vector size divided by
+    # the element size) elements, the original loop handles the remaining elements. The arrays can't partially overlap
+    # (there is no pointer arithmetic) so the elements of one iteration are independent of the other iterations.
+    def __init__(self, vector_size):
+        super().__init__()
+        self._vector_size = vector_size
+
+    def _visit_ForStatement(self, node):
+        self._generic_visit(node)
+        body = node.body
+        while isinstance(body, ast.CompoundStatement) and len(body.get_children()) == 1:
+            body = body.get_children()[0]
+        predicate = node.predicate
+        if not (isinstance(predicate, ast.BinaryOperator) and predicate.operator == '<' and
+                _is_int_variable(predicate.a) and
+                (isinstance(predicate.b, ast.IntegerConstant) or _is_int_variable(predicate.b))):
+            return
+        counter = predicate.a
+        if not (_is_increment(node.step, counter.symbol) and isinstance(body, ast.Assignment) and
+                _is_element(body.index, counter.symbol) and isinstance(body.value, ast.BinaryOperator) and
+                all(isinstance(operand, ast.Subscript) and _is_element(operand.index, counter.symbol)
+                    for operand in (body.value.a, body.value.b))):
+            return
+        element_type = body.symbol.type[:-2]
+        if body.value.operator not in _VECTOR_OPERATORS[(element_type, self._vector_size)]:
+            return
+        width = self._vector_size // _ELEMENT_SIZES[element_type]
+        if isinstance(predicate.b, ast.IntegerConstant):
+            # i < n - (width - 1), unless that underflows.
+            limit = predicate.b.value - (width - 1)
+            if limit < -_INT_MODULUS // 2:
+                return
+            vector_predicate = _create(predicate, ast.BinaryOperator, '<', counter,
+                                       _create(predicate, ast.IntegerConstant, limit))
+        else:
+            # i < n && n - i > width - 1, where the first comparison makes sure that n - i can only overflow (and end
+            # the vectorized loop early) for a large number of remaining elements.
+            remaining = _create(predicate, ast.BinaryOperator, '-', predicate.b, counter)
+            vector_predicate = _create(predicate, ast.BinaryOperator, '&&', predicate,
+                                       _create(predicate, ast.BinaryOperator, '>', remaining,
+                                               _create(predicate, ast.IntegerConstant, width - 1)))
+        increment = _create(node.step, ast.BinaryOperator, '+', counter, _create(node.step, ast.IntegerConstant, width))
+        vector_step = _create(node.step, ast.Assignment, node.step.identifier, increment)
+        vector_step.symbol = counter.symbol
+        node.vectorization = (width, vector_predicate, vector_step)
+
+
+def _create(template, node_class, *args):
+    # A new node in the same location (token and scope) as the template.
+    node = node_class(template.token, *args)
+    node.symbol_table = template.symbol_table
+    return node
+
+
+def _is_int_variable(node):
+    return (isinstance(node, ast.Identifier) and isinstance(node.symbol, (symtab.Variable, symtab.Parameter)) and
+            node.symbol.type == 'int')
+
+
+def _is_element(index, counter):
+    return isinstance(index, ast.Identifier) and index.symbol is counter
+
+
+def _is_increment(node, counter):
+    # i = i + 1 or i = 1 + i
+    if not (isinstance(node, ast.Assignment) and node.index is None and node.symbol is counter and
+            isinstance(node.value, ast.BinaryOperator) and node.value.operator == '+'):
+        return False
+    operands = (node.value.a, node.value.b)
+    return (any(isinstance(operand, ast.Identifier) and operand.symbol is counter for operand in operands) and
+            any(isinstance(operand, ast.IntegerConstant) and operand.value == 1 for operand in operands))
@@ -5,18 +5,72 @@ from seasub import abstract_syntax_tree as ast
 from seasub import error_handler as err
 
 
-def parse(token_stream):
+def parse(token_stream, errors=None):
+    # The syntax errors are reported to the error log (see error_handler.ErrorLog), the parsing continues after an
+    # error as long as the log is not full (see _Lexer), and the returned tree is then incomplete.
+    return _parse(token_stream, 'translation_unit', errors)
+
+
+def parse_signatures(token_stream, errors=None):
+    # A translation unit of the function definitions without their bodies (each body is replaced by a no operation),
+    # i.e. the declarations of the functions. This is a lightweight pass that only matches the curly brackets of the
+    # bodies.
+    return _parse(token_stream, 'signatures', errors)
+
+
+def parse_function_definitions(token_stream, errors=None):
+    # Yields the function definitions of a translation unit one at a time, each is parsed when the previous has been
+    # consumed.
+    return _parse(token_stream, 'function_definitions', errors)
+
+
+def _parse(token_stream, start, errors):
     def translation_unit(lexer):
-        functions = function_definition_list(lexer)
+        functions = list(function_definition_list(lexer, function_definition))
         token = lexer.eat('EOF')
         node = ast.TranslationUnit(token, functions)
         return node
 
-    def function_definition_list(lexer):
-        function_definitions = [function_definition(lexer)]
-        while lexer.peek().type == 'TYPE_SPECIFIER':
-            function_definitions.append(function_definition(lexer))
-        return function_definitions
+    def signatures(lexer):
+        functions = list(function_definition_list(lexer, function_signature))
+        token = lexer.eat('EOF')
+        node = ast.TranslationUnit(token, functions)
+        return node
+
+    def function_definitions(lexer):
+        yield from function_definition_list(lexer, function_definition)
+        lexer.eat('EOF')
+
+    def function_definition_list(lexer, function):
+        # A function with a syntax error outside of its body is left out, the rest of it is skipped and the parsing
+        # continues with the next function.
+        is_first = True
+        while is_first or lexer.peek().type != 'EOF':
+            try:
+                if is_first or lexer.peek().type == 'TYPE_SPECIFIER':
+                    yield function(lexer)
+                else:
+                    lexer.eat('EOF')  # Anything but another function is unexpected.
+            except _Panic:
+                lexer.skip_function()
+            is_first = False
+
+    def function_signature(lexer):
+        type_specifier = lexer.eat('TYPE_SPECIFIER').value
+        name = identifier(lexer)
+        lexer.eat('LEFT_PARENTHESIS')
+        parameters = parameter_list(lexer)
+        lexer.eat('RIGHT_PARENTHESIS')
+        token = lexer.eat('LEFT_CURLY_BRACKET')
+        depth = 1
+        while depth > 0:
+            token_type = lexer.peek().type
+            if token_type == 'EOF':
+                lexer.eat('RIGHT_CURLY_BRACKET')  # Raises the syntax error of the unterminated body.
+            depth += {'LEFT_CURLY_BRACKET': 1, 'RIGHT_CURLY_BRACKET': -1}.get(token_type, 0)
+            lexer.eat(token_type)
+        node = ast.FunctionDefinition(name.token, type_specifier, name.name, parameters, ast.NoOperation(token))
+        return node
 
     def function_definition(lexer):
         type_specifier = lexer.eat('TYPE_SPECIFIER').value
@@ -24,7 +78,12 @@ def parse(token_stream):
         lexer.eat('LEFT_PARENTHESIS')
         parameters = parameter_list(lexer)
         lexer.eat('RIGHT_PARENTHESIS')
+        panics = lexer.panics
         body = compound_statement(lexer)
+        if lexer.panics != panics:
+            # An incomplete body is not analyzed (it would mostly give misleading errors), the function is only
+            # declared.
+            body = ast.NoOperation(body.token)
         node = ast.FunctionDefinition(name.token, type_specifier, name.name, parameters, body)
         return node
 
@@ -36,8 +95,18 @@ def parse(token_stream):
         return parameters
 
     def parameter_declaration(lexer):
+        # A pointer parameter (int *a or int a[]) is given the type of an array of unknown length (int[]).
         type_specifier = lexer.eat('TYPE_SPECIFIER').value
+        pointer = lexer.peek().type == 'ARITHMETIC_OPERATOR' and lexer.peek().value == '*'
+        if pointer:
+            lexer.eat('ARITHMETIC_OPERATOR')
         name = identifier(lexer)
+        if not pointer and lexer.peek().type == 'LEFT_SQUARE_BRACKET':
+            lexer.eat('LEFT_SQUARE_BRACKET')
+            lexer.eat('RIGHT_SQUARE_BRACKET')
+            pointer = True
+        if pointer:
+            type_specifier = f'{type_specifier}[]'
         return ast.Parameter(name.token, type_specifier, name.name)
 
     def compound_statement(lexer):
@@ -57,13 +126,24 @@ def parse(token_stream):
         declarations = [declaration(lexer)]
         while lexer.peek().type == 'TYPE_SPECIFIER':
             declarations.append(declaration(lexer))
-        return declarations
+        return [declaration for declaration in declarations if declaration is not None]
 
     def declaration(lexer):
-        type_specifier = lexer.eat('TYPE_SPECIFIER')
-        variable = identifier(lexer).name
-        lexer.eat('SEMICOLON')
-        node = ast.Declaration(type_specifier, type_specifier.value, variable)
+        # A declaration with a syntax error is left out (None).
+        try:
+            type_specifier = lexer.eat('TYPE_SPECIFIER')
+            variable = identifier(lexer).name
+            length = None
+            if lexer.peek().type == 'LEFT_SQUARE_BRACKET':
+                lexer.eat('LEFT_SQUARE_BRACKET')
+                length = lexer.eat('INTEGER_CONSTANT').value
+                lexer.eat('RIGHT_SQUARE_BRACKET')
+            lexer.eat('SEMICOLON')
+        except _Panic:
+            if lexer.peek().type == 'EOF':
+                raise
+            return None
+        node = ast.Declaration(type_specifier, type_specifier.value, variable, length)
         return node
 
     def statement_list(lexer):
@@ -73,14 +153,23 @@ def parse(token_stream):
         return statements
 
     def statement(lexer):
-        if lexer.peek().type == 'LEFT_CURLY_BRACKET':
-            node = compound_statement(lexer)
-        elif lexer.peek().type == 'IF':
-            node = selection_statement(lexer)
-        elif lexer.peek().type == 'RETURN':
-            node = jump_statement(lexer)
-        else:
-            node = expression_statement(lexer)
+        # A statement with a syntax error is replaced by a no operation.
+        token = lexer.peek()
+        try:
+            if lexer.peek().type == 'LEFT_CURLY_BRACKET':
+                node = compound_statement(lexer)
+            elif lexer.peek().type == 'IF':
+                node = selection_statement(lexer)
+            elif lexer.peek().type in ('WHILE', 'FOR'):
+                node = iteration_statement(lexer)
+            elif lexer.peek().type == 'RETURN':
+                node = jump_statement(lexer)
+            else:
+                node = expression_statement(lexer)
+        except _Panic:
+            if lexer.peek().type == 'EOF':
+                raise
+            node = ast.NoOperation(token)
         return node
 
     def selection_statement(lexer):
@@ -94,6 +183,29 @@ def parse(token_stream):
         node = ast.IfStatement(token, predicate, consequent, alternative)
         return node
 
+    def iteration_statement(lexer):
+        if lexer.peek().type == 'WHILE':
+            token = lexer.eat('WHILE')
+            lexer.eat('LEFT_PARENTHESIS')
+            predicate = expression(lexer)
+            lexer.eat('RIGHT_PARENTHESIS')
+            body = statement(lexer)
+            node = ast.WhileStatement(token, predicate, body)
+        else:
+            token = lexer.eat('FOR')
+            lexer.eat('LEFT_PARENTHESIS')
+            initialization = expression_statement(lexer)
+            predicate = expression(lexer)
+            lexer.eat('SEMICOLON')
+            if lexer.peek().type == 'RIGHT_PARENTHESIS':
+                step = ast.NoOperation(lexer.peek())
+            else:
+                step = assignment(lexer)
+            lexer.eat('RIGHT_PARENTHESIS')
+            body = statement(lexer)
+            node = ast.ForStatement(token, initialization, predicate, step, body)
+        return node
+
     def jump_statement(lexer):
         token = lexer.eat('RETURN')
         value = expression(lexer)
@@ -106,15 +218,54 @@ def parse(token_stream):
             token = lexer.eat('SEMICOLON')
             node = ast.NoOperation(token)
         else:
-            variable = identifier(lexer).name
-            token = lexer.eat('ASSIGNMENT')
-            value = expression(lexer)
-            node = ast.Assignment(token, variable, value)
+            node = assignment(lexer)
             lexer.eat('SEMICOLON')
         return node
 
+    def assignment(lexer):
+        variable = identifier(lexer).name
+        index = None
+        if lexer.peek().type == 'LEFT_SQUARE_BRACKET':
+            index = subscript(lexer)
+        token = lexer.eat('ASSIGNMENT')
+        value = expression(lexer)
+        node = ast.Assignment(token, variable, value, index)
+        return node
+
     def expression(lexer):
+        node = logical_or_expression(lexer)
+        return node
+
+    def logical_or_expression(lexer):
+        node = logical_and_expression(lexer)
+        while lexer.peek().type == 'LOGICAL_OPERATOR' and lexer.peek().value == '||':
+            operator = lexer.eat('LOGICAL_OPERATOR')
+            operand = logical_and_expression(lexer)
+            node = ast.BinaryOperator(operator, operator.value, node, operand)
+        return node
+
+    def logical_and_expression(lexer):
+        node = equality_expression(lexer)
+        while lexer.peek().type == 'LOGICAL_OPERATOR' and lexer.peek().value == '&&':
+            operator = lexer.eat('LOGICAL_OPERATOR')
+            operand = equality_expression(lexer)
+            node = ast.BinaryOperator(operator, operator.value, node, operand)
+        return node
+
+    def equality_expression(lexer):
+        node = relational_expression(lexer)
+        while lexer.peek().type == 'RELATIONAL_OPERATOR' and lexer.peek().value in ('==', '!='):
+            operator = lexer.eat('RELATIONAL_OPERATOR')
+            operand = relational_expression(lexer)
+            node = ast.BinaryOperator(operator, operator.value, node, operand)
+        return node
+
+    def relational_expression(lexer):
         node = additive_expression(lexer)
+        while lexer.peek().type == 'RELATIONAL_OPERATOR' and lexer.peek().value in ('<', '<=', '>', '>='):
+            operator = lexer.eat('RELATIONAL_OPERATOR')
+            operand = additive_expression(lexer)
+            node = ast.BinaryOperator(operator, operator.value, node, operand)
         return node
 
     def additive_expression(lexer):
@@ -134,8 +285,9 @@ def parse(token_stream):
         return node
 
     def unary_expression(lexer):
-        if lexer.peek().type == 'ARITHMETIC_OPERATOR' and lexer.peek().value in ('+', '-'):
-            operator = lexer.eat('ARITHMETIC_OPERATOR')
+        if ((lexer.peek().type == 'ARITHMETIC_OPERATOR' and lexer.peek().value in ('+', '-')) or
+                (lexer.peek().type == 'LOGICAL_OPERATOR' and lexer.peek().value == '!')):
+            operator = lexer.eat(lexer.peek().type)
             operand = unary_expression(lexer)
             node = ast.UnaryOperator(operator, operator.value, operand)
         else:
@@ -145,7 +297,7 @@ def parse(token_stream):
     def primary_expression(lexer):
         if lexer.peek().type == 'LEFT_PARENTHESIS':
             lexer.eat('LEFT_PARENTHESIS')
-            node = additive_expression(lexer)
+            node = expression(lexer)
             lexer.eat('RIGHT_PARENTHESIS')
         elif lexer.peek().type == 'IDENTIFIER':
             node = identifier(lexer)
@@ -154,15 +306,24 @@ def parse(token_stream):
                 arguments = argument_expression_list(lexer)
                 lexer.eat('RIGHT_PARENTHESIS')
                 node = ast.FunctionCall(node.token, node, arguments)
+            elif lexer.peek().type == 'LEFT_SQUARE_BRACKET':
+                index = subscript(lexer)
+                node = ast.Subscript(node.token, node, index)
         else:
             node = constant(lexer)
         return node
 
+    def subscript(lexer):
+        lexer.eat('LEFT_SQUARE_BRACKET')
+        node = expression(lexer)
+        lexer.eat('RIGHT_SQUARE_BRACKET')
+        return node
+
     def argument_expression_list(lexer):
-        arguments = [additive_expression(lexer)]
+        arguments = [expression(lexer)]
         while lexer.peek().type == 'COMMA':
             lexer.eat('COMMA')
-            arguments.append(additive_expression(lexer))
+            arguments.append(expression(lexer))
         return arguments
 
     def identifier(lexer):
@@ -179,28 +340,73 @@ def parse(token_stream):
             node = ast.RealConstant(number, number.value)
         return node
 
-    return translation_unit(_Lexer(token_stream))
+    rules = {'translation_unit': translation_unit, 'signatures': signatures,
+             'function_definitions': function_definitions}
+    return rules[start](_Lexer(token_stream, err.ErrorLog() if errors is None else errors))
 
 
 class _Lexer:
-    def __init__(self, token_stream):
+    # Panic mode error recovery: an unexpected token is reported and the tokens are skipped up to the end of the
+    # statement (a semicolon, which is skipped too) or the end of the block (a right curly bracket). The parsing then
+    # continues after the innermost statement (or declaration) that contained the error, which is unwound by a _Panic.
+    # An error found before a few tokens have been parsed after the previous error (or an unexpected character found by
+    # the lexical analyzer) is most likely caused by the previous error (or the recovery from it) and is not reported.
+    _SYNCHRONIZING_TOKENS = ('SEMICOLON', 'RIGHT_CURLY_BRACKET', 'EOF')
+    _RECOVERY_TOKENS = 3
+
+    def __init__(self, token_stream, errors):
         self._current = None
         self._token_stream = token_stream
+        self._errors = errors
+        self._panics = 0
+        self._parsed_since_panic = self._RECOVERY_TOKENS
         self._advance()
 
+    @property
+    def panics(self):
+        # The number of syntax errors found, including the ones that were not reported.
+        return self._panics
+
     def peek(self):
         return self._current
 
     def eat(self, token_type):
         current = self._current
         if current.type != token_type:
-            raise err.SeaSubSyntaxError((f"Unexpected {current.value!r} (expected {token_type!r}) "
-                                         f"on line {current.line}:{current.column}"))
+            self._panics += 1
+            if self._parsed_since_panic >= self._RECOVERY_TOKENS:
+                self._errors.report(err.SeaSubSyntaxError(f"Unexpected {current.value!r} (expected {token_type!r})",
+                                                          'E201', current.line, current.column))
+            self._parsed_since_panic = 0
+            while self._current.type not in self._SYNCHRONIZING_TOKENS:
+                self._advance()
+            if self._current.type == 'SEMICOLON':
+                self._advance()
+            raise _Panic()
         self._advance()
+        self._parsed_since_panic += 1
         return current
 
+    def skip_function(self):
+        # Skips the tokens up to the end of the function, i.e. a right curly bracket followed by the type specifier of
+        # the next function (or the end of the input). The parser is then in sync again.
+        while self._current.type != 'EOF':
+            token_type = self._current.type
+            self._advance()
+            if token_type == 'RIGHT_CURLY_BRACKET' and self._current.type in ('TYPE_SPECIFIER', 'EOF'):
+                break
+        self._parsed_since_panic = self._RECOVERY_TOKENS
+
     def _advance(self):
+        errors = self._errors.error_count
         try:
             self._current = next(self._token_stream)
         except StopIteration:
             self._current = None
+        if self._errors.error_count != errors:
+            self._parsed_since_panic = 0
+
+
+class _Panic(Exception):
+    # Unwinds the parsing to where it continues after a syntax error, see _Lexer.
+    pass
@@ -0,0 +1,228 @@
+"""
+The pass manager of the sea sub compiler.
+
+The optimizations are passes, registered by name in the optimizer, that work on the abstract syntax tree, on the
+intermediate code of the whole program or on the intermediate code of one function. A function pass declares the
+analyses (e.g. the control flow graph) it requires and the analyses its changes invalidate. The analyses of a function
+are computed when they are first required and are kept, by the following passes, until they are invalidated. The
+optimization levels are pipelines, i.e. lists of passes that are run in order.
+"""
+import collections
+import functools as ft
+import time
+
+from seasub import control_flow as cfg
+
+TREE = 'tree'
+PROGRAM = 'program'
+FUNCTION = 'function'
+
+# The optimization levels: a description and the passes (names), the passes of the syntax tree first. The descriptions
+# are repeated in main.py, which does not import the compiler before the arguments are parsed.
+PIPELINES = {
+    0: ("No optimization", []),
+    1: ("Constant folding, block layout and loop optimizations",
+        ['constant-folding', 'vectorization', 'inline', 'hoist', 'induction', 'layout']),
+    2: ("As 1, and interprocedural constant propagation and dead code elimination",
+        ['constant-folding', 'vectorization', 'inline', 'constant-propagation', 'hoist', 'induction', 'dead-code',
+         'layout']),
+}
+
+# The analyses of a function: the analyses each requires and how it is computed.
+_ANALYSES = {
+    'cfg': ((), lambda analyses: cfg.build_control_flow_graph(analyses.code)),
+    'loops': (('cfg',), lambda analyses: cfg.find_loops(analyses.get('cfg'))),
+    'liveness': (('cfg',), lambda analyses: cfg.get_live_variables(analyses.get('cfg'))),
+}
+
+
+def get_passes(names):
+    # The registered passes by name, see optimizer.PASSES. The optimizer is only imported if there are passes, which
+    # keeps the start up time low without optimizations.
+    if not names:
+        return []
+    from seasub import optimizer
+    return [optimizer.PASSES[name] for name in names]
+
+
+def run_tree_passes(abstract_syntax_tree, passes, options, statistics=None):
+    # Runs the passes of the syntax tree (e.g. of a translation unit or a function definition) in order. The options
+    # are given to each pass (e.g. the vector size of the target).
+    for tree_pass in passes:
+        if statistics is None:
+            tree_pass.run(abstract_syntax_tree, options)
+            continue
+        before = _get_nodes(abstract_syntax_tree)  # Kept until the nodes are compared, so their ids are not reused.
+        start = time.perf_counter()
+        tree_pass.run(abstract_syntax_tree, options)
+        elapsed = time.perf_counter() - start
+        after = _get_nodes(abstract_syntax_tree)
+        changed = len(set(map(id, before)) ^ set(map(id, after)))
+        statistics.add(tree_pass, elapsed, changed, len(before), len(after))
+
+
+def run_code_passes(intermediate_code, passes, workers=map, statistics=None):
+    # Runs the passes of the intermediate code (a dict of function codes by name) in order. The consecutive function
+    # passes are run together on each function by the workers, a map-like callable (e.g. the map of a process pool),
+    # so the analyses are shared by the passes. The program passes are run in between, on the code of all functions.
+    position = 0
+    while position < len(passes):
+        if passes[position].level == PROGRAM:
+            _run_program_pass(intermediate_code, passes[position], statistics)
+            position += 1
+            continue
+        end = position
+        while end < len(passes) and passes[end].level == FUNCTION:
+            end += 1
+        run = ft.partial(run_function_passes, passes=passes[position:end], collect_statistics=statistics is not None)
+        for name, (code, records) in zip(list(intermediate_code), workers(run, list(intermediate_code.values()))):
+            intermediate_code[name] = code
+            for record in records:
+                statistics.add(*record)
+        position = end
+
+
+def run_function_passes(code, passes, collect_statistics=False):
+    # The optimized code of one function and the statistics of each pass (if collected). A pass returns new code, or
+    # None if it changed the blocks of the control flow graph (or nothing).
+    analyses = FunctionAnalyses(code)
+    records = []
+    for function_pass in passes:
+        if collect_statistics:
+            before = collections.Counter(analyses.quadruples())
+            start = time.perf_counter()
+        new_code = function_pass.run(analyses)
+        if new_code is not None:
+            analyses.replace(new_code)
+        else:
+            if 'cfg' in function_pass.requires:
+                analyses.mark_blocks_changed()
+            analyses.invalidate(function_pass.invalidates)
+        if collect_statistics:
+            elapsed = time.perf_counter() - start
+            after = collections.Counter(analyses.quadruples())
+            changed = sum((before - after).values()) + sum((after - before).values())
+            records.append((function_pass, elapsed, changed, sum(before.values()), sum(after.values())))
+    return analyses.code, records
+
+
+class Pass:
+    # An optimization pass, run on the level it works on: a tree pass is called with the syntax tree and the options, a
+    # program pass with the intermediate code of all functions (which it changes in place) and a function pass with the
+    # analyses of a function (see run_function_passes). The invalidated analyses (of a function pass that changes the
+    # blocks in place) are all analyses if not given.
+    def __init__(self, name, level, run, description, requires=(), invalidates=None):
+        self.name = name
+        self.level = level
+        self.run = run
+        self.description = description
+        self.requires = requires
+        self.invalidates = tuple(_ANALYSES) if invalidates is None else invalidates
+
+    def __repr__(self):
+        return f"Pass({self.name}, {self.level})"
+
+
+class FunctionAnalyses:
+    # The code of a function and its analyses. The passes change either the code (by returning new code) or the blocks
+    # of the control flow graph, the code is then emitted from the blocks when it is needed.
+    def __init__(self, code):
+        self._code = code
+        self._results = {}
+        self._are_blocks_changed = False
+
+    def __repr__(self):
+        return f"FunctionAnalyses({self._code.function.name}, {list(self._results)})"
+
+    @property
+    def function(self):
+        return self._code.function
+
+    @property
+    def code(self):
+        if self._are_blocks_changed:
+            self._code = cfg.emit_blocks(self._code.function, self._results['cfg'])
+            self._are_blocks_changed = False
+        return self._code
+
+    def get(self, name):
+        if name not in self._results:
+            self._results[name] = _ANALYSES[name][1](self)
+        return self._results[name]
+
+    def replace(self, code):
+        self._code = code
+        self._results = {}
+        self._are_blocks_changed = False
+
+    def mark_blocks_changed(self):
+        self._are_blocks_changed = 'cfg' in self._results
+
+    def invalidate(self, names):
+        # The analyses that require an invalidated analysis are invalidated too.
+        names = set(names)
+        changed = True
+        while changed:
+            dependents = set(name for name, (requires, _) in _ANALYSES.items() if names.intersection(requires))
+            changed = not dependents <= names
+            names |= dependents
+        if 'cfg' in names and self._are_blocks_changed:
+            self._code = self.code
+        for name in names:
+            self._results.pop(name, None)
+
+    def quadruples(self):
+        # The quadruples of the code (as tuples, which can be compared).
+        return [(quad.operator, quad.operand_1, quad.operand_2, quad.result) for quad in self.code]
+
+
+class PassStatistics:
+    # The time spent by each pass (summed over the functions, also when they are optimized in parallel), the number of
+    # nodes or quadruples changed (added or removed) and the size of the code before and after the pass.
+    def __init__(self):
+        self._passes = {}
+
+    def __repr__(self):
+        return f"PassStatistics(<{len(self._passes)} PASSES>)"
+
+    def __str__(self):
+        lines = [f"{'pass':<20} {'time':>10} {'changed':>10} {'before':>10} {'after':>10}"]
+        for name, (level, elapsed, changed, before, after) in self._passes.items():
+            unit = 'nodes' if level == TREE else 'quadruples'
+            lines.append(f"{name:<20} {elapsed * 1000:>7.1f} ms {changed:>10} {before:>10} {after:>10} {unit}")
+        return '\n'.join(lines)
+
+    def add(self, optimization_pass, elapsed, changed, before, after):
+        # A pass that is run more than once (e.g. on each function) is summed.
+        level, total_elapsed, total_changed, total_before, total_after = self._passes.get(
+            optimization_pass.name, (optimization_pass.level, 0, 0, 0, 0))
+        self._passes[optimization_pass.name] = (level, total_elapsed + elapsed, total_changed + changed,
+                                                total_before + before, total_after + after)
+
+
+def _run_program_pass(intermediate_code, program_pass, statistics):
+    if statistics is None:
+        program_pass.run(intermediate_code)
+        return
+    before = collections.Counter(_get_program_quadruples(intermediate_code))
+    start = time.perf_counter()
+    program_pass.run(intermediate_code)
+    elapsed = time.perf_counter() - start
+    after = collections.Counter(_get_program_quadruples(intermediate_code))
+    changed = sum((before - after).values()) + sum((after - before).values())
+    statistics.add(program_pass, elapsed, changed, sum(before.values()), sum(after.values()))
+
+
+def _get_program_quadruples(intermediate_code):
+    return [(name, quad.operator, quad.operand_1, quad.operand_2, quad.result)
+            for name, code in intermediate_code.items() for quad in code]
+
+
+def _get_nodes(abstract_syntax_tree):
+    nodes = []
+    stack = [abstract_syntax_tree]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get_children())
+    return nodes
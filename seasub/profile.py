@@ -0,0 +1,110 @@
+"""
+The profile of the sea sub compiler.
+
+An instrumented program counts how many times each basic block is executed and appends the counts to a profile file
+when it exits, which is used to guide the optimizations of a later compilation of the same program.
+"""
+import struct
+import zlib
+
+from seasub import control_flow as cfg
+from seasub import intermediate_code_generator as icg
+
+# The file is a sequence of records, one per run of the instrumented program: magic, checksum and number of counters
+# followed by the counters (all 64 bit little endian).
+MAGIC = int.from_bytes(b'SEASUBPF', 'little')
+_WORD = struct.Struct('<Q')
+
+
+class Instrumentation:
+    # The counters of an instrumented program and where they are stored.
+    def __init__(self, file_path, checksum, counters):
+        self.file_path = file_path
+        self.checksum = checksum
+        self.counters = counters
+
+    def __repr__(self):
+        return f"Instrumentation({self.file_path}, {self.checksum:#x}, {self.counters})"
+
+
+def get_checksum(intermediate_code):
+    # Identifies the intermediate code the counters belong to, the profile of another (e.g. modified) program, or of
+    # the same program compiled with other options, does not match.
+    checksum = 0
+    for name, code in intermediate_code.items():
+        checksum = zlib.crc32(name.encode(), checksum)
+        for quad in code:
+            checksum = zlib.crc32(str(quad).encode(), checksum)
+    return checksum
+
+
+def insert_counters(intermediate_code, frequencies=None):
+    # Inserts a q_count quadruple first in each basic block (except the end block). The counters are numbered in the
+    # order of the blocks, so the same intermediate code always gets the same counters. If the frequencies (the counts
+    # of a profile) are given the q_count quadruples don't count anything, they only carry the frequency of the block
+    # through the optimizer. Returns the number of counters.
+    counter = 0
+    for name, code in intermediate_code.items():
+        new_code = icg.FunctionCode(code.function)
+        blocks = cfg.build_control_flow_graph(code)
+        for block in blocks:
+            if block.label is not None:
+                new_code.append(icg.Operator.q_label, block.label, None, None)
+            if _is_counted(block, blocks):
+                frequency = None if frequencies is None else frequencies[counter]
+                new_code.append(icg.Operator.q_count, counter, frequency, None)
+                counter += 1
+            for quad in block.quads:
+                new_code.append(*quad)
+        intermediate_code[name] = new_code
+    return counter
+
+
+def get_counters(intermediate_code):
+    # The number of counters that insert_counters inserts.
+    return sum(1 for code in intermediate_code.values() for blocks in [cfg.build_control_flow_graph(code)]
+               for block in blocks if _is_counted(block, blocks))
+
+
+def remove_counters(intermediate_code):
+    for name, code in intermediate_code.items():
+        new_code = icg.FunctionCode(code.function)
+        for quad in code:
+            if quad.operator != icg.Operator.q_count:
+                new_code.append(quad.operator, quad.operand_1, quad.operand_2, quad.result)
+        intermediate_code[name] = new_code
+
+
+def save_counts(file_path, checksum, counts):
+    with open(file_path, 'ab') as file:
+        file.write(b''.join(_WORD.pack(value) for value in (MAGIC, checksum, len(counts), *counts)))
+
+
+def load_counts(file_path, checksum, counters):
+    # The sum of the counts of all runs in the profile file, of a program with the given checksum and number of
+    # counters.
+    with open(file_path, 'rb') as file:
+        data = memoryview(file.read())
+    counts = [0] * counters
+    position = 0
+    while position < len(data):
+        if len(data) - position < 3 * _WORD.size:
+            raise ValueError(f"Profile '{file_path}' is truncated")
+        magic, record_checksum, size = (_WORD.unpack_from(data, position + offset)[0] for offset in (0, 8, 16))
+        position += 3 * _WORD.size
+        if magic != MAGIC:
+            raise ValueError(f"'{file_path}' is not a profile")
+        if record_checksum != checksum or size != counters:
+            raise ValueError(f"Profile '{file_path}' does not match the program")
+        if len(data) - position < size * _WORD.size:
+            raise ValueError(f"Profile '{file_path}' is truncated")
+        for index, (value,) in enumerate(_WORD.iter_unpack(data[position:position + size * _WORD.size])):
+            counts[index] += value
+        position += size * _WORD.size
+    return counts
+
+
+def _is_counted(block, blocks):
+    # Not the end block, which is executed as many times as the function is called (the interpreter even returns
+    # without passing it), nor an empty block following a jump at the end.
+    return block is not blocks[-1] and (block.label is not None or block.quads)
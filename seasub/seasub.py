@@ -1,6 +1,9 @@
 """
 The sea sub compiler.
 """
+import contextlib
+import gc
+import io
 import os
 import sys
 
@@ -8,32 +11,392 @@ from seasub import abstract_syntax_tree as ast
 from seasub import error_handler as err
 from seasub import intermediate_code_generator as icg
 from seasub import lexer
-from seasub import optimizer as opt
 from seasub import parser
+from seasub import pass_manager as pm
 from seasub import semantic_analyzer as sa
 from seasub import symbol_table as symtab
 from seasub import target_code_generator as tcg
+from seasub import x86
+
+# The stages that are only needed by some of the options (e.g. the optimizer, the assembler and the interpreter) are
+# imported when they are used, which keeps the start up time of the compiler low.
 
 
 def run(input_file_path, output_file_path, optimization_level,
-        ast_graph_path=None, symbol_table_graph_path=None, save_intermediate_code=False):
-    with open(input_file_path, 'r') as file:
-        source_code = file.read()
-    try:
-        token_stream = lexer.tokenize(source_code)
-        abstract_syntax_tree = parser.parse(token_stream)
-        symbol_table = symtab.attach_symbol_table(abstract_syntax_tree)
-        sa.analyze_semantics(abstract_syntax_tree)
-    except (err.SeaSubLexicalError, err.SeaSubSyntaxError, err.SeaSubSemanticError) as error:
-        sys.exit(f"Error: {error}")
-    if optimization_level > 0:
-        opt.optimize(abstract_syntax_tree)
-    intermediate_code = icg.generate_intermediate_code(abstract_syntax_tree)
-    target_code = tcg.generate(intermediate_code, symbol_table, input_file_path.name)
-    tcg.save_code(target_code, output_file_path)
+        ast_graph_path=None, symbol_table_graph_path=None, save_intermediate_code=False, omit_frame_pointer=False,
+        architecture='x86-64', output_format='assembly', profile_generate=None, profile_use=None, jobs=1,
+        max_errors=1, diagnostics_format='text', graph_functions=None, graph_depth=None, pass_stats=False,
+        memoize=False):
+    # The graphs only include the graph functions (names) and the nodes down to the graph depth, if given. With
+    # profile_generate (a file path) the program is instrumented to append its block counts to the file when main
+    # returns, with profile_use (a file path) the counts are used to guide the optimizations. With more than one job
+    # the functions are compiled in parallel (0 uses all processors), the output is the same as with one job. Up to
+    # max_errors errors (None for all) are reported before the compilation is stopped, the diagnostics are printed in
+    # the diagnostics format (see error_handler.format_diagnostics) and the process exits if there are errors. With
+    # pass_stats the statistics of the optimization passes (see pass_manager.PassStatistics) are printed. With memoize
+    # the pure recursive functions are memoized (see optimizer.memoize_recursive_functions), at any optimization level.
+    with _compile(input_file_path, optimization_level, omit_frame_pointer, architecture, profile_generate, profile_use,
+                  jobs, max_errors, diagnostics_format, pass_stats, memoize) as (abstract_syntax_tree, symbol_table,
+                                                                                 intermediate_code, target_code):
+        if output_format == 'object':
+            _save_object(target_code, output_file_path, input_file_path.name)
+        else:
+            tcg.save_code(target_code, output_file_path)
     if ast_graph_path:
-        ast.save_graph(abstract_syntax_tree, ast_graph_path)
+        ast.save_graph(abstract_syntax_tree, ast_graph_path, graph_functions, graph_depth)
     if symbol_table_graph_path:
-        symtab.save_graph(symbol_table, symbol_table_graph_path)
+        symtab.save_graph(symbol_table, symbol_table_graph_path, graph_functions, graph_depth)
     if save_intermediate_code:
         icg.save_code(intermediate_code, f'{os.path.splitext(input_file_path)[0]}.ic')
+
+
+def run_stream(input_file_path, output_file_path, optimization_level, save_intermediate_code=False,
+               omit_frame_pointer=False, architecture='x86-64', output_format='assembly', diagnostics_format='text',
+               pass_stats=False):
+    # As run, but the program is compiled one function at a time, each function is compiled and written before the
+    # next function is parsed. Only the declarations of the functions are kept for the whole program, so the memory
+    # usage does not grow with the number of functions. The output is the same as of run (an object file is however
+    # assembled as a whole). The graphs, profiles, parallel compilation and optimization level 2 (the interprocedural
+    # constant propagation) need the whole program and are not supported. The compilation is stopped at the first
+    # error.
+    with open(input_file_path, 'r') as file:
+        source_code = file.read()
+    intermediate_code_path = f'{os.path.splitext(input_file_path)[0]}.ic'
+    errors = err.ErrorLog(file=str(input_file_path))
+    statistics = pm.PassStatistics() if pass_stats else None
+    try:
+        with open(intermediate_code_path, 'w') if save_intermediate_code else contextlib.nullcontext() as ic_file:
+            function_codes = _compile_functions(source_code, optimization_level, architecture, ic_file, errors,
+                                                statistics)
+            target_code = tcg.generate(function_codes, input_file_path.name, omit_frame_pointer)
+            if output_format == 'object':
+                _save_object(target_code, output_file_path, input_file_path.name)
+            else:
+                tcg.save_code(target_code, output_file_path)
+        _report_pass_statistics(statistics)
+    except (err.SeaSubLexicalError, err.SeaSubSyntaxError, err.SeaSubSemanticError):
+        # The functions before the error have already been written, the incomplete output is removed.
+        for path in (output_file_path, intermediate_code_path if save_intermediate_code else None):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        _report(errors, diagnostics_format)
+
+
+def run_passes(input_file_path, output_file_path, passes, omit_frame_pointer=False, jobs=1, pass_stats=False):
+    # Runs the optimization passes of the intermediate code (names, see optimizer.PASSES) in the given order on the
+    # intermediate code of a file, e.g. as saved by run, and writes the intermediate code (.ic), the target code (.s)
+    # or an object file (.o) as given by the extension of the output file. Exits if the intermediate code is not valid.
+    try:
+        intermediate_code = icg.load_code(input_file_path)
+    except ValueError as error:
+        sys.exit(f"Error: {error} of '{input_file_path}'")
+    extension = os.path.splitext(output_file_path)[1]
+    statistics = pm.PassStatistics() if pass_stats else None
+    with _get_workers(jobs, []) as workers:
+        pm.run_code_passes(intermediate_code, pm.get_passes(passes), workers, statistics)
+        _report_pass_statistics(statistics)
+        if extension == '.ic':
+            icg.save_code(intermediate_code, output_file_path)
+            return
+        target_code = tcg.generate(list(intermediate_code.values()), os.path.basename(input_file_path),
+                                   omit_frame_pointer, workers=workers)
+        if extension == '.o':
+            _save_object(target_code, output_file_path, os.path.basename(input_file_path))
+        else:
+            tcg.save_code(target_code, output_file_path)
+
+
+def execute(input_file_path, optimization_level, omit_frame_pointer=False, architecture='x86-64',
+            profile_generate=None, profile_use=None, jobs=1, max_errors=1, diagnostics_format='text', pass_stats=False,
+            memoize=False):
+    # Compiles the program into the memory of this process and runs it, returns the value returned by main. The first
+    # parameter of main (argc) is 1, i.e. the program is run without arguments, any other parameters are zero (or
+    # empty arrays).
+    from seasub import jit
+    with _compile(input_file_path, optimization_level, omit_frame_pointer, architecture, profile_generate, profile_use,
+                  jobs, max_errors, diagnostics_format, pass_stats, memoize) as (_, symbol_table, intermediate_code,
+                                                                                 target_code):
+        program = jit.load(target_code, [code.function for code in intermediate_code.values()])
+    try:
+        return program.call('main', *_get_main_arguments(symbol_table['main']))
+    finally:
+        program.close()
+
+
+def interpret(input_file_path, optimization_level, architecture='x86-64', profile_generate=None, profile_use=None,
+              jobs=1, max_errors=1, diagnostics_format='text', pass_stats=False, memoize=False):
+    # As execute, but runs the intermediate code in the interpreter instead (no target code is generated). A runtime
+    # error of the program is reported as a diagnostic. The interpreter runs the memoized functions as they are.
+    from seasub import interpreter
+    abstract_syntax_tree, symbol_table, errors = _analyze(input_file_path, max_errors, diagnostics_format)
+    statistics = pm.PassStatistics() if pass_stats else None
+    with _get_workers(jobs, abstract_syntax_tree.functions) as workers:
+        intermediate_code, instrumentation = _generate_intermediate_code(
+            abstract_syntax_tree, optimization_level, architecture, profile_generate, profile_use, workers, errors,
+            statistics, memoize)
+    _report(errors, diagnostics_format)
+    _report_pass_statistics(statistics)
+    program = interpreter.load(intermediate_code, instrumentation.counters if instrumentation else 0)
+    try:
+        value = program.call('main', *_get_main_arguments(symbol_table['main']))
+    except err.SeaSubRuntimeError as error:
+        error.file = str(input_file_path)
+        sys.exit(err.format_diagnostics([error], diagnostics_format))
+    if instrumentation is not None:
+        from seasub import profile
+        profile.save_counts(instrumentation.file_path, instrumentation.checksum, program.counters)
+    return value
+
+
+def compile_source(source_code, optimization_level, file_name='<source>', omit_frame_pointer=False,
+                   architecture='x86-64', output_format='assembly', save_intermediate_code=False, jobs=1,
+                   max_errors=None, memoize=False):
+    # Compiles the source code in memory, no files are read or written and the process never exits, which allows many
+    # programs to be compiled by one process. Returns a Compilation with the output (and the intermediate code if
+    # saved) of a successful compilation and the diagnostics. The file name is only used in the diagnostics and the
+    # object file. Up to max_errors errors (None for all) are reported.
+    abstract_syntax_tree, _, errors = _analyze_source(source_code, file_name, max_errors)
+    if errors.error_count:
+        return Compilation(list(errors))
+    with _get_workers(jobs, abstract_syntax_tree.functions) as workers:
+        intermediate_code, _ = _generate_intermediate_code(abstract_syntax_tree, optimization_level, architecture, None,
+                                                           None, workers, errors, memoize=memoize)
+        target_code = tcg.generate(list(intermediate_code.values()), file_name, omit_frame_pointer, workers=workers)
+        if output_format == 'object':
+            from seasub import assembler as asm
+            from seasub import elf
+            output = elf.get_object(asm.assemble(target_code), file_name)
+        else:
+            output = io.StringIO()
+            tcg.write_code(target_code, output)
+            output = output.getvalue()
+    intermediate_code_text = None
+    if save_intermediate_code:
+        intermediate_code_text = io.StringIO()
+        icg.write_code(intermediate_code, intermediate_code_text)
+        intermediate_code_text = intermediate_code_text.getvalue()
+    return Compilation(list(errors), output, intermediate_code_text)
+
+
+class Compilation:
+    # The result of compile_source: the diagnostics (see error_handler.Diagnostic), and the output (the assembly code
+    # as a string, or the object file as bytes) and the intermediate code (a string, if saved) that are None if the
+    # compilation failed.
+    def __init__(self, diagnostics, output=None, intermediate_code=None):
+        self.diagnostics = diagnostics
+        self.output = output
+        self.intermediate_code = intermediate_code
+
+    def __repr__(self):
+        return f"Compilation(<{len(self.diagnostics)} DIAGNOSTICS>, {'failed' if self.output is None else 'succeeded'})"
+
+    @property
+    def succeeded(self):
+        return self.output is not None
+
+
+def _save_object(target_code, file_path, source_name):
+    from seasub import assembler as asm
+    from seasub import elf
+    elf.save_object(asm.assemble(target_code), file_path, source_name)
+
+
+def _get_main_arguments(main):
+    arguments = [[] if parameter.type.endswith('[]') else 0 for parameter in main.parameters]
+    if arguments and arguments[0] == 0:
+        arguments[0] = 1
+    return arguments
+
+
+@contextlib.contextmanager
+def _compile(input_file_path, optimization_level, omit_frame_pointer, architecture, profile_generate, profile_use,
+             jobs, max_errors, diagnostics_format, pass_stats, memoize):
+    # The target code is generated as it is consumed, which must be done before the workers are shut down.
+    abstract_syntax_tree, symbol_table, errors = _analyze(input_file_path, max_errors, diagnostics_format)
+    statistics = pm.PassStatistics() if pass_stats else None
+    with _get_workers(jobs, abstract_syntax_tree.functions) as workers:
+        intermediate_code, instrumentation = _generate_intermediate_code(
+            abstract_syntax_tree, optimization_level, architecture, profile_generate, profile_use, workers, errors,
+            statistics, memoize)
+        _report(errors, diagnostics_format)
+        _report_pass_statistics(statistics)
+        yield abstract_syntax_tree, symbol_table, intermediate_code, tcg.generate(
+            list(intermediate_code.values()), input_file_path.name, omit_frame_pointer, instrumentation, workers)
+
+
+def _analyze(input_file_path, max_errors, diagnostics_format):
+    # Exits if there are errors.
+    with open(input_file_path, 'r') as file:
+        source_code = file.read()
+    abstract_syntax_tree, symbol_table, errors = _analyze_source(source_code, str(input_file_path), max_errors)
+    _report(errors, diagnostics_format)
+    return abstract_syntax_tree, symbol_table, errors
+
+
+def _analyze_source(source_code, file_name, max_errors):
+    # All errors (up to max_errors) are collected, the semantic analysis is done also after syntax errors (on the
+    # recovered syntax tree) to find as many errors as possible in one compilation. The syntax tree is incomplete if
+    # there are errors.
+    errors = err.ErrorLog(max_errors, file_name)
+    abstract_syntax_tree = symbol_table = None
+    try:
+        token_stream = lexer.tokenize(source_code, errors)
+        abstract_syntax_tree = parser.parse(token_stream, errors)
+        symbol_table = symtab.attach_symbol_table(abstract_syntax_tree)
+        symtab.resolve_symbols(abstract_syntax_tree, symbol_table)
+        sa.analyze_semantics(abstract_syntax_tree, errors, is_complete=errors.error_count == 0)
+    except (err.SeaSubLexicalError, err.SeaSubSyntaxError, err.SeaSubSemanticError):
+        pass  # The error log is full.
+    return abstract_syntax_tree, symbol_table, errors
+
+
+def _report(errors, diagnostics_format):
+    # Prints the diagnostics of the error log (if any), and exits if there are errors.
+    diagnostics = list(errors)
+    if not diagnostics:
+        return
+    report = err.format_diagnostics(diagnostics, diagnostics_format)
+    if errors.error_count == 0:
+        print(report, file=sys.stderr)
+        return
+    if errors.is_full and errors.max_errors > 1 and diagnostics_format == 'text':
+        report += f"\nError: Stopped after {errors.max_errors} errors"
+    sys.exit(report)
+
+
+def _compile_functions(source_code, optimization_level, architecture, intermediate_code_file, errors, statistics):
+    # Yields the (optimized) intermediate code of one function at a time. The functions are first declared from their
+    # signatures, which lets a function call the functions that are defined after it. The passes of the whole program
+    # are skipped, the inlining does nothing without a profile and the constant propagation (of optimization level 2)
+    # is not supported.
+    tree_passes, code_passes = _get_pipeline(optimization_level)
+    code_passes = [code_pass for code_pass in code_passes if code_pass.level == pm.FUNCTION]
+    options = {'vector_size': x86.get_vector_size(x86.get_features(architecture))}
+    symbol_table = _declare_functions(source_code, errors)
+    for function_definition in parser.parse_function_definitions(lexer.tokenize(source_code, errors), errors):
+        symtab.attach_function_symbol_table(function_definition, symbol_table)
+        sa.analyze_semantics(function_definition, errors)
+        pm.run_tree_passes(function_definition, tree_passes, options, statistics)
+        code, records = pm.run_function_passes(icg.generate_function_code(function_definition), code_passes,
+                                               statistics is not None)
+        for record in records:
+            statistics.add(*record)
+        if intermediate_code_file is not None:
+            icg.write_code({function_definition.identifier: code}, intermediate_code_file)
+        symtab.detach_function_symbol_table(function_definition, symbol_table)
+        yield code
+
+
+def _declare_functions(source_code, errors):
+    # The global scope with the declarations of the functions, the syntax tree of the signatures is not kept.
+    signatures = parser.parse_signatures(lexer.tokenize(source_code, errors), errors)
+    symbol_table = symtab.attach_symbol_table(signatures)
+    symtab.resolve_symbols(signatures, symbol_table)
+    sa.analyze_semantics(signatures, errors)
+    return symbol_table
+
+
+@contextlib.contextmanager
+def _get_workers(jobs, function_definitions):
+    # A map-like callable that processes the functions of the program, using a pool of processes if more than one job.
+    # The results are in the order of the functions, and the temporaries and labels are numbered per function, so the
+    # output does not depend on the number of jobs. The function definitions are given to each process once when it
+    # starts (inherited when the processes are forked), since every node refers to the scopes of the symbol table,
+    # which makes the definitions expensive to transfer with each task.
+    if jobs == 1:
+        _share_function_definitions(function_definitions)
+        try:
+            yield map
+        finally:
+            _share_function_definitions(None)
+        return
+    import concurrent.futures as cf
+    jobs = jobs or os.cpu_count()
+    # The garbage collection is paused meanwhile, it would otherwise run over and over (through all objects of the
+    # compiler) as the many objects of the results are unpickled. A few chunks per process balances the load while
+    # keeping the number of transfers low.
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with cf.ProcessPoolExecutor(jobs, initializer=_initialize_worker,
+                                    initargs=(function_definitions,)) as executor:
+            yield lambda function, items: executor.map(function, items, chunksize=max(1, len(items) // (4 * jobs)))
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+_function_definitions = None  # The function definitions shared with the workers, see _get_workers.
+
+
+def _initialize_worker(function_definitions):
+    # The objects inherited from the main process are excluded from the garbage collection of the worker, they are
+    # never garbage and collecting them would only take time (and copy their memory pages).
+    gc.freeze()
+    _share_function_definitions(function_definitions)
+
+
+def _share_function_definitions(function_definitions):
+    global _function_definitions
+    _function_definitions = function_definitions
+
+
+def _generate_intermediate_code(abstract_syntax_tree, optimization_level, architecture, profile_generate, profile_use,
+                                workers, errors, statistics=None, memoize=False):
+    # After the semantic analysis the functions are independent of each other until the (interprocedural) profile
+    # guided optimizations, the intermediate code is generated (and optimized) per function by the workers. The
+    # symbols of the code returned by a worker process are copies. The counters are inserted before the intermediate
+    # code is optimized so that the counters of the instrumented program and the program using the profile are the
+    # same, given the same source code and options. The pipeline of the optimization level (see
+    # pass_manager.PIPELINES) is run, the passes of the syntax tree before the intermediate code is generated.
+    tree_passes, code_passes = _get_pipeline(optimization_level, memoize)
+    options = {'vector_size': x86.get_vector_size(x86.get_features(architecture))}
+    pm.run_tree_passes(abstract_syntax_tree, tree_passes, options, statistics)
+    if profile_generate is not None or profile_use is not None:
+        from seasub import profile
+    names = [function_definition.identifier for function_definition in abstract_syntax_tree.functions]
+    intermediate_code = dict(zip(names, workers(_generate_function_code, range(len(names)))))
+    instrumentation = None
+    uses_profile = False
+    if profile_generate is not None:
+        checksum = profile.get_checksum(intermediate_code)
+        counters = profile.insert_counters(intermediate_code)
+        instrumentation = profile.Instrumentation(os.path.abspath(profile_generate), checksum, counters)
+    elif profile_use is not None and optimization_level > 0:
+        uses_profile = _insert_profile(intermediate_code, profile_use, errors)
+    pm.run_code_passes(intermediate_code, code_passes, workers, statistics)
+    if uses_profile:
+        profile.remove_counters(intermediate_code)
+    return intermediate_code, instrumentation
+
+
+def _get_pipeline(optimization_level, memoize=False):
+    # The passes of the syntax tree and the passes of the intermediate code of the optimization level. The memoization
+    # is run last, after any inlining.
+    passes = pm.get_passes(pm.PIPELINES[optimization_level][1] + (['memoize'] if memoize else []))
+    return ([tree_pass for tree_pass in passes if tree_pass.level == pm.TREE],
+            [code_pass for code_pass in passes if code_pass.level != pm.TREE])
+
+
+def _report_pass_statistics(statistics):
+    if statistics is not None:
+        print(statistics, file=sys.stderr)
+
+
+def _generate_function_code(index):
+    return icg.generate_function_code(_function_definitions[index])
+
+
+def _insert_profile(intermediate_code, profile_path, errors):
+    # A profile that is missing or does not match the program is ignored (with a warning in the error log), the
+    # program is then compiled as without a profile.
+    from seasub import profile
+    checksum = profile.get_checksum(intermediate_code)
+    counters = profile.get_counters(intermediate_code)
+    try:
+        counts = profile.load_counts(profile_path, checksum, counters)
+    except (OSError, ValueError) as error:
+        errors.warn(err.SeaSubProfileWarning(f"Ignoring the profile, {error}", 'W501'))
+        return False
+    profile.insert_counters(intermediate_code, counts)
+    return True
@@ -6,21 +6,32 @@ from seasub import error_handler as err
 from seasub import symbol_table as symtab
 
 
-def analyze_semantics(abstract_syntax_tree):
-    _SemanticAnalyzerDeclaredIdentifiers().visit(abstract_syntax_tree)
-    _SemanticAnalyzerTypes().visit(abstract_syntax_tree)
+_LOGICAL_OPERATORS = ('<', '<=', '>', '>=', '==', '!=', '&&', '||', '!')
+
+
+def analyze_semantics(abstract_syntax_tree, errors=None, is_complete=True):
+    # The semantic errors are reported to the error log (see error_handler.ErrorLog), the analysis continues after an
+    # error as long as the log is not full. The type of an erroneous expression is unknown (None), which is accepted
+    # everywhere, so an error is not reported again by each enclosing expression. The tree of a program with syntax
+    # errors is incomplete (see parser.parse), the absence of main is then not reported.
+    if errors is None:
+        errors = err.ErrorLog()
+    _SemanticAnalyzerDeclaredIdentifiers(errors, is_complete).visit(abstract_syntax_tree)
+    _SemanticAnalyzerTypes(errors).visit(abstract_syntax_tree)
 
 
 class _SemanticAnalyzerDeclaredIdentifiers(ast.NodeVisitor):
-    def __init__(self):
+    def __init__(self, errors, is_complete):
         super().__init__()
+        self._errors = errors
+        self._is_complete = is_complete
         self._has_main = None
 
     def _visit_TranslationUnit(self, node):
         self._has_main = False
         self._generic_visit(node)
-        if not self._has_main:
-            raise err.SeaSubSemanticError("Definition of 'main' function is missing")
+        if not self._has_main and self._is_complete:
+            self._errors.report(err.SeaSubSemanticError("Definition of 'main' function is missing", 'E301'))
 
     def _visit_FunctionDefinition(self, node):
         if node.identifier == 'main':
@@ -28,85 +39,130 @@ class _SemanticAnalyzerDeclaredIdentifiers(ast.NodeVisitor):
         self._generic_visit(node)
 
     def _visit_Assignment(self, node):
-        self._verify_identifier_declared(node.identifier, node.symbol_table, node.token.line, node.token.column)
+        self._verify_identifier_declared(node.identifier, node.symbol, node.token)
         self._generic_visit(node)
 
     def _visit_Identifier(self, node):
-        self._verify_identifier_declared(node.name, node.symbol_table, node.token.line, node.token.column)
+        self._verify_identifier_declared(node.name, node.symbol, node.token)
         self._generic_visit(node)
 
-    @staticmethod
-    def _verify_identifier_declared(identifier, symbol_table, line, column):
-        try:
-            symbol_table[identifier]
-        except KeyError as error:
-            raise err.SeaSubSemanticError(f"Undeclared identifier '{identifier}' on line {line}:{column}") from error
+    def _verify_identifier_declared(self, identifier, symbol, token):
+        if symbol is None:
+            self._errors.report(err.SeaSubSemanticError(f"Undeclared identifier '{identifier}'", 'E302', token.line,
+                                                        token.column))
 
 
 class _SemanticAnalyzerTypes(ast.NodeVisitor):
-    def __init__(self):
+    def __init__(self, errors):
         super().__init__()
+        self._errors = errors
         self._current_function = None
 
     def _visit_FunctionDefinition(self, node):
-        self._current_function = node.symbol_table[node.identifier]
+        self._current_function = node.symbol
         self._generic_visit(node)
         self._current_function = None
 
     def _visit_FunctionCall(self, node):
-        function = node.symbol_table[node.identifier.name]
-        if not isinstance(function, symtab.Function):
-            raise err.SeaSubSemanticError((f"Called object '{node.identifier.name}' is not a function "
-                                           f"on line {node.token.line}:{node.token.column}"))
-        parameters = function.parameters
-        num_arguments = len(node.arguments)
-        num_parameters = len(parameters)
-        if num_arguments != num_parameters:
-            raise err.SeaSubSemanticError((f"Calling function '{node.identifier.name}' with incorrect number of "
-                                           f"arguments, expected {num_parameters} got {num_arguments}, "
-                                           f"on line {node.token.line}:{node.token.column}"))
-        for i, (arg, param) in enumerate(zip(node.arguments, parameters)):
+        function = node.identifier.symbol
+        parameters = None
+        if function is not None and not isinstance(function, symtab.Function):
+            self._report('E303', f"Called object '{node.identifier.name}' is not a function", node.token)
+            function = None
+        elif function is not None:
+            parameters = function.parameters
+            num_arguments = len(node.arguments)
+            num_parameters = len(parameters)
+            if num_arguments != num_parameters:
+                self._report('E304', (f"Calling function '{node.identifier.name}' with incorrect number of "
+                                      f"arguments, expected {num_parameters} got {num_arguments}"), node.token)
+                parameters = None
+        for i, arg in enumerate(node.arguments):
             arg_type = self.visit(arg)
-            if arg_type != param.type:
-                raise err.SeaSubSemanticError((f"Calling function '{node.identifier.name}' with invalid type for "
-                                               f"parameter {i + 1}, expected '{param.type}' got '{arg_type}', "
-                                               f"on line {arg.token.line}:{arg.token.column}"))
-        return self.visit(node.identifier)
+            if parameters is not None and not _is_compatible(arg_type, parameters[i].type):
+                self._report('E305', (f"Calling function '{node.identifier.name}' with invalid type for "
+                                      f"parameter {i + 1}, expected '{parameters[i].type}' got '{arg_type}'"),
+                             arg.token)
+        return None if function is None else function.type
 
     def _visit_ReturnStatement(self, node):
         return_type = self.visit(node.value)
-        if return_type != self._current_function.type:
-            raise err.SeaSubSemanticError((f"Invalid return type for function '{self._current_function.name}', "
-                                           f"expected '{self._current_function.type}' got '{return_type}', "
-                                           f"on line {node.value.token.line}:{node.value.token.column}"))
+        if not _is_compatible(return_type, self._current_function.type):
+            self._report('E306', (f"Invalid return type for function '{self._current_function.name}', "
+                                  f"expected '{self._current_function.type}' got '{return_type}'"), node.value.token)
+
+    def _visit_Declaration(self, node):
+        if node.length == 0:
+            self._report('E307', f"Declaring array '{node.identifier}' of length zero", node.token)
 
     def _visit_Assignment(self, node):
-        identifier = node.symbol_table[node.identifier]
-        if not isinstance(identifier, (symtab.Variable, symtab.Parameter)):
-            raise err.SeaSubSemanticError((f"Assigning to an object that is not a variable "
-                                           f"on line {node.token.line}:{node.token.column}"))
-        identifier_type = identifier.type
+        identifier = node.symbol
+        if identifier is not None and not isinstance(identifier, (symtab.Variable, symtab.Parameter)):
+            self._report('E308', "Assigning to an object that is not a variable", node.token)
+            identifier = None
+        identifier_type = None if identifier is None else identifier.type
+        if node.index is not None:
+            identifier_type = self._get_element_type(identifier_type, node.index, node.token)
+        elif _is_array(identifier_type):
+            self._report('E309', f"Assigning to array '{node.identifier}'", node.token)
+            identifier_type = None
         value_type = self.visit(node.value)
-        if identifier_type != value_type:
-            raise err.SeaSubSemanticError((f"Assigning value of type '{value_type}'' to variable of type "
-                                           f"'{identifier_type}' on line {node.token.line}:{node.token.column}"))
+        if not _is_compatible(identifier_type, value_type):
+            self._report('E310', f"Assigning value of type '{value_type}' to variable of type '{identifier_type}'",
+                         node.token)
 
     def _visit_BinaryOperator(self, node):
         a_type = self.visit(node.a)
         b_type = self.visit(node.b)
-        if a_type != b_type:
-            raise err.SeaSubSemanticError((f"Applying binary operator '{node.operator}' with incompatible types "
-                                           f"'{a_type}' and '{b_type}' on line {node.token.line}:{node.token.column}"))
-        return a_type
+        if _is_array(a_type) or _is_array(b_type):
+            self._report('E311', f"Applying binary operator '{node.operator}' to an array", node.token)
+            return None
+        if not _is_compatible(a_type, b_type) and node.operator not in ('&&', '||'):  # The operands are only tested.
+            self._report('E312', (f"Applying binary operator '{node.operator}' with incompatible types "
+                                  f"'{a_type}' and '{b_type}'"), node.token)
+            return None
+        if node.operator in _LOGICAL_OPERATORS:  # The result of a comparison or a logical operator is an int (0 or 1).
+            return 'int'
+        return b_type if a_type is None else a_type
 
     def _visit_UnaryOperator(self, node):
-        return self.visit(node.a)
+        a_type = self.visit(node.a)
+        if _is_array(a_type):
+            self._report('E313', f"Applying unary operator '{node.operator}' to an array", node.token)
+            return None
+        if node.operator in _LOGICAL_OPERATORS:
+            return 'int'
+        return a_type
+
+    def _visit_Subscript(self, node):
+        return self._get_element_type(self.visit(node.identifier), node.index, node.token)
 
     def _visit_Identifier(self, node):
-        return node.symbol_table[node.name].type
+        return None if node.symbol is None else node.symbol.type
 
     def _visit_IntegerConstant(self, node):
         return 'int'
 
     def _visit_RealConstant(self, node):
         return 'double'
+
+    def _get_element_type(self, array_type, index, token):
+        if array_type is not None and not _is_array(array_type):
+            self._report('E314', "Subscripted value is not an array", token)
+            array_type = None
+        index_type = self.visit(index)
+        if not _is_compatible(index_type, 'int'):
+            self._report('E315', f"Array subscript of type '{index_type}' is not an integer", index.token)
+        return None if array_type is None else array_type[:-2]
+
+    def _report(self, code, message, token):
+        self._errors.report(err.SeaSubSemanticError(message, code, token.line, token.column))
+
+
+def _is_array(symbol_type):
+    return symbol_type is not None and symbol_type.endswith('[]')
+
+
+def _is_compatible(type_a, type_b):
+    # An unknown type (of an erroneous expression) is compatible with any type.
+    return type_a is None or type_b is None or type_a == type_b
@@ -0,0 +1,493 @@
+"""
+The serialization of the sea sub compiler.
+
+A compact, versioned binary format of the abstract syntax tree, the symbol table and the intermediate code, for caching
+them on disk or transferring them between processes. Unlike pickle, only the structures themselves are stored, not the
+back references (e.g. from every node of the tree to its scope) or the classes. The data starts with a magic number of
+the structure and the version of the format, followed by a table of the values (names, constants, labels), each stored
+once, and the structure as records and arrays of integers that refer to the values and to each other. All numbers are
+little endian. The data is read through a memoryview and is never copied as a whole, so e.g. a memory mapped file can
+be loaded directly.
+"""
+import array
+import contextlib
+import gc
+import struct
+import sys
+
+from seasub import abstract_syntax_tree as ast
+from seasub import intermediate_code_generator as icg
+from seasub import lexer
+from seasub import symbol_table as symtab
+
+VERSION = 1
+
+_SYNTAX_TREE = b'SSAT'
+_SYMBOL_TABLE = b'SSST'
+_INTERMEDIATE_CODE = b'SSIC'
+
+_HEADER = struct.Struct('<4sI')
+_COUNT = struct.Struct('<I')
+_NODE = struct.Struct('<8i')  # Kind, token type, token value, line, column and three fields of the kind.
+_SYMBOL = struct.Struct('<5i')  # Kind, name, type, length and index.
+_SCOPE = struct.Struct('<3i')  # Name, outer scope and number of symbols.
+_CODE = struct.Struct('<4i')  # Name, function, number of quadruples and number of operands.
+
+# The kinds of the values, nodes and symbols, their order is part of the format.
+_NONE, _INT, _FLOAT, _STR, _BIG_INT, _BOOL = range(6)
+_NODES = (ast.NoOperation, ast.TranslationUnit, ast.FunctionDefinition, ast.Parameter, ast.FunctionCall,
+          ast.ReturnStatement, ast.CompoundStatement, ast.Declaration, ast.Assignment, ast.IfStatement,
+          ast.WhileStatement, ast.ForStatement, ast.BinaryOperator, ast.UnaryOperator, ast.Subscript, ast.Identifier,
+          ast.IntegerConstant, ast.RealConstant)
+_SYMBOLS = (symtab.BuiltinType, symtab.Function, symtab.Parameter, symtab.Variable, symtab.Array, symtab.Temporary)
+
+_NO_REFERENCE = -1
+
+
+def dump_syntax_tree(abstract_syntax_tree):
+    # The tree as given by the parser, i.e. without the symbol table and the symbols of the nodes (and the annotations
+    # of the optimizer). Attach the symbol table and resolve the symbols again after loading it.
+    values = _ValueTable()
+    nodes = _SyntaxTreeEncoder(values).encode(abstract_syntax_tree)
+    return b''.join((_HEADER.pack(_SYNTAX_TREE, VERSION), values.encode(), _COUNT.pack(len(nodes)), *nodes))
+
+
+def load_syntax_tree(data):
+    reader = _Reader(data, _SYNTAX_TREE, 'syntax tree')
+    with _paused_garbage_collection():
+        values = reader.values()
+        return _SyntaxTreeDecoder(values).decode(reader.records(_NODE))
+
+
+def dump_symbol_table(symbol_table):
+    # The global scope and all its inner scopes, and the symbols of the scopes.
+    values = _ValueTable()
+    symbols = _SymbolEncoder(values)
+    scopes = []
+    entries = array.array('i')
+
+    def add_scope(scope, outer_id):
+        scope_id = len(scopes)
+        scopes.append(_SCOPE.pack(values.add(scope.name), outer_id, len(scope.symbols)))
+        for key, symbol in scope.symbols.items():
+            entries.extend((values.add(key), symbols.add(symbol)))
+        for inner in scope.inner:
+            add_scope(inner, scope_id)
+
+    add_scope(symbol_table, _NO_REFERENCE)
+    symbols = symbols.encode()  # Before the values, which it adds to.
+    return b''.join((_HEADER.pack(_SYMBOL_TABLE, VERSION), values.encode(), symbols, _encode_array(entries),
+                     _COUNT.pack(len(scopes)), *scopes))
+
+
+def load_symbol_table(data):
+    reader = _Reader(data, _SYMBOL_TABLE, 'symbol table')
+    with _paused_garbage_collection():
+        values = reader.values()
+        symbols = _decode_symbols(reader, values)
+        entries = iter(reader.array('i'))
+        scopes = []
+        for name, outer_id, count in reader.records(_SCOPE):
+            scope = symtab.SymbolTable(values[name], None if outer_id == _NO_REFERENCE else scopes[outer_id])
+            for _ in range(count):
+                key, symbol = next(entries), next(entries)
+                scope[values[key]] = symbols[symbol]
+            scopes.append(scope)
+    return scopes[0]
+
+
+def dump_intermediate_code(intermediate_code):
+    # The code of the functions (a dict of function codes by name). The symbols are stored once for all functions, so
+    # a symbol (e.g. a called function) is still the same object in the code of all functions after loading it.
+    values = _ValueTable()
+    symbols = _SymbolEncoder(values)
+    codes = []
+    for name, code in intermediate_code.items():
+        operators, operands_1, operands_2, results, operands = code.columns
+        # The constants and labels refer to the values and the symbols to the symbols, as negative numbers.
+        references = array.array('i', (-symbols.add(operand) - 1 if isinstance(operand, symtab.Symbol)
+                                       else values.add(operand) for operand in operands))
+        header = _CODE.pack(values.add(name), symbols.add(code.function), len(operators), len(references))
+        codes.append(b''.join((header, operators.tobytes(), _to_bytes(references), _to_bytes(operands_1),
+                               _to_bytes(operands_2), _to_bytes(results))))
+    symbols = symbols.encode()
+    return b''.join((_HEADER.pack(_INTERMEDIATE_CODE, VERSION), values.encode(), symbols,
+                     _COUNT.pack(len(codes)), *codes))
+
+
+def load_intermediate_code(data):
+    reader = _Reader(data, _INTERMEDIATE_CODE, 'intermediate code')
+    intermediate_code = {}
+    with _paused_garbage_collection():
+        values = reader.values()
+        symbols = _decode_symbols(reader, values)
+        for _ in range(reader.count()):
+            name, function, length, operand_count = _CODE.unpack(reader.take(_CODE.size))
+            operators = _from_bytes('B', reader.take(length))
+            operands = [symbols[-reference - 1] if reference < 0 else values[reference]
+                        for reference in _from_bytes('i', reader.take(4 * operand_count))]
+            operands_1, operands_2, results = (_from_bytes('i', reader.take(4 * length)) for _ in range(3))
+            intermediate_code[values[name]] = icg.FunctionCode.from_columns(symbols[function], operators, operands_1,
+                                                                            operands_2, results, operands)
+    return intermediate_code
+
+
+class _ValueTable:
+    # The values (None, numbers and strings) of a structure, each stored once and referred to by its index.
+    def __init__(self):
+        self._values = []
+        self._ids = {}
+
+    def add(self, value):
+        # The strings (most values) are their own keys, the type is part of the other keys to not mix up e.g. 1, 1.0
+        # and True, and the floats are keyed by their exact representation to not mix up 0.0 and -0.0.
+        value_type = type(value)
+        key = value if value_type is str else (value_type, value.hex() if value_type is float else value)
+        value_id = self._ids.get(key)
+        if value_id is None:
+            value_id = len(self._values)
+            self._ids[key] = value_id
+            self._values.append(value)
+        return value_id
+
+    def encode(self):
+        # The kinds of the values, followed by the integers, the floats and the lengths of the (utf-8 encoded) strings
+        # with the strings themselves.
+        kinds = array.array('B')
+        integers = array.array('q')
+        floats = array.array('d')
+        lengths = array.array('I')
+        strings = []
+        for value in self._values:
+            if value is None:
+                kinds.append(_NONE)
+            elif isinstance(value, bool):
+                kinds.append(_BOOL)
+                integers.append(value)
+            elif isinstance(value, int):
+                if -2**63 <= value < 2**63:
+                    kinds.append(_INT)
+                    integers.append(value)
+                else:
+                    kinds.append(_BIG_INT)
+                    strings.append(str(value).encode())
+                    lengths.append(len(strings[-1]))
+            elif isinstance(value, float):
+                kinds.append(_FLOAT)
+                floats.append(value)
+            elif isinstance(value, str):
+                kinds.append(_STR)
+                strings.append(value.encode())
+                lengths.append(len(strings[-1]))
+            else:
+                raise TypeError(f"Can't serialize the value {value!r}")
+        strings = b''.join(strings)
+        return b''.join((_encode_array(kinds), _encode_array(integers), _encode_array(floats), _encode_array(lengths),
+                         _COUNT.pack(len(strings)), strings))
+
+
+class _SymbolEncoder:
+    # The symbols of a structure, each stored once and referred to by its index. The parameters and variables of the
+    # functions are added with the functions.
+    def __init__(self, values):
+        self._values = values
+        self._symbols = []
+        self._ids = {}
+        self._members = array.array('i')
+        self._kinds = {symbol: kind for kind, symbol in enumerate(_SYMBOLS)}
+
+    def add(self, symbol):
+        symbol_id = self._ids.get(id(symbol))
+        if symbol_id is None:
+            symbol_id = len(self._symbols)
+            self._ids[id(symbol)] = symbol_id
+            self._symbols.append(symbol)
+            if isinstance(symbol, symtab.Function):
+                members = [self.add(member) for member in (*symbol.parameters, *symbol.variables)]
+                self._members.extend((symbol_id, len(symbol.parameters), len(symbol.variables), *members))
+        return symbol_id
+
+    def encode(self):
+        records = []
+        for symbol in self._symbols:
+            index = getattr(symbol, 'index', None)
+            records.append(_SYMBOL.pack(self._kinds[type(symbol)], self._values.add(symbol.name),
+                                        self._values.add(getattr(symbol, 'type', None)),
+                                        self._values.add(getattr(symbol, 'length', None)),
+                                        _NO_REFERENCE if index is None else index))
+        return b''.join((_COUNT.pack(len(records)), *records, _encode_array(self._members)))
+
+
+def _decode_symbols(reader, values):
+    symbols = []
+    indices = []
+    for kind, name, symbol_type, length, index in reader.records(_SYMBOL):
+        kind = _SYMBOLS[kind]
+        if kind is symtab.BuiltinType:
+            symbols.append(kind(values[name]))
+        elif kind is symtab.Array:
+            symbols.append(kind(values[name], values[symbol_type], values[length]))
+        else:
+            symbols.append(kind(values[name], values[symbol_type]))
+        indices.append(index)
+    members = reader.array('i')
+    position = 0
+    while position < len(members):
+        function, parameters, variables = members[position:position + 3]
+        position += 3
+        for member in members[position:position + parameters]:
+            symbols[function].add_parameter(symbols[member])
+        position += parameters
+        for member in members[position:position + variables]:
+            symbols[function].add_variable(symbols[member])
+        position += variables
+    # The indices are restored as stored, also of the symbols that are not members of a function (e.g. copies made by
+    # the optimizer).
+    for symbol, index in zip(symbols, indices):
+        if index != _NO_REFERENCE:
+            symbol.index = index
+    return symbols
+
+
+class _SyntaxTreeEncoder(ast.NodeVisitor):
+    # Encodes the nodes in postorder, each node after its children, as records of the kind, the token and three fields
+    # of the kind (values or the number of children).
+    def __init__(self, values):
+        super().__init__()
+        self._values = values
+        self._nodes = None
+        self._kinds = {node: kind for kind, node in enumerate(_NODES)}
+
+    def encode(self, tree):
+        self._nodes = []
+        self.visit(tree)
+        return self._nodes
+
+    def visit(self, node):
+        fields = super().visit(node) or ()
+        self._add(node, *fields)
+
+    def _visit_TranslationUnit(self, node):
+        self._generic_visit(node)
+        return (len(node.functions),)
+
+    def _visit_FunctionDefinition(self, node):
+        self._generic_visit(node)
+        return self._values.add(node.type_specifier), self._values.add(node.identifier), len(node.parameters)
+
+    def _visit_Parameter(self, node):
+        return self._values.add(node.type_specifier), self._values.add(node.identifier)
+
+    def _visit_FunctionCall(self, node):
+        self._generic_visit(node)
+        return (len(node.arguments),)
+
+    def _visit_CompoundStatement(self, node):
+        self._generic_visit(node)
+        return len(node.declarations), len(node.statements)
+
+    def _visit_Declaration(self, node):
+        return self._values.add(node.type_specifier), self._values.add(node.identifier), self._values.add(node.length)
+
+    def _visit_Assignment(self, node):
+        self._generic_visit(node)
+        return self._values.add(node.identifier), int(node.index is not None)
+
+    def _visit_BinaryOperator(self, node):
+        self._generic_visit(node)
+        return (self._values.add(node.operator),)
+
+    def _visit_UnaryOperator(self, node):
+        self._generic_visit(node)
+        return (self._values.add(node.operator),)
+
+    def _visit_Identifier(self, node):
+        return (self._values.add(node.name),)
+
+    def _visit_IntegerConstant(self, node):
+        return (self._values.add(node.value),)
+
+    def _visit_RealConstant(self, node):
+        return (self._values.add(node.value),)
+
+    def _add(self, node, field_1=0, field_2=0, field_3=0):
+        token = node.token
+        if token is None:
+            token_fields = (_NO_REFERENCE, _NO_REFERENCE, 0, 0)
+        else:
+            token_fields = (self._values.add(token.type), self._values.add(token.value), token.line, token.column)
+        self._nodes.append(_NODE.pack(self._kinds[type(node)], *token_fields, field_1, field_2, field_3))
+
+
+class _SyntaxTreeDecoder:
+    # Builds the nodes from the records in postorder, the children of a node are the last nodes built.
+    def __init__(self, values):
+        self._values = values
+        self._stack = []
+        self._builders = [getattr(self, f'_build_{node.__name__}') for node in _NODES]
+
+    def decode(self, records):
+        values = self._values
+        for kind, token_type, token_value, line, column, field_1, field_2, field_3 in records:
+            token = None if token_type == _NO_REFERENCE else lexer.Token(values[token_type], values[token_value],
+                                                                         line, column)
+            self._stack.append(self._builders[kind](token, field_1, field_2, field_3))
+        if len(self._stack) != 1:
+            raise ValueError("The serialized syntax tree is not a tree")
+        return self._stack.pop()
+
+    def _pop(self, count):
+        if count > len(self._stack):
+            raise ValueError("The serialized syntax tree is not a tree")
+        if count == 0:
+            return []
+        children = self._stack[-count:]
+        del self._stack[-count:]
+        return children
+
+    def _build_NoOperation(self, token, *_):
+        return ast.NoOperation(token)
+
+    def _build_TranslationUnit(self, token, functions, *_):
+        return ast.TranslationUnit(token, self._pop(functions))
+
+    def _build_FunctionDefinition(self, token, type_specifier, identifier, parameters):
+        *parameters, body = self._pop(parameters + 1)
+        return ast.FunctionDefinition(token, self._values[type_specifier], self._values[identifier], parameters, body)
+
+    def _build_Parameter(self, token, type_specifier, identifier, _):
+        return ast.Parameter(token, self._values[type_specifier], self._values[identifier])
+
+    def _build_FunctionCall(self, token, arguments, *_):
+        identifier, *arguments = self._pop(arguments + 1)
+        return ast.FunctionCall(token, identifier, arguments)
+
+    def _build_ReturnStatement(self, token, *_):
+        return ast.ReturnStatement(token, *self._pop(1))
+
+    def _build_CompoundStatement(self, token, declarations, statements, _):
+        children = self._pop(declarations + statements)
+        return ast.CompoundStatement(token, children[:declarations], children[declarations:])
+
+    def _build_Declaration(self, token, type_specifier, identifier, length):
+        return ast.Declaration(token, self._values[type_specifier], self._values[identifier], self._values[length])
+
+    def _build_Assignment(self, token, identifier, has_index, _):
+        if has_index:
+            index, value = self._pop(2)
+            return ast.Assignment(token, self._values[identifier], value, index)
+        return ast.Assignment(token, self._values[identifier], *self._pop(1))
+
+    def _build_IfStatement(self, token, *_):
+        return ast.IfStatement(token, *self._pop(3))
+
+    def _build_WhileStatement(self, token, *_):
+        return ast.WhileStatement(token, *self._pop(2))
+
+    def _build_ForStatement(self, token, *_):
+        return ast.ForStatement(token, *self._pop(4))
+
+    def _build_BinaryOperator(self, token, operator, *_):
+        return ast.BinaryOperator(token, self._values[operator], *self._pop(2))
+
+    def _build_UnaryOperator(self, token, operator, *_):
+        return ast.UnaryOperator(token, self._values[operator], *self._pop(1))
+
+    def _build_Subscript(self, token, *_):
+        return ast.Subscript(token, *self._pop(2))
+
+    def _build_Identifier(self, token, name, *_):
+        return ast.Identifier(token, self._values[name])
+
+    def _build_IntegerConstant(self, token, value, *_):
+        return ast.IntegerConstant(token, self._values[value])
+
+    def _build_RealConstant(self, token, value, *_):
+        return ast.RealConstant(token, self._values[value])
+
+
+class _Reader:
+    # Reads the data from the start, through a memoryview of it.
+    def __init__(self, data, magic, name):
+        self._view = memoryview(data).cast('B')
+        self._position = 0
+        self._name = name
+        if len(self._view) < _HEADER.size or _HEADER.unpack_from(self._view)[0] != magic:
+            raise ValueError(f"The data is not a serialized {name}")
+        version = _HEADER.unpack_from(self._view)[1]
+        if version != VERSION:
+            raise ValueError(f"The serialized {name} has version {version}, expected version {VERSION}")
+        self._position = _HEADER.size
+
+    def take(self, size):
+        if self._position + size > len(self._view):
+            raise ValueError(f"The serialized {self._name} is truncated")
+        view = self._view[self._position:self._position + size]
+        self._position += size
+        return view
+
+    def count(self):
+        return _COUNT.unpack(self.take(_COUNT.size))[0]
+
+    def records(self, record):
+        return record.iter_unpack(self.take(self.count() * record.size))
+
+    def array(self, typecode):
+        count = self.count()
+        return _from_bytes(typecode, self.take(count * array.array(typecode).itemsize))
+
+    def values(self):
+        kinds = self.array('B')
+        integers = iter(self.array('q'))
+        floats = iter(self.array('d'))
+        lengths = iter(self.array('I'))
+        strings = self.take(self.count())
+        values = []
+        position = 0
+        for kind in kinds:
+            if kind == _INT:
+                values.append(next(integers))
+            elif kind == _STR or kind == _BIG_INT:
+                length = next(lengths)
+                value = str(strings[position:position + length], 'utf-8')
+                values.append(value if kind == _STR else int(value))
+                position += length
+            elif kind == _FLOAT:
+                values.append(next(floats))
+            elif kind == _BOOL:
+                values.append(bool(next(integers)))
+            else:
+                values.append(None)
+        return values
+
+
+@contextlib.contextmanager
+def _paused_garbage_collection():
+    # The garbage collection would otherwise run over and over (through all objects of the compiler) as the many
+    # objects of a structure are created, none of which are garbage.
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _encode_array(items):
+    return _COUNT.pack(len(items)) + _to_bytes(items)
+
+
+def _to_bytes(items):
+    if sys.byteorder == 'big':
+        items = array.array(items.typecode, items)
+        items.byteswap()
+    return items.tobytes()
+
+
+def _from_bytes(typecode, view):
+    items = array.array(typecode)
+    items.frombytes(view)
+    if sys.byteorder == 'big':
+        items.byteswap()
+    return items
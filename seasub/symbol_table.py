@@ -1,6 +1,8 @@
 """
 The symbol table of the sea sub compiler.
 """
+import collections
+
 from seasub import abstract_syntax_tree as ast
 
 
@@ -11,27 +13,55 @@ def attach_symbol_table(abstract_syntax_tree):
     return symbol_table
 
 
+def resolve_symbols(abstract_syntax_tree, symbol_table):
+    _SymbolResolver().resolve(abstract_syntax_tree, symbol_table)
+
+
+def attach_function_symbol_table(function_definition, symbol_table):
+    # Attaches the symbol table of one function definition to the global scope and resolves its symbols, when the
+    # functions are compiled one at a time. The global scope contains the declarations of all functions (attached from
+    # the signatures), the definition of the function replaces its declaration until it is detached.
+    _SymbolTableVisitor().attach(function_definition, symbol_table)
+    _SymbolResolver().resolve_function(function_definition, symbol_table)
+
+
+def detach_function_symbol_table(function_definition, symbol_table):
+    # Replaces the definition of the function with a declaration again, which lets the scopes and symbols of the
+    # function be freed once it has been compiled.
+    function = function_definition.symbol
+    declaration = Function(function.name, function.type)
+    for parameter in function.parameters:
+        declaration.add_parameter(Parameter(parameter.name, parameter.type))
+    symbol_table.inner.remove(function_definition.symbol_table)
+    symbol_table[function.name] = declaration
+
+
 def add_builtins(symbol_table):
     symbol_table['int'] = BuiltinType('int')
     symbol_table['double'] = BuiltinType('double')
 
 
-def save_graph(symbol_table, file_path):
-    def level(node, connections=[]):
-        name = f"===== {node.name} L{node.level} ====="
-        symbols = "\\n".join(f'{key}: {str(value)}' for key, value in node.symbols.items())
-        label = f"{name}\\n{symbols}"
-        connections.append(f'node{id(node)} [label="{label}", shape=box]')
-        for child in node.inner:
-            level(child, connections)
-            connections.append(f"node{id(node)} -> node{id(child)};")
-        return connections
+def save_graph(symbol_table, file_path, functions=None, depth=None):
+    # Writes the graph of the scopes in the format of the file extension (see the graph module), the scopes are
+    # numbered in the order they are visited. Only the given functions (names) are included if any, also among the
+    # symbols of the global scope, and only the scopes down to the given depth (level) if any.
+    from seasub import graph  # Imported when used, like the other optional stages.
 
-    connections = level(symbol_table)
-    internal = "\n".join(connections)
-    graph = f"digraph symboltable {{\n{internal}\n}}"
-    with open(file_path, 'w') as file:
-        file.write(graph)
+    def add_scope(scope, parent_id):
+        node_id = f'n{len(node_ids)}'
+        node_ids.append(node_id)
+        symbols = ''.join(f'\n{key}: {value}' for key, value in scope.symbols.items()
+                          if functions is None or not isinstance(value, Function) or key in functions)
+        writer.add_node(node_id, f"===== {scope.name} L{scope.level} ====={symbols}", 'SymbolTable', parent_id)
+        if depth is None or scope.level < depth:
+            for child in scope.inner:
+                if functions is None or scope.outer is not None or child.name in functions:
+                    add_scope(child, node_id)
+
+    functions = None if functions is None else set(functions)
+    node_ids = []
+    with graph.open_graph(file_path, 'symboltable', node_shape='box') as writer:
+        add_scope(symbol_table, None)
 
 
 class SymbolTable:
@@ -190,6 +220,36 @@ class Variable(Symbol):
         self._index = value
 
 
+class Array(Variable):
+    # A one dimensional array of a fixed length, of type 'int[]' or 'double[]'. A pointer parameter has the same type
+    # but is a Parameter.
+    def __init__(self, name, symbol_type, length):
+        super().__init__(name, symbol_type)
+        self._length = length
+
+    def __repr__(self):
+        return f"Array({self.name}, {self.type}, {self._length})"
+
+    def __str__(self):
+        return f"Array<{self.name}: {self.type} [{self._length}] @ {self.index}>"
+
+    @property
+    def length(self):
+        return self._length
+
+    @property
+    def element_type(self):
+        return self.type[:-2]
+
+
+class Temporary(Variable):
+    def __repr__(self):
+        return f"Temporary({self.name}, {self.type})"
+
+    def __str__(self):
+        return f"Temporary<{self.name}: {self.type} @ {self.index}>"
+
+
 class _SymbolTableVisitor(ast.NodeVisitor):
     def __init__(self):
         super().__init__()
@@ -240,7 +300,10 @@ class _SymbolTableVisitor(ast.NodeVisitor):
         self._current_scope = self._current_scope.outer
 
     def _visit_Declaration(self, node):
-        variable = Variable(node.identifier, node.type_specifier)
+        if node.length is None:
+            variable = Variable(node.identifier, node.type_specifier)
+        else:
+            variable = Array(node.identifier, f'{node.type_specifier}[]', node.length)
         self._current_function.add_variable(variable)
         self._current_scope[node.identifier] = variable
         self._generic_visit(node)
@@ -254,6 +317,14 @@ class _SymbolTableVisitor(ast.NodeVisitor):
         self._generic_visit(node)
         self._add_symbol_table(node)
 
+    def _visit_WhileStatement(self, node):
+        self._generic_visit(node)
+        self._add_symbol_table(node)
+
+    def _visit_ForStatement(self, node):
+        self._generic_visit(node)
+        self._add_symbol_table(node)
+
     def _visit_BinaryOperator(self, node):
         self._generic_visit(node)
         self._add_symbol_table(node)
@@ -262,6 +333,10 @@ class _SymbolTableVisitor(ast.NodeVisitor):
         self._generic_visit(node)
         self._add_symbol_table(node)
 
+    def _visit_Subscript(self, node):
+        self._generic_visit(node)
+        self._add_symbol_table(node)
+
     def _visit_Identifier(self, node):
         self._generic_visit(node)
         self._add_symbol_table(node)
@@ -276,3 +351,70 @@ class _SymbolTableVisitor(ast.NodeVisitor):
 
     def _add_symbol_table(self, node):
         node.symbol_table = self._current_scope
+
+
+class _SymbolResolver(ast.NodeVisitor):
+    # Binds each identifier to its symbol using one flat hash map of the visible symbols and an undo log, instead of
+    # walking the scope chain for each look up. Identifiers that can't be resolved are bound to None.
+    def __init__(self):
+        super().__init__()
+        self._visible = None
+        self._undo_log = None
+        self._scope_starts = None
+
+    def resolve(self, tree, global_scope):
+        self._visible = {}
+        self._undo_log = []
+        self._scope_starts = []
+        self._enter_scope(global_scope)
+        self.visit(tree)
+        self._leave_scope()
+        assert not self._undo_log
+
+    def resolve_function(self, function_definition, global_scope):
+        # The symbols of the global scope are looked up in the scope itself instead of being entered, which would take
+        # time proportional to the number of functions for each function.
+        self._visible = collections.ChainMap({}, global_scope.symbols)
+        self._undo_log = []
+        self._scope_starts = []
+        self.visit(function_definition)
+        assert not self._undo_log
+
+    def _visit_FunctionDefinition(self, node):
+        node.symbol = self._visible[node.identifier]
+        self._enter_scope(node.symbol_table)
+        self._generic_visit(node)
+        self._leave_scope()
+
+    def _visit_Parameter(self, node):
+        node.symbol = self._visible[node.identifier]
+
+    def _visit_CompoundStatement(self, node):
+        self._enter_scope(node.symbol_table)
+        self._generic_visit(node)
+        self._leave_scope()
+
+    def _visit_Declaration(self, node):
+        node.symbol = self._visible[node.identifier]
+
+    def _visit_Assignment(self, node):
+        node.symbol = self._visible.get(node.identifier)
+        self._generic_visit(node)
+
+    def _visit_Identifier(self, node):
+        node.symbol = self._visible.get(node.name)
+
+    def _enter_scope(self, scope):
+        self._scope_starts.append(len(self._undo_log))
+        for identifier, symbol in scope.symbols.items():
+            self._undo_log.append((identifier, self._visible.get(identifier)))
+            self._visible[identifier] = symbol
+
+    def _leave_scope(self):
+        start = self._scope_starts.pop()
+        while len(self._undo_log) > start:
+            identifier, shadowed = self._undo_log.pop()
+            if shadowed is None:
+                del self._visible[identifier]
+            else:
+                self._visible[identifier] = shadowed
@@ -4,167 +4,1027 @@ The target code generator of the sea sub compiler.
 Generates code for the x86-64 architecture.
 """
 import functools as ft
+import os
+import struct
 
+from seasub import intermediate_code_generator as icg
 from seasub import symbol_table as symtab
+from seasub import x86
 
 
 _SIZE_OF_INT = 4
+_SIZES = {'int': _SIZE_OF_INT, 'double': 8}
+_RED_ZONE_SIZE = 128  # The System V ABI guarantees that the 128 bytes below the stack pointer are not overwritten.
 
 
-def generate(intermediate_code, symbol_table, file_name):
-    output = []
-    output.append(f'.file "{file_name}"')
-    output.append(r'.text')
-    for function, body in intermediate_code.items():
-        function_symbol = symbol_table[function]
-        output.append(f'.globl {function_symbol.name}')
-        output.append(f'.type {function_symbol.name}, @function')
-        output.append(f'{function_symbol.name}:')
-        _emit_function(function_symbol, body, output)
-        output.append(f'.size {function_symbol.name}, .-{function_symbol.name}')
-    return output
+def generate(function_codes, file_name, omit_frame_pointer=False, instrumentation=None, workers=map):
+    # The target code is generated lazily, one function at a time, so only the code of one function needs to be kept
+    # in memory when the code is written (or assembled) as it is generated. The function codes (the intermediate code
+    # of each function) may also be generated lazily. The functions are generated independently of each other by the
+    # workers, a map-like callable (e.g. the map of a process pool), in order. An instrumented program (see the
+    # profile module) writes its counters to the profile file when main returns.
+    yield f'.file "{file_name}"'
+    yield '.text'
+    generate_function = ft.partial(_generate_function, omit_frame_pointer=omit_frame_pointer,
+                                   instrumented=instrumentation is not None)
+    for function_output in workers(generate_function, function_codes):
+        yield from function_output
+    if instrumentation is not None:
+        output = []
+        _emit_profile(instrumentation, output)
+        yield from output
 
 
 def save_code(code, file_path):
     with open(file_path, 'w') as file:
-        file.writelines("\n".join(line if ':' in line else f'\t{line}' for line in code))
-        file.write("\n")
+        write_code(code, file)
+
+
+def write_code(code, file):
+    # The lines are formatted as they are written, the labels are placed first on the line and the instructions and
+    # directives are indented.
+    file.writelines(f'{line}\n' if isinstance(line, x86.Label) else f'\t{line}\n' for line in code)
 
 
-def _emit_function(function, body, output):
+def _generate_function(body, omit_frame_pointer, instrumented):
+    function = body.function
+    output = []
+    output.append(f'.globl {function.name}')
+    output.append(f'.type {function.name}, @function')
+    output.append(x86.Label(function.name))
+    dump_profile = instrumented and function.name == 'main'
+    constants, memo_table = _emit_function(function, body, omit_frame_pointer, dump_profile, output)
+    output.append(f'.size {function.name}, .-{function.name}')
+    constants.emit(output)
+    if memo_table is not None:
+        memo_table.emit(output)
+    return output
+
+
+def _emit_function(function, body, omit_frame_pointer, dump_profile, output):
     def prologue():
-        local_variables_size = _get_next_multiple(len(function.variables) * _SIZE_OF_INT, 8)  # 8 bytes aligned.
-        output.append(r'pushq %rbp')  # Save the previous frame pointer.
-        output.append(r'movq %rsp, %rbp')  # Set the frame pointer to the current frame (i.e. current stack pointer).
-        output.append(f'subq ${local_variables_size}, %rsp')  # Allocate local variables on the stack.
+        if frame.base is x86.RBP:
+            output.append(x86.Instruction('pushq', x86.RBP))  # Save the previous frame pointer.
+            output.append(x86.Instruction('movq', x86.RSP, x86.RBP))  # Set the frame pointer to the current frame.
+        if frame.allocated:
+            output.append(x86.Instruction('subq', x86.Immediate(frame.allocated), x86.RSP))  # Allocate locals.
 
     def epilogue():
-        output.append(r'movq %rbp, %rsp')  # Restore the stack pointer.
-        output.append(r'popq %rbp')  # Restore the frame pointer.
-        output.append(r'ret')  # Pops the return address from the stack and jumps to it.
+        if frame.base is x86.RBP:
+            if frame.allocated:
+                output.append(x86.Instruction('movq', x86.RBP, x86.RSP))  # Restore the stack pointer.
+            output.append(x86.Instruction('popq', x86.RBP))  # Restore the frame pointer.
+        elif frame.allocated:
+            output.append(x86.Instruction('addq', x86.Immediate(frame.allocated), x86.RSP))  # Remove the locals.
+        output.append(x86.Instruction('ret'))  # Pops the return address from the stack and jumps to it.
 
+    statements = _build_trees(body)
+    frame = _StackFrame(statements, omit_frame_pointer)
+    constants = _ConstantPool(function.name)
+    memo_table = _get_memo_table(function, body)
+    # The address of each symbol is computed once per function (and stack depth) instead of once per use.
+    symbols = function.parameters + list(frame.offsets)
+    addresses = {0: _Addresses({symbol: _get_address(symbol, frame, 0) for symbol in symbols}, constants)}
+    depth = 0  # The number of bytes pushed on the stack for the parameters of a function call.
     prologue()
-    for instruction in body:
-        globals()[instruction.operator](instruction, output)  # Calls the q_xxx functions below.
+    body_start = len(output)
+    if memo_table is not None:
+        memo_table.emit_lookup(addresses[0], output)
+    for statement in statements:
+        if statement.operator == icg.Operator.q_call:  # The call removes the parameters before storing its result.
+            depth -= statement.operand_2 * _SIZE_OF_INT * 2
+        if depth not in addresses:
+            addresses[depth] = _Addresses({symbol: _get_address(symbol, frame, depth) for symbol in symbols}, constants)
+        _STATEMENTS[statement.operator](statement, addresses[depth], output)  # Calls the _munch_xxx functions below.
+        if statement.operator == icg.Operator.q_param:
+            depth += _SIZE_OF_INT * 2
+    if memo_table is not None:
+        memo_table.emit_store(addresses[0], output)
+    _remove_jumps_to_next(output, body_start)
+    if _uses_ymm_registers(output, body_start):
+        # Clears the upper halves of the ymm registers before calling (or returning to) code that might use SSE
+        # instructions, which otherwise would have to preserve the upper halves (a large penalty on many processors).
+        output[body_start:] = [item for instruction in output[body_start:]
+                               for item in _with_vzeroupper(instruction, 'call')]
+        output.append(x86.Instruction('vzeroupper'))
+    if dump_profile:
+        output.append(x86.Instruction('call', _DUMP_PROFILE))  # Preserves the returned value.
     epilogue()
+    return constants, memo_table
+
+
+_DUMP_PROFILE = '.Lseasub.dump_profile'
+_PROFILE = '.Lseasub.profile'
+_PROFILE_PATH = '.Lseasub.profile_path'
+_SYSCALL_WRITE, _SYSCALL_OPEN, _SYSCALL_CLOSE = 1, 2, 3
+_O_WRONLY, _O_CREAT, _O_APPEND = 0o1, 0o100, 0o2000
+
+
+def _counter_label(index):
+    return f'.Lseasub.counter{index}'
+
+
+def _emit_profile(instrumentation, output):
+    # The profile record (see the profile module) is stored in the data section, with the counters last. It is
+    # appended to the profile file using system calls directly since the program is not linked with any library. Any
+    # error (e.g. the file can't be opened) is ignored, the program shall behave the same with or without profiling.
+    from seasub import profile
+    size = (3 + instrumentation.counters) * 8
+    path = ','.join(str(byte) for byte in (*os.fsencode(instrumentation.file_path), 0))
+    end = f'{_DUMP_PROFILE}.end'
+    output.append(x86.Label(_DUMP_PROFILE))
+    output.append(x86.Instruction('pushq', x86.RAX))
+    output.append(x86.Instruction('movl', x86.Immediate(_SYSCALL_OPEN), x86.EAX))
+    output.append(x86.Instruction('leaq', x86.Memory(_PROFILE_PATH, x86.RIP), x86.RDI))
+    output.append(x86.Instruction('movl', x86.Immediate(_O_WRONLY | _O_CREAT | _O_APPEND), x86.ESI))
+    output.append(x86.Instruction('movl', x86.Immediate(0o644), x86.EDX))  # The permissions of a created file.
+    output.append(x86.Instruction('syscall'))
+    output.append(x86.Instruction('testl', x86.EAX, x86.EAX))
+    output.append(x86.Instruction('js', end))
+    output.append(x86.Instruction('movl', x86.EAX, x86.EDI))  # The file descriptor.
+    output.append(x86.Instruction('movl', x86.Immediate(_SYSCALL_WRITE), x86.EAX))
+    output.append(x86.Instruction('leaq', x86.Memory(_PROFILE, x86.RIP), x86.RSI))
+    output.append(x86.Instruction('movl', x86.Immediate(size), x86.EDX))
+    output.append(x86.Instruction('syscall'))
+    output.append(x86.Instruction('movl', x86.Immediate(_SYSCALL_CLOSE), x86.EAX))
+    output.append(x86.Instruction('syscall'))
+    output.append(x86.Label(end))
+    output.append(x86.Instruction('popq', x86.RAX))
+    output.append(x86.Instruction('ret'))
+    output.append('.section .rodata')
+    output.append(x86.Label(_PROFILE_PATH))
+    output.append(f'.byte {path}')
+    output.append('.data')
+    output.append('.align 8')
+    output.append(x86.Label(_PROFILE))
+    for value in (profile.MAGIC, instrumentation.checksum, instrumentation.counters):
+        output.append(f'.quad {value:#x}')
+    for index in range(instrumentation.counters):
+        output.append(x86.Label(_counter_label(index)))
+        output.append('.quad 0')
+    output.append('.text')
+
+
+def _uses_ymm_registers(output, start):
+    return any(isinstance(instruction, x86.Instruction) and
+               any(operand in (x86.YMM0, x86.YMM1) for operand in instruction.operands)
+               for instruction in output[start:])
+
+
+def _with_vzeroupper(instruction, mnemonic):
+    if isinstance(instruction, x86.Instruction) and instruction.mnemonic == mnemonic:
+        return [x86.Instruction('vzeroupper'), instruction]
+    return [instruction]
+
+
+def _remove_jumps_to_next(output, start):
+    # Removes unconditional jumps to a label that directly follows the jump (e.g. a return at the end of a function).
+    index = start
+    while index < len(output):
+        instruction = output[index]
+        if isinstance(instruction, x86.Instruction) and instruction.mnemonic == 'jmp':
+            following = index + 1
+            while following < len(output) and isinstance(output[following], x86.Label):
+                if output[following].name == instruction.operands[0]:
+                    del output[index]
+                    index -= 1
+                    break
+                following += 1
+        index += 1
+
+
+class _Tree:
+    # A node in a tree of intermediate code. The operands are either trees, symbols, constants or labels. The type is
+    # only given when it can't be derived from the operands (an array element).
+    def __init__(self, operator, operand_1, operand_2, result, value_type=None):
+        self.operator = operator
+        self.operand_1 = operand_1
+        self.operand_2 = operand_2
+        self.result = result
+        self.value_type = value_type
+
+    def __repr__(self):
+        return f"_Tree({self.operator}, {self.operand_1!r}, {self.operand_2!r}, {self.result!r})"
+
+
+def _build_trees(body):
+    # The intermediate code is turned into a list of statement trees by folding each temporary that is assigned once
+    # and used once into its use. The instruction selector below can then match patterns covering several quadruples.
+    # To keep the register usage low only one operand of a binary operator may be a tree (except for scaled additions
+    # and vector operations where one operand is loaded from an array). A folded tree is evaluated at its use instead of
+    # its definition, which is fine as long as none of the variables it reads are assigned in between, otherwise the
+    # tree is stored in the temporary before the assignment. The same goes for array elements, which might be assigned
+    # by any array assignment or function call (through a pointer). Trees are never folded across basic block
+    # boundaries.
+    definitions = {}
+    uses = {}
+    for quad in body:
+        for operand in (quad.operand_1, quad.operand_2):
+            if isinstance(operand, symtab.Temporary):
+                uses[operand] = uses.get(operand, 0) + 1
+        if isinstance(quad.result, symtab.Temporary):
+            definitions[quad.result] = definitions.get(quad.result, 0) + 1
+
+    statements = []
+    pending = {}
+
+    def store(temp, tree):
+        statements.append(_Tree(icg.Operator.q_assign, tree, None, temp))
+
+    def flush(condition=lambda tree: True):
+        for temp, tree in list(pending.items()):
+            if condition(tree):
+                del pending[temp]
+                store(temp, tree)
+
+    def take(operand):
+        if isinstance(operand, int):
+            return _wrap(operand)  # An integer constant is given as a signed 32 bit immediate (e.g. pushq).
+        return pending.pop(operand) if operand in pending else operand
+
+    def define(temp, tree):
+        if definitions.get(temp) == 1 and uses.get(temp) == 1:
+            pending[temp] = tree
+        else:
+            store(temp, tree)
+
+    for quad in body:
+        operator = quad.operator
+        if operator == icg.Operator.q_load:
+            define(quad.result, take(quad.operand_1))
+        elif operator == icg.Operator.q_uplus:
+            define(quad.result, take(quad.operand_1))
+        elif operator in (icg.Operator.q_uminus, icg.Operator.q_not):
+            define(quad.result, _Tree(operator, take(quad.operand_1), None, None))
+        elif operator in (icg.Operator.q_plus, icg.Operator.q_minus, icg.Operator.q_mult, icg.Operator.q_div,
+                          *_CONDITION_CODES):
+            operand_1 = take(quad.operand_1)
+            operand_2 = take(quad.operand_2)
+            if operator in (icg.Operator.q_plus, icg.Operator.q_mult) and isinstance(operand_1, int):
+                operand_1, operand_2 = operand_2, operand_1  # Keep constants to the right of commutative operators.
+            scaled = operator == icg.Operator.q_plus and (_is_scaled(operand_1) or _is_scaled(operand_2))
+            loaded = _is_vector(quad.result.type) and (_is_element(operand_1) or _is_element(operand_2))
+            if isinstance(operand_1, _Tree) and isinstance(operand_2, _Tree) and not scaled and not loaded:
+                store(quad.operand_1, operand_1)
+                operand_1 = quad.operand_1
+            define(quad.result, _Tree(operator, operand_1, operand_2, None))
+        elif operator == icg.Operator.q_assign:
+            value = take(quad.operand_1)
+            flush(lambda tree: _reads(tree, quad.result))
+            statements.append(_Tree(operator, value, None, quad.result))
+        elif operator == icg.Operator.q_getelem:
+            define(quad.result, _Tree(operator, quad.operand_1, take(quad.operand_2), None, quad.result.type))
+        elif operator == icg.Operator.q_setelem:
+            value = take(quad.operand_1)
+            index = take(quad.operand_2)
+            if isinstance(value, _Tree) and isinstance(index, _Tree):
+                store(quad.operand_2, index)
+                index = quad.operand_2
+            flush(_reads_element)
+            statements.append(_Tree(operator, value, index, quad.result))
+        elif operator == icg.Operator.q_param:
+            statements.append(_Tree(operator, take(quad.operand_1), quad.operand_2, quad.result))
+        elif operator == icg.Operator.q_call:
+            flush(_reads_element)
+            statements.append(_Tree(operator, quad.operand_1, quad.operand_2, quad.result))
+        elif operator == icg.Operator.q_count:
+            statements.append(_Tree(operator, quad.operand_1, None, None))
+        elif operator == icg.Operator.q_memoize:
+            continue  # The memo table is looked up on entry of the function, see _MemoTable.
+        else:  # Jumps, labels and returns are basic block boundaries.
+            operand_2 = take(quad.operand_2)
+            flush()
+            statements.append(_Tree(operator, quad.operand_1, operand_2, quad.result))
+    flush()
+    return statements
+
+
+def _is_scaled(tree):
+    # Matches index * scale, where scale is a valid scale of an x86 memory operand.
+    return (isinstance(tree, _Tree) and tree.operator == icg.Operator.q_mult and
+            isinstance(tree.operand_1, symtab.Symbol) and _get_type(tree.operand_1) == 'int' and
+            tree.operand_2 in (2, 4, 8))
+
+
+def _reads(tree, symbol):
+    if not isinstance(tree, _Tree):
+        return tree is symbol
+    return _reads(tree.operand_1, symbol) or _reads(tree.operand_2, symbol)
+
+
+def _reads_element(tree):
+    if not isinstance(tree, _Tree):
+        return False
+    return _is_element(tree) or _reads_element(tree.operand_1) or _reads_element(tree.operand_2)
+
+
+def _is_element(tree):
+    return isinstance(tree, _Tree) and tree.operator == icg.Operator.q_getelem
+
+
+def _is_leaf(tree):
+    return not isinstance(tree, _Tree)
+
+
+def _get_type(tree):
+    if isinstance(tree, _Tree):
+        if tree.value_type is not None:
+            return tree.value_type
+        if tree.operator in _CONDITION_CODES or tree.operator == icg.Operator.q_not:
+            return 'int'
+        return _get_type(tree.operand_1)
+    if isinstance(tree, float):
+        return 'double'
+    if isinstance(tree, int):
+        return 'int'
+    return tree.type
+
+
+def _is_vector(value_type):
+    return value_type.endswith('>')
+
+
+def _get_vector_kind(value_type):
+    # The element type and the size in bytes of a vector type, e.g. ('int', 16) for int<4>.
+    element_type, width = value_type[:-1].split('<')
+    return element_type, int(width) * _SIZES[element_type]
+
+
+def _get_operand(leaf, addresses):
+    if isinstance(leaf, float):
+        return addresses.constants[leaf]
+    return x86.Immediate(leaf) if isinstance(leaf, int) else addresses[leaf]
+
 
+def _munch_expression(tree, addresses, output):
+    # Maximal munch, emits instructions evaluating the tree into the eax register. The largest patterns are tried
+    # first. The rax, rcx and rdx registers may be overwritten.
+    if _is_leaf(tree):
+        output.append(x86.Instruction('movl', _get_operand(tree, addresses), x86.EAX))
+        return
+    operator = tree.operator
+    a = tree.operand_1
+    b = tree.operand_2
+    if operator == icg.Operator.q_uminus:
+        _munch_expression(a, addresses, output)
+        output.append(x86.Instruction('negl', x86.EAX))
+    elif operator == icg.Operator.q_plus and (_is_scaled(a) or _is_scaled(b)):
+        base, scaled = (b, a) if _is_scaled(a) else (a, b)
+        _munch_expression(base, addresses, output)
+        output.append(x86.Instruction('movl', addresses[scaled.operand_1], x86.EDX))
+        output.append(x86.Instruction('leal', x86.Memory(0, x86.RAX, x86.RDX, scaled.operand_2), x86.EAX))
+    elif operator == icg.Operator.q_mult and _is_leaf(a) and _is_leaf(b) and (isinstance(a, int) or isinstance(b, int)):
+        constant, other = (a, b) if isinstance(a, int) else (b, a)
+        if isinstance(other, int):
+            output.append(x86.Instruction('movl', x86.Immediate(other), x86.EAX))
+            other_operand = x86.EAX
+        else:
+            other_operand = addresses[other]
+        output.append(x86.Instruction('imull', x86.Immediate(constant), other_operand, x86.EAX))
+    elif operator in (icg.Operator.q_plus, icg.Operator.q_mult):
+        mnemonic = 'addl' if operator == icg.Operator.q_plus else 'imull'
+        if _is_leaf(b):
+            _munch_expression(a, addresses, output)
+            output.append(x86.Instruction(mnemonic, _get_operand(b, addresses), x86.EAX))
+        else:  # The operator is commutative.
+            _munch_expression(b, addresses, output)
+            output.append(x86.Instruction(mnemonic, _get_operand(a, addresses), x86.EAX))
+    elif operator == icg.Operator.q_minus:
+        if _is_leaf(b):
+            _munch_expression(a, addresses, output)
+            output.append(x86.Instruction('subl', _get_operand(b, addresses), x86.EAX))
+        else:  # a - b = -b + a
+            _munch_expression(b, addresses, output)
+            output.append(x86.Instruction('negl', x86.EAX))
+            output.append(x86.Instruction('addl', _get_operand(a, addresses), x86.EAX))
+    elif operator == icg.Operator.q_div:
+        if _is_leaf(b):
+            _munch_expression(a, addresses, output)
+            divisor = _get_operand(b, addresses)
+            if isinstance(divisor, x86.Immediate):  # The divisor can't be an immediate.
+                output.append(x86.Instruction('movl', divisor, x86.ECX))
+                divisor = x86.ECX
+        else:
+            _munch_expression(b, addresses, output)
+            output.append(x86.Instruction('movl', x86.EAX, x86.ECX))
+            _munch_expression(a, addresses, output)
+            divisor = x86.ECX
+        output.append(x86.Instruction('cltd'))  # Alias for cdq, sign-extends eax into edx:eax.
+        output.append(x86.Instruction('idivl', divisor))  # Divides edx:eax, eax: quotient, edx: remainder.
+    elif operator in _CONDITION_CODES or operator == icg.Operator.q_not:
+        condition = _munch_condition(tree, addresses, output)
+        output.append(x86.Instruction(f'set{condition}', x86.AL))
+        output.append(x86.Instruction('movzbl', x86.AL, x86.EAX))
+    elif operator == icg.Operator.q_getelem:
+        output.append(x86.Instruction('movl', _munch_element_address(a, b, addresses, output), x86.EAX))
+    else:
+        raise NotImplementedError(f"No instruction pattern for {operator}")
 
-def q_param(quad, output):
-    value = _get_address(quad.symbol_table[quad.operand_1])
-    output.append(f'movl {value}, %eax')
-    output.append(r'pushq %rax')  # Push the parameter on the stack.
-    # The lower 32 bits of rax is eax, the reason for doing like this is to keep the stack pointer aligned to 8 bytes.
 
+def _munch_double_expression(tree, addresses, output):
+    # Same as above for double values, which are evaluated into the xmm0 register (using scalar SSE2 instructions).
+    # The xmm1 register may be overwritten.
+    if _is_leaf(tree):
+        output.append(x86.Instruction('movsd', _get_operand(tree, addresses), x86.XMM0))
+        return
+    operator = tree.operator
+    a = tree.operand_1
+    b = tree.operand_2
+    if operator == icg.Operator.q_uminus:
+        _munch_double_expression(a, addresses, output)
+        output.append(x86.Instruction('movsd', addresses.constants[-0.0], x86.XMM1))
+        output.append(x86.Instruction('xorpd', x86.XMM1, x86.XMM0))  # Flips the sign bit.
+    elif operator in _DOUBLE_MNEMONICS:
+        operand = _munch_double_operands(a, b, addresses, output)
+        output.append(x86.Instruction(_DOUBLE_MNEMONICS[operator], operand, x86.XMM0))
+    elif operator == icg.Operator.q_getelem:
+        output.append(x86.Instruction('movsd', _munch_element_address(a, b, addresses, output), x86.XMM0))
+    else:
+        raise NotImplementedError(f"No instruction pattern for {operator} (double)")
 
-def q_call(quad, output):
-    result = _get_address(quad.symbol_table[quad.result])
-    output.append(f'call {quad.operand_1}')  # Pushes the return address on the stack.
-    output.append(f'addq ${quad.operand_2 * _SIZE_OF_INT * 2}, %rsp')  # Remove the parameters from the stack.
-    # Multiply by 2 since each parameter is 8 byte aligned.
-    output.append(f'movl %eax, {result}')  # Store the returned value (which will be located in eax).
 
+def _munch_double_operands(a, b, addresses, output):
+    # Evaluates a into xmm0 and returns the operand of b, a memory operand or xmm1. Only one of them can be a tree.
+    if _is_leaf(b):
+        _munch_double_expression(a, addresses, output)
+        return _get_operand(b, addresses)
+    _munch_double_expression(b, addresses, output)
+    output.append(x86.Instruction('movapd', x86.XMM0, x86.XMM1))
+    _munch_double_expression(a, addresses, output)
+    return x86.XMM1
 
-def q_load(quad, output):
-    result = _get_address(quad.symbol_table[quad.result])
-    output.append(f'movl ${quad.operand_1}, {result}')
 
+_DOUBLE_MNEMONICS = {icg.Operator.q_plus: 'addsd', icg.Operator.q_minus: 'subsd', icg.Operator.q_mult: 'mulsd',
+                     icg.Operator.q_div: 'divsd'}
 
-def q_uplus(quad, output):
-    pass  # Unary plus doesn't do anything.
 
+def _munch_vector_expression(tree, addresses, output):
+    # Same as above for vectors, which are evaluated into xmm0 using packed SSE2 instructions, or into ymm0 using AVX2
+    # instructions (that have a separate destination operand) for 32 byte vectors. The vectors are loaded and stored
+    # with unaligned moves since the stack (and thereby the arrays) is only 8 byte aligned. The xmm1 (ymm1) register
+    # may be overwritten.
+    kind = _get_vector_kind(_get_type(tree))
+    register, other_register = _VECTOR_REGISTERS[kind[1]]
+    if _is_leaf(tree) or _is_element(tree):
+        _munch_vector_load(tree, register, addresses, output)
+        return
+    mnemonic = _VECTOR_MNEMONICS[kind].get(tree.operator)
+    if mnemonic is None:
+        raise NotImplementedError(f"No instruction pattern for {tree.operator} ({kind[0]} vector)")
+    a = tree.operand_1
+    b = tree.operand_2
+    if _is_leaf(b) or _is_element(b):
+        _munch_vector_expression(a, addresses, output)
+        _munch_vector_load(b, other_register, addresses, output)
+    else:  # Then a is a leaf or an element, which is loaded without overwriting the other register.
+        _munch_vector_expression(b, addresses, output)
+        output.append(x86.Instruction(_VECTOR_MOVES[kind][1], register, other_register))
+        _munch_vector_expression(a, addresses, output)
+    if kind[1] == 32:
+        output.append(x86.Instruction(mnemonic, other_register, register, register))
+    else:
+        output.append(x86.Instruction(mnemonic, other_register, register))
 
-def q_uminus(quad, output):
-    operand = _get_address(quad.symbol_table[quad.operand_1])
-    result = _get_address(quad.symbol_table[quad.result])
-    output.append(f'movl {operand}, %eax')
-    output.append(r'negl %eax')
-    output.append(f'movl %eax, {result}')
 
+def _munch_vector_load(tree, register, addresses, output):
+    kind = _get_vector_kind(_get_type(tree))
+    if _is_leaf(tree):
+        source = addresses[tree]
+    else:
+        source = _munch_element_address(tree.operand_1, tree.operand_2, addresses, output)
+    output.append(x86.Instruction(_VECTOR_MOVES[kind][0], source, register))
 
-def q_plus(quad, output):
-    _binary_operator('addl', quad, output)
 
+_VECTOR_REGISTERS = {16: (x86.XMM0, x86.XMM1), 32: (x86.YMM0, x86.YMM1)}
+# The unaligned move (to or from memory) and the register to register move of each vector kind.
+_VECTOR_MOVES = {('int', 16): ('movdqu', 'movdqa'), ('double', 16): ('movupd', 'movapd'),
+                 ('int', 32): ('vmovdqu', 'vmovdqa'), ('double', 32): ('vmovupd', 'vmovapd')}
+_VECTOR_MNEMONICS = {('int', 16): {icg.Operator.q_plus: 'paddd', icg.Operator.q_minus: 'psubd'},
+                     ('double', 16): {icg.Operator.q_plus: 'addpd', icg.Operator.q_minus: 'subpd',
+                                      icg.Operator.q_mult: 'mulpd', icg.Operator.q_div: 'divpd'},
+                     ('int', 32): {icg.Operator.q_plus: 'vpaddd', icg.Operator.q_minus: 'vpsubd',
+                                   icg.Operator.q_mult: 'vpmulld'},
+                     ('double', 32): {icg.Operator.q_plus: 'vaddpd', icg.Operator.q_minus: 'vsubpd',
+                                      icg.Operator.q_mult: 'vmulpd', icg.Operator.q_div: 'vdivpd'}}
 
-def q_minus(quad, output):
-    _binary_operator('subl', quad, output)
 
+def _munch_element_address(array, index, addresses, output):
+    # Returns the memory operand of an array element, base + index * element size. The index is sign-extended into
+    # rdx (before the pointer is loaded into rcx, since evaluating the index may overwrite rcx) and a constant index is
+    # folded into the offset. The base is either the array in the stack frame or a pointer parameter.
+    size = _SIZES[array.type[:-2]]
+    offset = 0
+    index_register = None
+    if isinstance(index, int):
+        offset = index * size
+    else:
+        if _is_leaf(index):
+            output.append(x86.Instruction('movslq', addresses[index], x86.RDX))
+        else:
+            _munch_expression(index, addresses, output)
+            output.append(x86.Instruction('movslq', x86.EAX, x86.RDX))
+        index_register = x86.RDX
+    if isinstance(array, symtab.Parameter):
+        output.append(x86.Instruction('movq', addresses[array], x86.RCX))
+        base = x86.Memory(0, x86.RCX)
+    else:
+        base = addresses[array]
+    return x86.Memory(base.offset + offset, base.base, index_register, size)
 
-def q_mult(quad, output):
-    _binary_operator('imull', quad, output)
 
+def _munch_condition(tree, addresses, output):
+    # Emits instructions setting the flags according to the tree, returns the condition code (as used in the jcc and
+    # setcc mnemonics) that is true if the value of the tree is non-zero.
+    if _get_type(tree) == 'double':  # The truth value of a double is the same as comparing it to 0.0.
+        tree = _Tree(icg.Operator.q_ne, tree, 0.0, None)
+    if isinstance(tree, _Tree) and tree.operator in _CONDITION_CODES and _get_type(tree.operand_1) == 'double':
+        return _munch_double_comparison(tree, addresses, output)
+    if isinstance(tree, _Tree) and tree.operator in _CONDITION_CODES:
+        a = tree.operand_1
+        b = tree.operand_2
+        condition = _CONDITION_CODES[tree.operator]
+        if not _is_leaf(b) or isinstance(a, int):  # Only the second operand of cmp can be an immediate.
+            a, b, condition = b, a, _SWAPPED_CONDITIONS[condition]
+        if _is_leaf(a) and not isinstance(a, int) and isinstance(b, int):
+            output.append(x86.Instruction('cmpl', x86.Immediate(b), addresses[a]))
+        else:
+            _munch_expression(a, addresses, output)
+            output.append(x86.Instruction('cmpl', _get_operand(b, addresses), x86.EAX))
+        return condition
+    if isinstance(tree, _Tree) and tree.operator == icg.Operator.q_not:
+        return _NEGATED_CONDITIONS[_munch_condition(tree.operand_1, addresses, output)]
+    if _is_leaf(tree) and not isinstance(tree, int):
+        output.append(x86.Instruction('cmpl', x86.Immediate(0), addresses[tree]))
+    else:
+        _munch_expression(tree, addresses, output)
+        last = output[-1]
+        if last.mnemonic not in _SETS_ZERO_FLAG or last.operands[-1] is not x86.EAX:
+            output.append(x86.Instruction('testl', x86.EAX, x86.EAX))
+    return 'nz'
 
-def q_div(quad, output):
-    operand_1 = _get_address(quad.symbol_table[quad.operand_1])
-    operand_2 = _get_address(quad.symbol_table[quad.operand_2])
-    result = _get_address(quad.symbol_table[quad.result])
-    output.append(f'movl {operand_1}, %eax')
-    output.append(r'cltd')  # Alias for cdq, sign-extends eax into edx:eax.
-    output.append(f'movl {operand_2}, %ecx')
-    output.append(r'idivl %ecx')  # Divides to content of edx:eax with ecx, result is eax: quotient, edx: remainder.
-    output.append(f'movl %eax, {result}')
 
+def _munch_double_comparison(tree, addresses, output):
+    # The ucomisd instruction sets the flags like an unsigned comparison, and all of zf, pf and cf if any of the
+    # values is NaN (unordered), in which case all comparisons except != are false. The above (a) and above or equal
+    # (ae) conditions are false for unordered values, therefore a < b is computed as b > a. Equality must also check
+    # the parity flag.
+    operator = tree.operator
+    a, b = tree.operand_1, tree.operand_2
+    if operator in (icg.Operator.q_lt, icg.Operator.q_le):
+        a, b = b, a
+    operand = _munch_double_operands(a, b, addresses, output)
+    output.append(x86.Instruction('ucomisd', operand, x86.XMM0))
+    if operator in (icg.Operator.q_lt, icg.Operator.q_gt):
+        return 'a'
+    if operator in (icg.Operator.q_le, icg.Operator.q_ge):
+        return 'ae'
+    if operator == icg.Operator.q_eq:
+        output.append(x86.Instruction('sete', x86.AL))
+        output.append(x86.Instruction('setnp', x86.DL))
+        output.append(x86.Instruction('andb', x86.DL, x86.AL))
+    else:
+        output.append(x86.Instruction('setne', x86.AL))
+        output.append(x86.Instruction('setp', x86.DL))
+        output.append(x86.Instruction('orb', x86.DL, x86.AL))
+    return 'nz'
 
-def _binary_operator(operator, quad, output):
-    operand_1 = _get_address(quad.symbol_table[quad.operand_1])
-    operand_2 = _get_address(quad.symbol_table[quad.operand_2])
-    result = _get_address(quad.symbol_table[quad.result])
-    output.append(f'movl {operand_2}, %edx')
-    output.append(f'movl {operand_1}, %eax')
-    output.append(f'{operator} %edx, %eax')
-    output.append(f'movl %eax, {result}')
 
+_CONDITION_CODES = {icg.Operator.q_lt: 'l', icg.Operator.q_le: 'le', icg.Operator.q_gt: 'g', icg.Operator.q_ge: 'ge',
+                    icg.Operator.q_eq: 'e', icg.Operator.q_ne: 'ne'}
+_SWAPPED_CONDITIONS = {'l': 'g', 'le': 'ge', 'g': 'l', 'ge': 'le', 'e': 'e', 'ne': 'ne'}  # a < b is b > a etc.
+_NEGATED_CONDITIONS = {'l': 'ge', 'le': 'g', 'g': 'le', 'ge': 'l', 'e': 'ne', 'ne': 'e', 'z': 'nz', 'nz': 'z',
+                       'a': 'na', 'ae': 'nae'}
 
-def q_assign(quad, output):
-    value = _get_address(quad.symbol_table[quad.operand_1])
-    variable = _get_address(quad.symbol_table[quad.result])
-    output.append(f'movl {value}, %eax')
-    output.append(f'movl %eax, {variable}')
 
+def _munch_assign(tree, addresses, output):
+    value = tree.operand_1
+    variable = addresses[tree.result]
+    if _is_vector(tree.result.type):
+        if value is not tree.result:
+            kind = _get_vector_kind(tree.result.type)
+            _munch_vector_expression(value, addresses, output)
+            output.append(x86.Instruction(_VECTOR_MOVES[kind][0], _VECTOR_REGISTERS[kind[1]][0], variable))
+        return
+    if tree.result.type == 'double':
+        if value is not tree.result:
+            _munch_double_expression(value, addresses, output)
+            output.append(x86.Instruction('movsd', x86.XMM0, variable))
+        return
+    if isinstance(value, int):
+        output.append(x86.Instruction('movl', x86.Immediate(value), variable))
+    elif _is_leaf(value):
+        if value is not tree.result:
+            output.append(x86.Instruction('movl', addresses[value], x86.EAX))
+            output.append(x86.Instruction('movl', x86.EAX, variable))
+    elif value.operator == icg.Operator.q_uminus and value.operand_1 is tree.result:
+        output.append(x86.Instruction('negl', variable))  # x = -x
+    elif value.operator in (icg.Operator.q_plus, icg.Operator.q_minus) and (
+            value.operand_1 is tree.result or
+            (value.operator == icg.Operator.q_plus and value.operand_2 is tree.result)):
+        # Read-modify-write of the variable, e.g. x = x + 1.
+        other = value.operand_2 if value.operand_1 is tree.result else value.operand_1
+        mnemonic = 'addl' if value.operator == icg.Operator.q_plus else 'subl'
+        if isinstance(other, int):
+            output.append(x86.Instruction(mnemonic, x86.Immediate(other), variable))
+        else:
+            _munch_expression(other, addresses, output)
+            output.append(x86.Instruction(mnemonic, x86.EAX, variable))
+    else:
+        _munch_expression(value, addresses, output)
+        output.append(x86.Instruction('movl', x86.EAX, variable))
 
-def q_jmp(quad, output):
-    output.append(f'jmp {quad.operand_1}')
 
+def _munch_setelem(tree, addresses, output):
+    # The value is evaluated before the address, unless the index is a tree, then the value is a leaf and loading it
+    # does not overwrite the address registers.
+    value = tree.operand_1
+    value_type = _get_type(value)
+    if _is_leaf(tree.operand_2):
+        source = _munch_value(value, addresses, output)
+        address = _munch_element_address(tree.result, tree.operand_2, addresses, output)
+    else:
+        address = _munch_element_address(tree.result, tree.operand_2, addresses, output)
+        source = _munch_value(value, addresses, output)
+    if _is_vector(value_type):
+        mnemonic = _VECTOR_MOVES[_get_vector_kind(value_type)][0]
+    else:
+        mnemonic = 'movsd' if value_type == 'double' else 'movl'
+    output.append(x86.Instruction(mnemonic, source, address))
 
-def q_jmpifnot(quad, output):
-    value = _get_address(quad.symbol_table[quad.operand_2])
-    output.append(f'movl {value}, %ecx')
-    output.append(f'jecxz {quad.operand_1}')  # Jump if the ecx register is zero.
 
+def _munch_value(value, addresses, output):
+    # Evaluates the value into a register (or an immediate) of its type and returns it.
+    value_type = _get_type(value)
+    if _is_vector(value_type):
+        _munch_vector_expression(value, addresses, output)
+        return _VECTOR_REGISTERS[_get_vector_kind(value_type)[1]][0]
+    if value_type == 'double':
+        _munch_double_expression(value, addresses, output)
+        return x86.XMM0
+    if isinstance(value, int):
+        return x86.Immediate(value)
+    _munch_expression(value, addresses, output)
+    return x86.EAX
 
-def q_label(quad, output):
-    output.append(f'{quad.operand_1}:')
 
+def _munch_param(tree, addresses, output):
+    # Each parameter is pushed as 8 bytes to keep the stack pointer aligned to 8 bytes, only the lower 4 bytes are used
+    # (except for pointers). An array is passed as a pointer to its first element.
+    value = tree.operand_1
+    if isinstance(value, symtab.Array):
+        output.append(x86.Instruction('leaq', addresses[value], x86.RAX))
+        output.append(x86.Instruction('pushq', x86.RAX))
+    elif _is_leaf(value):
+        output.append(x86.Instruction('pushq', _get_operand(value, addresses)))
+    elif _get_type(value) == 'double':
+        _munch_double_expression(value, addresses, output)
+        output.append(x86.Instruction('subq', x86.Immediate(8), x86.RSP))
+        output.append(x86.Instruction('movsd', x86.XMM0, x86.Memory(0, x86.RSP)))
+    else:
+        _munch_expression(value, addresses, output)
+        output.append(x86.Instruction('pushq', x86.RAX))
 
-def q_return(quad, output):
-    value = _get_address(quad.symbol_table[quad.operand_2])
-    output.append(f'movl {value}, %eax')  # Move the return value to the return register (eax).
-    output.append(f'jmp {quad.operand_1}')  # Jump to the end of the function (epilogue).
 
+def _munch_call(tree, addresses, output):
+    output.append(x86.Instruction('call', tree.operand_1.name))  # Pushes the return address on the stack.
+    # Remove the parameters from the stack, multiply by 2 since each parameter is 8 byte aligned.
+    output.append(x86.Instruction('addq', x86.Immediate(tree.operand_2 * _SIZE_OF_INT * 2), x86.RSP))
+    if tree.result in addresses:  # The returned value is located in eax (or xmm0 for a double).
+        if tree.result.type == 'double':
+            output.append(x86.Instruction('movsd', x86.XMM0, addresses[tree.result]))
+        else:
+            output.append(x86.Instruction('movl', x86.EAX, addresses[tree.result]))
 
-@ft.singledispatch
-def _get_address(symbol):
+
+def _munch_jmp(tree, addresses, output):
+    output.append(x86.Instruction('jmp', tree.operand_1))
+
+
+def _munch_jmpif(tree, addresses, output):
+    _conditional_jump(tree, False, addresses, output)
+
+
+def _munch_jmpifnot(tree, addresses, output):
+    _conditional_jump(tree, True, addresses, output)
+
+
+def _conditional_jump(tree, jump_if_zero, addresses, output):
+    # The compare (or arithmetic) instruction is placed directly before the jump so that they can be macro-fused.
+    value = tree.operand_2
+    if isinstance(value, (int, float)):
+        if (value == 0) == jump_if_zero:
+            output.append(x86.Instruction('jmp', tree.operand_1))
+        return
+    condition = _munch_condition(value, addresses, output)
+    if jump_if_zero:
+        condition = _NEGATED_CONDITIONS[condition]
+    output.append(x86.Instruction(f'j{condition}', tree.operand_1))
+
+
+# Instructions that set the zero flag according to their result, making a following test instruction unnecessary.
+_SETS_ZERO_FLAG = ('addl', 'subl', 'negl')
+
+
+def _munch_label(tree, addresses, output):
+    output.append(x86.Label(tree.operand_1))
+
+
+def _munch_count(tree, addresses, output):
+    output.append(x86.Instruction('addq', x86.Immediate(1), x86.Memory(_counter_label(tree.operand_1), x86.RIP)))
+
+
+def _munch_return(tree, addresses, output):
+    # Move the return value to the return register (eax, or xmm0 for a double).
+    if _get_type(tree.operand_2) == 'double':
+        _munch_double_expression(tree.operand_2, addresses, output)
+    else:
+        _munch_expression(tree.operand_2, addresses, output)
+    output.append(x86.Instruction('jmp', tree.operand_1))  # Jump to the end of the function (epilogue).
+
+
+_STATEMENTS = {
+    icg.Operator.q_assign: _munch_assign,
+    icg.Operator.q_setelem: _munch_setelem,
+    icg.Operator.q_param: _munch_param,
+    icg.Operator.q_call: _munch_call,
+    icg.Operator.q_jmp: _munch_jmp,
+    icg.Operator.q_jmpif: _munch_jmpif,
+    icg.Operator.q_jmpifnot: _munch_jmpifnot,
+    icg.Operator.q_label: _munch_label,
+    icg.Operator.q_return: _munch_return,
+    icg.Operator.q_count: _munch_count,
+}
+
+
+def _get_address(symbol, frame, depth):
+    # Dispatched on the kind of symbol with isinstance rather than functools.singledispatch, whose registration imports
+    # the typing module (which is slow to import).
+    if isinstance(symbol, symtab.Parameter):
+        return _get_parameter_address(symbol, frame, depth)
+    if isinstance(symbol, symtab.Variable):
+        return _get_variable_address(symbol, frame, depth)
     raise NotImplementedError()
 
 
-@_get_address.register(symtab.Parameter)
-def _(symbol):
+def _get_parameter_address(symbol, frame, depth):
     # %rbp + 0: Previous stack frame pointer (i.e. rbp) [8 bytes].
     # %rbp + 8: Return address [8 bytes].
     # %rbp + 16: First parameter [4 bytes].
     # %rbp + 20: Alignment padding [4 bytes].
     # %rbp + 24: Second parameter [4 bytes].
     # %rbp + 28: Alignment padding [4 bytes].
-    offset = (symbol.index * _SIZE_OF_INT * 2) + 16  # Multiply by 2 since each parameter is 8 byte aligned.
-    return f'{offset}(%rbp)'
+    # Without a frame pointer the stack pointer is used instead, then the local variables, the return address and any
+    # parameters pushed for a function call are located between the stack pointer and the parameters.
+    offset = symbol.index * _SIZE_OF_INT * 2  # Multiply by 2 since each parameter is 8 byte aligned.
+    if frame.base is x86.RBP:
+        return x86.Memory(offset + 16, x86.RBP)
+    return x86.Memory(offset + depth + frame.allocated + 8, x86.RSP)
 
 
-@_get_address.register(symtab.Variable)
-def _(symbol):
+def _get_variable_address(symbol, frame, depth):
     # %rbp - 0: Previous stack frame pointer (i.e. rbp) [8 bytes].
-    # %rbp - 4: First local variable [4 bytes].
-    # %rbp - 8: Second local variable [4 bytes].
-    offset = (symbol.index + 1) * _SIZE_OF_INT
-    return f'-{offset}(%rbp)'
+    # %rbp - 4: First stack slot [4 bytes].
+    # %rbp - 8: Second stack slot [4 bytes].
+    # An array occupies one slot of all of its elements, the address is the address of the first element (the lowest
+    # address). Variables with non-overlapping live ranges share the same stack slot. Without a frame pointer the slots
+    # are addressed relative to the stack pointer instead. In leaf functions the slots might be located in the red
+    # zone, below the stack pointer.
+    if frame.base is x86.RBP:
+        return x86.Memory(-frame.offsets[symbol], x86.RBP)
+    return x86.Memory(depth + frame.allocated - frame.offsets[symbol], x86.RSP)
+
+
+class _Addresses(dict):
+    # The addresses of the symbols (at a certain stack depth), and the constant pool.
+    def __init__(self, addresses, constants):
+        super().__init__(addresses)
+        self.constants = constants
+
+
+class _ConstantPool:
+    # The double constants can't be immediate operands, instead each distinct constant of a function is stored once in
+    # the read-only data section and addressed relative to the instruction pointer. The constants are identified by
+    # their bit patterns (e.g. 0.0 and -0.0 are different constants).
+    def __init__(self, function_name):
+        self._function_name = function_name
+        self._labels = {}
+
+    def __getitem__(self, value):
+        bits = struct.unpack('<Q', struct.pack('<d', value))[0]
+        if bits not in self._labels:
+            self._labels[bits] = f'.L{self._function_name}.double{len(self._labels)}'
+        return x86.Memory(self._labels[bits], x86.RIP)
+
+    def emit(self, output):
+        if self._labels:
+            output.append('.section .rodata')
+            output.append('.align 8')
+            for bits, label in self._labels.items():
+                output.append(x86.Label(label))
+                output.append(f'.quad {bits:#x}')
+            output.append('.text')
+
+
+def _get_memo_table(function, body):
+    # A function without parameters has no arguments to look up, it is not memoized.
+    entries = next((quad.operand_1 for quad in body if quad.operator == icg.Operator.q_memoize), None)
+    return None if entries is None or not function.parameters else _MemoTable(function, entries)
+
+
+class _MemoTable:
+    # The memo table of a memoized function (see optimizer.memoize_recursive_functions), a fixed number of entries (a
+    # power of two) in the bss section, i.e. zero initialized without taking any space in the object file. An entry is
+    # 8 bytes per field, whether it is used, the arguments and the returned value. The entry of the arguments is
+    # selected by a multiplicative hash of their bits, a collision replaces the previous entry. On entry of the
+    # function the arguments are compared to the entry, if they match the value is returned directly. Otherwise the
+    # body is run and the arguments and the value are stored in the entry before the epilogue, which requires that the
+    # parameters are not assigned by the body. The scratch registers are free on entry, and on exit only the return
+    # register is used.
+    _HASH_MULTIPLIER = -0x61c8864f  # 2^32 divided by the golden ratio (0x9e3779b1), as a signed 32 bit immediate.
+
+    def __init__(self, function, entries):
+        self._function = function
+        self._shift = 32 - (entries.bit_length() - 1)  # Keeps the upper bits of the hash, which are the best mixed.
+        self._entry_size = (len(function.parameters) + 2) * 8
+        self._size = entries * self._entry_size
+        self._label = f'.L{function.name}.memo'
+
+    def emit_lookup(self, addresses, output):
+        miss = f'{self._label}.miss'
+        self._emit_entry_address(x86.EAX, x86.RAX, addresses, output)
+        output.append(x86.Instruction('cmpl', x86.Immediate(0), x86.Memory(0, x86.RCX)))
+        output.append(x86.Instruction('je', miss))
+        for offset, parameter in self._get_fields():
+            if parameter.type == 'double':
+                output.append(x86.Instruction('movq', addresses[parameter], x86.RDX))
+                output.append(x86.Instruction('cmpq', x86.RDX, x86.Memory(offset, x86.RCX)))
+            else:
+                output.append(x86.Instruction('movl', addresses[parameter], x86.EDX))
+                output.append(x86.Instruction('cmpl', x86.EDX, x86.Memory(offset, x86.RCX)))
+            output.append(x86.Instruction('jne', miss))
+        value = x86.Memory(self._entry_size - 8, x86.RCX)
+        if self._function.type == 'double':
+            output.append(x86.Instruction('movsd', value, x86.XMM0))
+        else:
+            output.append(x86.Instruction('movl', value, x86.EAX))
+        output.append(x86.Instruction('jmp', f'{self._label}.hit'))
+        output.append(x86.Label(miss))
+
+    def emit_store(self, addresses, output):
+        # The returned value is in eax (or xmm0 for a double).
+        self._emit_entry_address(x86.EDX, x86.RDX, addresses, output)
+        output.append(x86.Instruction('movl', x86.Immediate(1), x86.Memory(0, x86.RCX)))
+        for offset, parameter in self._get_fields():
+            if parameter.type == 'double':
+                output.append(x86.Instruction('movq', addresses[parameter], x86.RDX))
+                output.append(x86.Instruction('movq', x86.RDX, x86.Memory(offset, x86.RCX)))
+            else:
+                output.append(x86.Instruction('movl', addresses[parameter], x86.EDX))
+                output.append(x86.Instruction('movl', x86.EDX, x86.Memory(offset, x86.RCX)))
+        value = x86.Memory(self._entry_size - 8, x86.RCX)
+        if self._function.type == 'double':
+            output.append(x86.Instruction('movsd', x86.XMM0, value))
+        else:
+            output.append(x86.Instruction('movl', x86.EAX, value))
+        output.append(x86.Label(f'{self._label}.hit'))
+
+    def emit(self, output):
+        output.append('.bss')
+        output.append('.align 8')
+        output.append(x86.Label(self._label))
+        output.append(f'.zero {self._size}')
+        output.append('.text')
+
+    def _emit_entry_address(self, register, wide_register, addresses, output):
+        # The address of the entry of the arguments in rcx, the hash is computed in the given register. The (both
+        # halves of the) arguments are added to the hash, which is multiplied after each argument.
+        for index, parameter in enumerate(self._function.parameters):
+            address = addresses[parameter]
+            output.append(x86.Instruction('movl' if index == 0 else 'addl', address, register))
+            if parameter.type == 'double':
+                output.append(x86.Instruction('addl', x86.Memory(address.offset + 4, address.base), register))
+            output.append(x86.Instruction('imull', x86.Immediate(self._HASH_MULTIPLIER), register, register))
+        output.append(x86.Instruction('shrl', x86.Immediate(self._shift), register))
+        output.append(x86.Instruction('imull', x86.Immediate(self._entry_size), register, register))
+        output.append(x86.Instruction('leaq', x86.Memory(self._label, x86.RIP), x86.RCX))
+        output.append(x86.Instruction('addq', wide_register, x86.RCX))  # The upper half is cleared by the 32 bit ops.
+
+    def _get_fields(self):
+        # The offset of each argument in an entry, after the used field.
+        return [((index + 1) * 8, parameter) for index, parameter in enumerate(self._function.parameters)]
+
+
+class _StackFrame:
+    # Assigns a stack slot to each local variable and temporary of a function. The live range of a variable is
+    # approximated by the interval from its first to its last occurrence in the intermediate code (extended to cover
+    # loops, see below). Variables with non-overlapping live ranges are assigned to the same stack slot (using linear
+    # scan) so that the size of the stack frame is given by the maximum number of simultaneously live variables.
+    # A leaf function (that does not call any other function) does not need to allocate its stack frame if it fits in
+    # the red zone. Without a frame pointer the stack pointer is used as base for all addresses.
+    def __init__(self, statements, omit_frame_pointer):
+        self._offsets = {}
+        self._size = 0
+        self._allocate(self._get_live_ranges(statements))
+        size = _get_next_multiple(self._size, 8)  # 8 bytes aligned.
+        is_leaf = all(statement.operator != icg.Operator.q_call for statement in statements)
+        self._allocated = 0 if is_leaf and size <= _RED_ZONE_SIZE else size
+        self._base = x86.RSP if omit_frame_pointer else x86.RBP
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def allocated(self):
+        return self._allocated
+
+    @property
+    def base(self):
+        return self._base
+
+    @staticmethod
+    def _get_live_ranges(statements):
+        live_ranges = {}
+        labels = {}
+        jumps = []
+        arguments = []
+        for index, quad in enumerate(statements):
+            if quad.operator == icg.Operator.q_label:
+                labels[quad.operand_1] = index
+            elif quad.operator in (icg.Operator.q_jmp, icg.Operator.q_jmpif, icg.Operator.q_jmpifnot):
+                jumps.append((index, quad.operand_1))
+            elif quad.operator == icg.Operator.q_param and isinstance(quad.operand_1, symtab.Array):
+                arguments.append(quad.operand_1)
+            elif quad.operator == icg.Operator.q_call:
+                # An array is passed as its address, the called function uses its memory until the call returns.
+                for array in arguments:
+                    live_ranges[array] = (live_ranges[array][0], index)
+                arguments = []
+            for variable in _get_variables(quad):
+                start, end = live_ranges.get(variable, (index, index))
+                live_ranges[variable] = (min(start, index), max(end, index))
+        # A jump backwards forms a loop, a variable that is live somewhere in the loop and also outside of it (or that
+        # might be used before it is assigned in the loop) must be kept alive during the whole loop. A temporary that
+        # is contained in the loop is always assigned before it is used so it does not need to be extended.
+        loops = [(labels[label], index) for index, label in jumps if labels[label] < index]
+        changed = True
+        while changed:
+            changed = False
+            for variable, (start, end) in live_ranges.items():
+                for loop_start, loop_end in loops:
+                    overlaps = start <= loop_end and end >= loop_start
+                    contained = loop_start <= start and end <= loop_end
+                    if overlaps and not (contained and isinstance(variable, symtab.Temporary)):
+                        extended = (min(start, loop_start), max(end, loop_end))
+                        if extended != (start, end):
+                            start, end = extended
+                            live_ranges[variable] = extended
+                            changed = True
+        return live_ranges
+
+    def _allocate(self, live_ranges):
+        free_slots = {}
+        active = []
+        for variable, (start, end) in sorted(live_ranges.items(), key=lambda item: item[1]):
+            # A slot is only reused when the previous live range ended before the current starts, since a quadruple
+            # might write its result before all of its operands have been read.
+            for expired in [item for item in active if item[0] < start]:
+                active.remove(expired)
+                free_slots.setdefault(expired[1], []).append(expired[2])
+            size = _get_size(variable)
+            slots = free_slots.get(size)
+            if slots:
+                offset = slots.pop()
+            else:
+                self._size = _get_next_multiple(self._size, min(size, 8)) + size
+                offset = self._size
+            self._offsets[variable] = offset
+            active.append((end, size, offset))
+
+
+def _get_size(variable):
+    if isinstance(variable, symtab.Array):
+        return variable.length * _SIZES[variable.element_type]
+    if _is_vector(variable.type):
+        return _get_vector_kind(variable.type)[1]
+    return _SIZES[variable.type]
+
+
+def _get_variables(tree):
+    for operand in (tree.operand_1, tree.operand_2, tree.result):
+        if isinstance(operand, _Tree):
+            yield from _get_variables(operand)
+        elif isinstance(operand, symtab.Variable):
+            yield operand
+
+
+def _wrap(value):
+    # Integer arithmetic wraps around at 32 bits, a constant out of the range of an int has the same lower 32 bits.
+    return ((value + 2 ** 31) & 0xffffffff) - 2 ** 31
 
 
 def _get_next_multiple(number, multiple):
@@ -0,0 +1,174 @@
+"""
+The x86-64 instructions and operands of the sea sub compiler (AT&T syntax).
+"""
+
+
+class Register:
+    def __init__(self, name):
+        self._name = name
+
+    def __repr__(self):
+        return f"Register({self._name})"
+
+    def __str__(self):
+        return f'%{self._name}'
+
+    def __eq__(self, other):
+        return isinstance(other, Register) and self._name == other._name
+
+    def __hash__(self):
+        return hash(self._name)
+
+    @property
+    def name(self):
+        return self._name
+
+
+class Immediate:
+    def __init__(self, value):
+        self._value = value
+
+    def __repr__(self):
+        return f"Immediate({self._value})"
+
+    def __str__(self):
+        return f'${self._value}'
+
+    @property
+    def value(self):
+        return self._value
+
+
+class Memory:
+    def __init__(self, offset, base, index=None, scale=1):
+        self._offset = offset
+        self._base = base
+        self._index = index
+        self._scale = scale
+
+    def __repr__(self):
+        return f"Memory({self._offset}, {self._base!r}, {self._index!r}, {self._scale})"
+
+    def __str__(self):
+        offset = self._offset if self._offset else ''
+        if self._index is None:
+            return f'{offset}({self._base})'
+        return f'{offset}({self._base},{self._index},{self._scale})'
+
+    def __eq__(self, other):
+        return (isinstance(other, Memory) and
+                (self._offset, self._base, self._index, self._scale) ==
+                (other._offset, other._base, other._index, other._scale))
+
+    def __hash__(self):
+        return hash((self._offset, self._base, self._index, self._scale))
+
+    @property
+    def offset(self):
+        return self._offset
+
+    @property
+    def base(self):
+        return self._base
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def scale(self):
+        return self._scale
+
+
+class Instruction:
+    def __init__(self, mnemonic, *operands):
+        self._mnemonic = mnemonic
+        self._operands = operands
+
+    def __repr__(self):
+        return f"Instruction({self._mnemonic}, {self._operands})"
+
+    def __str__(self):
+        if not self._operands:
+            return self._mnemonic
+        return f"{self._mnemonic} {', '.join(str(operand) for operand in self._operands)}"
+
+    @property
+    def mnemonic(self):
+        return self._mnemonic
+
+    @property
+    def operands(self):
+        return self._operands
+
+
+class Label:
+    def __init__(self, name):
+        self._name = name
+
+    def __repr__(self):
+        return f"Label({self._name})"
+
+    def __str__(self):
+        return f'{self._name}:'
+
+    @property
+    def name(self):
+        return self._name
+
+
+AL = Register('al')
+DL = Register('dl')
+EAX = Register('eax')
+ECX = Register('ecx')
+EDX = Register('edx')
+ESI = Register('esi')
+EDI = Register('edi')
+RAX = Register('rax')
+RCX = Register('rcx')
+RDX = Register('rdx')
+RSI = Register('rsi')
+RDI = Register('rdi')
+R8 = Register('r8')
+R9 = Register('r9')
+RSP = Register('rsp')
+RBP = Register('rbp')
+RIP = Register('rip')
+XMM0 = Register('xmm0')
+XMM1 = Register('xmm1')
+XMM2 = Register('xmm2')
+XMM3 = Register('xmm3')
+XMM4 = Register('xmm4')
+XMM5 = Register('xmm5')
+XMM6 = Register('xmm6')
+XMM7 = Register('xmm7')
+YMM0 = Register('ymm0')
+YMM1 = Register('ymm1')
+
+
+# The instruction set extensions of each target architecture (as in gcc's -march), the x86-64 baseline includes SSE2.
+ARCHITECTURES = {'x86-64': ('sse', 'sse2'),
+                 'avx2': ('sse', 'sse2', 'avx', 'avx2')}
+
+
+def get_features(architecture):
+    # The features are only decided at compile time, the generated code does not check them at run time. The 'native'
+    # architecture has the features of the machine running the compiler.
+    if architecture == 'native':
+        return _detect_features()
+    return frozenset(ARCHITECTURES[architecture])
+
+
+def get_vector_size(features):
+    # The size (in bytes) of the vector registers.
+    return 32 if 'avx2' in features else 16
+
+
+def _detect_features():
+    known = set(feature for features in ARCHITECTURES.values() for feature in features)
+    try:
+        with open('/proc/cpuinfo', 'r') as file:
+            flags = next((line.split(':', 1)[1].split() for line in file if line.startswith('flags')), [])
+    except OSError:
+        flags = []
+    return frozenset(ARCHITECTURES['x86-64']) | (known & set(flags))
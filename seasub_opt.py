@@ -0,0 +1,52 @@
+"""
+The sea sub optimizer entry point.
+
+Runs selected optimization passes on intermediate code, e.g. as saved by the compiler (--save-intermediate-code), which
+lets the passes be run, measured and compared in isolation without the front end.
+"""
+import os
+
+import argparse
+import pathlib
+
+from seasub import optimizer as opt
+from seasub import pass_manager as pm
+
+
+def main():
+    code_passes = {name: code_pass for name, code_pass in opt.PASSES.items() if code_pass.level != pm.TREE}
+    default_passes = ','.join(name for name in pm.PIPELINES[1][1] if name in code_passes)  # As optimization level 1.
+    passes_help = "\n".join(f"\t{name}: {code_pass.description}" for name, code_pass in code_passes.items())
+    parser = argparse.ArgumentParser(description="Runs optimization passes on the intermediate code of the Sea Sub "
+                                                 "(C subset) compiler.",
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('input', type=pathlib.Path, help="the intermediate code file (.ic)")
+    parser.add_argument('-p', '--passes', default=default_passes, metavar='NAME[,NAME...]',
+                        help=f"the passes to run, in order (default {default_passes}, none if empty)\n{passes_help}")
+    parser.add_argument('-o', dest='output', type=pathlib.Path,
+                        help=("the output file, intermediate code (.ic), assembly (.s) or an (ELF) object file (.o)\n"
+                              "(default the input file with '.s' ending)"))
+    parser.add_argument('--omit-frame-pointer', action='store_true',
+                        help="address the stack frame relative to the stack pointer instead of a frame pointer")
+    parser.add_argument('-j', dest='jobs', type=int, metavar='N', default=1,
+                        help="optimize the functions in N parallel processes (default 1, 0 uses all processors)")
+    parser.add_argument('--pass-stats', action='store_true',
+                        help=("print the time spent, the number of quadruples changed and the size of the code before\n"
+                              "and after each pass"))
+    args = parser.parse_args()
+    passes = [name for name in args.passes.split(',') if name]
+    for name in passes:
+        if name not in code_passes:
+            parser.error(f"unknown pass '{name}' (expected {', '.join(code_passes)})")
+    output = args.output or pathlib.Path(f'{os.path.splitext(args.input)[0]}.s')
+    if output.suffix not in ('.ic', '.s', '.o'):
+        parser.error(f"unknown output format of '{output}' (expected .ic, .s or .o)")
+    if output.resolve() == args.input.resolve():
+        parser.error("the output file can't be the input file")
+    from seasub import seasub
+    seasub.run_passes(args.input, output, passes, omit_frame_pointer=args.omit_frame_pointer, jobs=args.jobs,
+                      pass_stats=args.pass_stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Builds the sea sub compiler into a single file (zip) application, that can be run as e.g. python seasub.pyz demo.c.
+
+The modules are stored both as source and precompiled, since the modules imported from a zip file are never cached and
+would otherwise be compiled each time the application is started.
+"""
+import argparse
+import pathlib
+import py_compile
+import shutil
+import tempfile
+import zipapp
+
+_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the sea sub compiler into a single file application.")
+    parser.add_argument('-o', dest='output', type=pathlib.Path, default=pathlib.Path('seasub.pyz'),
+                        help="the application file (default seasub.pyz)")
+    args = parser.parse_args()
+    build(args.output)
+
+
+def build(output_path):
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        (directory / 'seasub').mkdir()
+        sources = [_ROOT / 'main.py', *sorted((_ROOT / 'seasub').glob('*.py'))]
+        for source in sources:
+            target = directory / source.relative_to(_ROOT)
+            shutil.copyfile(source, target)
+            # The zip importer only finds the compiled module next to its source (not in __pycache__), and can't check
+            # the time stamp of the source reliably, the compiled modules are therefore not checked against the source.
+            py_compile.compile(target, cfile=target.with_suffix('.pyc'), dfile=str(source.relative_to(_ROOT)),
+                               doraise=True, invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        zipapp.create_archive(directory, output_path, interpreter='/usr/bin/env python3', main='main:main')
+
+
+if __name__ == "__main__":
+    main()
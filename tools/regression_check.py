@@ -0,0 +1,44 @@
+"""
+Checks the sea sub compiler against the programs of known bugs.
+
+Each program is run by the intermediate code interpreter (at optimization level 0) and compiled into memory and run
+(see seasub.execute) at each optimization level, with and without the frame pointer. The values returned by main must
+be equal. The program is also compiled into an object file, which must succeed. Exits with an error if any check fails.
+Needs an x86-64 Linux host (to run the compiled programs).
+"""
+import argparse
+import pathlib
+import sys
+
+_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(_ROOT))
+
+from seasub import seasub  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the sea sub compiler against the programs of known bugs.")
+    parser.add_argument('inputs', type=pathlib.Path, nargs='*', help="the programs (default tools/regressions/*.c)",
+                        default=sorted((_ROOT / 'tools' / 'regressions').glob('*.c')))
+    args = parser.parse_args()
+    failures = 0
+    for path in args.inputs:
+        expected = seasub.interpret(path, 0)
+        for optimization_level in (0, 1, 2):
+            for omit_frame_pointer in (False, True):
+                value = seasub.execute(path, optimization_level, omit_frame_pointer)
+                if value != expected:
+                    failures += 1
+                    frame = ' --omit-frame-pointer' if omit_frame_pointer else ''
+                    print(f"{path.name}: -o {optimization_level}{frame} returned {value} (expected {expected})")
+        compilation = seasub.compile_source(path.read_text(), 2, path.name, output_format='object')
+        if not compilation.succeeded:
+            failures += 1
+            print(f"{path.name}: the object file could not be compiled")
+        print(f"{path.name}: {expected}")
+    if failures:
+        sys.exit(f"Error: {failures} checks failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+int reverse(int a[], int b[], int n)
+{
+    int i;
+    i = 0;
+    while (i < n)
+    {
+        a[i] = b[n - 1 - i];
+        i = i + 1;
+    }
+    return a[0] * 10 + a[n - 1];
+}
+
+int main(int argc)
+{
+    int a[8];
+    int b[8];
+    int i;
+    i = 0;
+    while (i < 8)
+    {
+        b[i] = i + 3;
+        i = i + 1;
+    }
+    return reverse(a, b, 8);
+}
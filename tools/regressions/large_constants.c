@@ -0,0 +1,11 @@
+int f(int a)
+{
+    return a - 2999999990;
+}
+
+int main(int argc)
+{
+    int x;
+    x = 3000000000;
+    return f(3000000000) + x - 2999999990 + argc * 5000000000;
+}
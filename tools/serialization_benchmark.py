@@ -0,0 +1,64 @@
+"""
+Compares the serialization of the sea sub compiler with pickle.
+
+The syntax tree (as analyzed, so that pickle also stores the scopes and symbols it refers to), the symbol table and the
+intermediate code of a program are serialized in both formats, the median time to dump and load them and the size of
+the data are reported.
+"""
+import argparse
+import pathlib
+import pickle
+import statistics
+import sys
+import time
+
+_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(_ROOT))
+
+from seasub import error_handler as err  # noqa: E402
+from seasub import seasub  # noqa: E402
+from seasub import serialization  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the serialization of the sea sub compiler with pickle.")
+    parser.add_argument('input', type=pathlib.Path, help="the program (default demo.c)", nargs='?',
+                        default=_ROOT / 'demo.c')
+    parser.add_argument('-n', dest='runs', type=int, default=10, help="the number of runs of each step (default 10)")
+    parser.add_argument('-o', dest='optimization_level', type=int, default=1,
+                        help="the optimization level of the intermediate code (default 1)")
+    args = parser.parse_args()
+    sys.setrecursionlimit(100000)  # Pickle recurses through the (deep) syntax tree.
+    abstract_syntax_tree, symbol_table, errors = seasub._analyze_source(args.input.read_text(), str(args.input), 1)
+    with seasub._get_workers(1, abstract_syntax_tree.functions) as workers:
+        intermediate_code, _ = seasub._generate_intermediate_code(abstract_syntax_tree, args.optimization_level,
+                                                                  'x86-64', None, None, workers, err.ErrorLog())
+    structures = {
+        'syntax tree': (abstract_syntax_tree, serialization.dump_syntax_tree, serialization.load_syntax_tree),
+        'symbol table': (symbol_table, serialization.dump_symbol_table, serialization.load_symbol_table),
+        'intermediate code': (intermediate_code, serialization.dump_intermediate_code,
+                              serialization.load_intermediate_code),
+    }
+    print(f"{'structure':<20} {'format':<8} {'dump':>10} {'load':>10} {'size':>12}")
+    for name, (structure, dump, load) in structures.items():
+        for format_name, format_dump, format_load in (('seasub', dump, load), ('pickle', pickle.dumps, pickle.loads)):
+            dump_time, data = _measure(format_dump, structure, args.runs)
+            load_time, _ = _measure(format_load, data, args.runs)
+            print(f"{name:<20} {format_name:<8} {_format(dump_time):>10} {_format(load_time):>10} {len(data):>12,}")
+
+
+def _measure(function, argument, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(argument)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def _format(seconds):
+    return f'{seconds * 1000:.1f} ms'
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Measures the start up time of the sea sub compiler.
+
+Each command is run a number of times in a new process, the median wall time is reported together with the overhead,
+i.e. the time over the start up of the Python interpreter itself. Exits with an error if the overhead of importing the
+compiler is above the budget.
+"""
+import argparse
+import pathlib
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the start up time of the sea sub compiler.")
+    parser.add_argument('-n', dest='runs', type=int, default=20, help="the number of runs of each command (default 20)")
+    parser.add_argument('--budget', type=float, default=50.0,
+                        help="the maximum overhead of importing the compiler in milliseconds (default 50)")
+    parser.add_argument('--zipapp', type=pathlib.Path, help="also measure a single file application (see build_zipapp)")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        source = pathlib.Path(directory) / 'demo.c'
+        shutil.copyfile(_ROOT / 'demo.c', source)
+        applications = {'main.py': [sys.executable, str(_ROOT / 'main.py')]}
+        imports = {'main.py': [sys.executable, '-c', 'import seasub.seasub']}
+        if args.zipapp:
+            zipapp = str(args.zipapp.resolve())
+            applications['zipapp'] = [sys.executable, zipapp]
+            imports['zipapp'] = [sys.executable, '-c', f'import sys; sys.path.insert(0, {zipapp!r}); import seasub.seasub']
+        baseline = _measure([sys.executable, '-c', 'pass'], args.runs)
+        print(f"{'command':<40} {'median':>10} {'overhead':>10}")
+        print(f"{'python':<40} {_format(baseline):>10}")
+        over_budget = False
+        for name, command in applications.items():
+            for arguments in (['--help'], ['-o', '0', str(source)], [str(source)]):
+                median = _measure([*command, *arguments], args.runs)
+                label = f"{name} {' '.join(arguments).replace(str(source), 'demo.c')}"
+                print(f"{label:<40} {_format(median):>10} {_format(median - baseline):>10}")
+            median = _measure(imports[name], args.runs)
+            overhead = median - baseline
+            over_budget |= overhead * 1000 > args.budget
+            print(f"{f'{name} import seasub.seasub':<40} {_format(median):>10} {_format(overhead):>10}")
+    if over_budget:
+        sys.exit(f"Error: The import overhead is above the budget of {args.budget} ms")
+
+
+def _measure(command, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=_ROOT, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def _format(seconds):
+    return f'{seconds * 1000:.1f} ms'
+
+
+if __name__ == "__main__":
+    main()